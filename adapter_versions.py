@@ -0,0 +1,165 @@
+"""
+Date-versioned LoRA adapters for continual training, with rollback.
+
+Every training run publishes its adapter as a new version instead of
+overwriting artifacts/lora. The current version is also copied to the top of
+ADAPTER_ROOT, which is what merge_and_convert.py and the agent load, so
+switching versions (rollback) is a file copy, no retraining.
+
+Each version records the rows it has been trained on (seen.npy, sorted
+sft_shards row keys, inherited from its parent), so the next continual run
+can train only on rows that are new plus a replay sample of old ones.
+Rolling back also rolls back that ledger: rows first trained by the
+discarded version count as new again.
+
+Layout of ADAPTER_ROOT:
+    versions/<YYYY-MM-DD>[_HHMMSS]/   adapter + tokenizer files, version.json, seen.npy
+    current.json                     {"version", "files"}
+    adapter_config.json, ...         copy of the current version's files
+"""
+
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+ADAPTER_ROOT = os.getenv("ADAPTER_ROOT", "artifacts/lora")
+ADAPTER_KEEP_VERSIONS = int(os.getenv("ADAPTER_KEEP_VERSIONS", "14"))
+_VERSION_META = ("version.json", "seen.npy")
+
+
+def versions_dir(root: str = ADAPTER_ROOT) -> Path:
+    return Path(root) / "versions"
+
+
+def list_versions(root: str = ADAPTER_ROOT) -> List[str]:
+    """Published versions, oldest first (names sort chronologically)."""
+    base = versions_dir(root)
+    if not base.exists():
+        return []
+    # Dot-prefixed dirs are unpublished staging dirs
+    return sorted(p.name for p in base.iterdir() if not p.name.startswith(".") and (p / "version.json").exists())
+
+
+def read_version(name: str, root: str = ADAPTER_ROOT) -> Dict[str, Any]:
+    with open(versions_dir(root) / name / "version.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def current_version(root: str = ADAPTER_ROOT) -> Optional[str]:
+    path = Path(root) / "current.json"
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        name = json.load(f).get("version")
+    return name if name in list_versions(root) else None
+
+
+def load_seen(name: Optional[str], root: str = ADAPTER_ROOT) -> np.ndarray:
+    """Sorted int64 row keys trained on up to and including version `name`."""
+    path = versions_dir(root) / name / "seen.npy" if name else None
+    if path is None or not path.exists():
+        return np.empty(0, dtype=np.int64)
+    return np.load(path)
+
+
+def new_version_name(root: str = ADAPTER_ROOT) -> str:
+    now = datetime.now()
+    name = now.strftime("%Y-%m-%d")
+    if (versions_dir(root) / name).exists():
+        name = now.strftime("%Y-%m-%d_%H%M%S")
+    suffix = 1
+    while (versions_dir(root) / name).exists():
+        suffix += 1
+        name = f"{now.strftime('%Y-%m-%d_%H%M%S')}_{suffix}"
+    return name
+
+
+def activate(name: str, root: str = ADAPTER_ROOT) -> None:
+    """Make `name` the current version: copy its files to ADAPTER_ROOT and update current.json."""
+    source = versions_dir(root) / name
+    if not (source / "version.json").exists():
+        raise ValueError(f"Unknown adapter version: {name}")
+    root_path = Path(root)
+    pointer = root_path / "current.json"
+    previous_files: List[str] = []
+    if pointer.exists():
+        with open(pointer, "r", encoding="utf-8") as f:
+            previous_files = json.load(f).get("files", [])
+
+    files = sorted(p.name for p in source.iterdir() if p.is_file() and p.name not in _VERSION_META)
+    for file_name in files:
+        shutil.copy2(source / file_name, root_path / file_name)
+    for file_name in set(previous_files) - set(files):
+        (root_path / file_name).unlink(missing_ok=True)
+
+    tmp = pointer.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": name, "files": files, "activated_at": datetime.now().isoformat()}, f, indent=2)
+    os.replace(tmp, pointer)
+
+
+def publish(
+    staging_dir: str,
+    meta: Dict[str, Any],
+    seen: np.ndarray,
+    root: str = ADAPTER_ROOT,
+    keep: int = ADAPTER_KEEP_VERSIONS,
+) -> str:
+    """
+    Move a saved adapter (staging_dir) into versions/, record meta and the seen
+    ledger, make it current and prune old versions. Returns the version name.
+    """
+    name = meta.get("version") or new_version_name(root)
+    target = versions_dir(root) / name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    np.save(Path(staging_dir) / "seen.npy", np.unique(np.asarray(seen, dtype=np.int64)))
+    with open(Path(staging_dir) / "version.json", "w", encoding="utf-8") as f:
+        json.dump({**meta, "version": name, "created_at": datetime.now().isoformat()}, f, indent=2)
+    os.replace(staging_dir, target)
+    activate(name, root)
+    prune(root, keep)
+    return name
+
+
+def rollback(to: Optional[str] = None, root: str = ADAPTER_ROOT) -> str:
+    """
+    Re-activate version `to`, or by default the current version's parent
+    (the adapter it was trained from), falling back to the previous version
+    by date. Later versions are kept, so a rollback can itself be undone.
+    """
+    versions = list_versions(root)
+    current = current_version(root)
+    if to is None:
+        if current is None:
+            raise ValueError("No current adapter version to roll back from")
+        parent = read_version(current, root).get("parent")
+        if parent in versions:
+            to = parent
+        else:
+            older = [v for v in versions if v < current]
+            if not older:
+                raise ValueError(f"No version older than {current}")
+            to = older[-1]
+    activate(to, root)
+    return to
+
+
+def prune(root: str = ADAPTER_ROOT, keep: int = ADAPTER_KEEP_VERSIONS) -> List[str]:
+    """Delete the oldest versions beyond `keep`, never the current one or its parent."""
+    versions = list_versions(root)
+    current = current_version(root)
+    protected = {current}
+    if current:
+        protected.add(read_version(current, root).get("parent"))
+    removed = []
+    for name in versions[:max(len(versions) - keep, 0)]:
+        if name not in protected:
+            shutil.rmtree(versions_dir(root) / name)
+            removed.append(name)
+    return removed
@@ -0,0 +1,33 @@
+"""add updated_at to knowledge_base
+
+Revision ID: 3f9d2b7c4e1a
+Revises: abec6df8c121
+Create Date: 2025-09-22 09:14:37.502113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9d2b7c4e1a'
+down_revision: Union[str, Sequence[str], None] = 'abec6df8c121'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Add updated_at (backfilled from created_at) for incremental ES sync."""
+    op.add_column(
+        'knowledge_base',
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    )
+    op.execute("UPDATE knowledge_base SET updated_at = COALESCE(created_at, now())")
+    op.create_index(op.f('ix_knowledge_base_updated_at'), 'knowledge_base', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_knowledge_base_updated_at'), table_name='knowledge_base')
+    op.drop_column('knowledge_base', 'updated_at')
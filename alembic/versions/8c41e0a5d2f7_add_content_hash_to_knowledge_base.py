@@ -0,0 +1,78 @@
+"""add content_hash to knowledge_base
+
+Revision ID: 8c41e0a5d2f7
+Revises: 3f9d2b7c4e1a
+Create Date: 2025-09-23 10:02:51.884310
+
+"""
+import hashlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c41e0a5d2f7'
+down_revision: Union[str, Sequence[str], None] = '3f9d2b7c4e1a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+BATCH_SIZE = 1000
+
+
+def _content_hash(content: str) -> str:
+    # Frozen copy of models.compute_content_hash so the migration never drifts
+    return hashlib.md5((content or "").strip().lower().encode("utf-8")).hexdigest()
+
+
+def upgrade() -> None:
+    """Add content_hash, backfill it, retire duplicate active rows, then add the unique partial index."""
+    op.add_column('knowledge_base', sa.Column('content_hash', sa.String(length=32), nullable=True))
+
+    # Backfill in Python so the hash matches the application exactly
+    # (str.strip/str.lower differ from btrim/lower on some inputs).
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.text("SELECT id, content FROM knowledge_base WHERE id > :last ORDER BY id LIMIT :n"),
+            {"last": last_id, "n": BATCH_SIZE},
+        ).all()
+        if not rows:
+            break
+        conn.execute(
+            sa.text("UPDATE knowledge_base SET content_hash = :h WHERE id = :id"),
+            [{"h": _content_hash(content), "id": row_id} for row_id, content in rows],
+        )
+        last_id = rows[-1][0]
+
+    # Keep the oldest active row per hash; deactivate the rest so the index can be built.
+    # updated_at is bumped so the next incremental ES sync removes them too.
+    result = conn.execute(sa.text(
+        """
+        UPDATE knowledge_base kb
+        SET is_active = false, updated_at = now()
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY content_hash ORDER BY id) AS rn
+            FROM knowledge_base
+            WHERE is_active
+        ) d
+        WHERE kb.id = d.id AND d.rn > 1
+        """
+    ))
+    print(f"Deactivated {result.rowcount} duplicate knowledge_base rows")
+
+    op.create_index(
+        'ix_knowledge_base_content_hash_active',
+        'knowledge_base',
+        ['content_hash'],
+        unique=True,
+        postgresql_where=sa.text('is_active'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_knowledge_base_content_hash_active', table_name='knowledge_base')
+    op.drop_column('knowledge_base', 'content_hash')
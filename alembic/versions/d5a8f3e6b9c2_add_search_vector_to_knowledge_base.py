@@ -0,0 +1,52 @@
+"""add full-text search_vector to knowledge_base
+
+Revision ID: d5a8f3e6b9c2
+Revises: 8c41e0a5d2f7
+Create Date: 2025-09-25 15:41:08.217694
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a8f3e6b9c2'
+down_revision: Union[str, Sequence[str], None] = '8c41e0a5d2f7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Generated tsvector (title weighted A, content B) with GIN, plus pg_trgm on title for fuzzy search."""
+    # 'simple' config: no stemming, so Vietnamese and English text are both tokenized the same way
+    op.execute(
+        """
+        ALTER TABLE knowledge_base
+        ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(content, '')), 'B')
+        ) STORED
+        """
+    )
+    op.create_index(
+        'ix_knowledge_base_search_vector',
+        'knowledge_base',
+        ['search_vector'],
+        postgresql_using='gin',
+    )
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index(
+        'ix_knowledge_base_title_trgm',
+        'knowledge_base',
+        ['title'],
+        postgresql_using='gin',
+        postgresql_ops={'title': 'gin_trgm_ops'},
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_knowledge_base_title_trgm', table_name='knowledge_base')
+    op.drop_index('ix_knowledge_base_search_vector', table_name='knowledge_base')
+    op.drop_column('knowledge_base', 'search_vector')
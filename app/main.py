@@ -1,22 +1,47 @@
+import asyncio
+import base64
+import hashlib
+import json
 import os
-from typing import Optional, List, Dict, Any
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Any, Literal
 
+import httpx
+import openai
 from dotenv import load_dotenv
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+from sqlalchemy import Float, and_, cast, func, or_, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from database import get_db
-from lm_client import LMStudioClient
+from database import get_db, SessionLocal
+from lm_client import LMStudioClient, get_async_lm_client, close_async_lm_client
 from models import ChatHistory, KnowledgeBase
+from es_client import close_async_es_client, close_es_client
 from es_search_service import es_search_service
+from kb_scan import scan_knowledge_base
+from rag import retrieve_context, build_system_prompt, search_semantic_passages
+from response_cache import build_response_cache
 
 
 load_dotenv()
 
-app = FastAPI(title="Hannah AI - LM Studio")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_async_lm_client()
+    yield
+    await close_async_lm_client()
+    await close_async_es_client()
+    close_es_client()
+
+
+app = FastAPI(title="Hannah AI - LM Studio", lifespan=lifespan)
 
 # CORS for local UI and tools
 app.add_middleware(
@@ -44,6 +69,7 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     history_id: int
+    cached: bool = False
 
 
 def get_lm_client() -> LMStudioClient:
@@ -52,30 +78,159 @@ def get_lm_client() -> LMStudioClient:
     return LMStudioClient(base_url=base_url, api_key=api_key)
 
 
+async def _embed_question(text: str) -> List[float]:
+    model = os.getenv("LMSTUDIO_EMBEDDING_MODEL", "")
+    return (await get_async_lm_client().embed(model, [text]))[0]
+
+
+# Semantic matching is only enabled when an embedding model is configured
+response_cache = build_response_cache(
+    embed_fn=_embed_question if os.getenv("LMSTUDIO_EMBEDDING_MODEL") else None
+)
+
+
+def build_chat_messages(req: ChatRequest, context: Optional[str] = None) -> List[Dict[str, Any]]:
+    return [
+        {"role": "system", "content": build_system_prompt(context)},
+        {"role": "user", "content": req.message},
+    ]
+
+
+def save_chat_history(
+    req: ChatRequest,
+    answer: str,
+    context_used: Optional[str] = None,
+    review_notes: Optional[str] = None,
+) -> int:
+    """Persist one ChatHistory row and return its id (runs in the threadpool)."""
+    db = SessionLocal()
+    try:
+        history = ChatHistory(
+            user_id=req.user_id,
+            session_id=req.session_id,
+            question=req.message,
+            answer=answer,
+            context_used=context_used,
+            rating=req.rating,
+            review_notes=review_notes,
+        )
+        db.add(history)
+        db.commit()
+        db.refresh(history)
+        return history.id
+    finally:
+        db.close()
+
+
 @app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest, db: Session = Depends(get_db)):
+async def chat(req: ChatRequest):
     model_name = os.getenv("LMSTUDIO_MODEL", "microsoft/phi-4-mini-reasoning")
-    client = get_lm_client()
-    answer = client.chat(
-        model=model_name,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": req.message},
-        ],
-        temperature=req.temperature,
-    )
+    context = await retrieve_context(req.message)
+
+    if response_cache is not None:
+        hit = await response_cache.lookup(req.message, model_name, req.temperature, context)
+        if hit is not None:
+            history_id = await run_in_threadpool(save_chat_history, req, hit["answer"], context)
+            return ChatResponse(answer=hit["answer"], history_id=history_id, cached=True)
+
+    client = get_async_lm_client()
+    try:
+        answer = await client.chat(
+            model=model_name,
+            messages=build_chat_messages(req, context),
+            temperature=req.temperature,
+            timeout=float(os.getenv("CHAT_REQUEST_TIMEOUT", "120")),
+        )
+    except openai.APITimeoutError:
+        raise HTTPException(status_code=504, detail="LM Studio timed out")
+    except openai.APIConnectionError as e:
+        raise HTTPException(status_code=502, detail=f"LM Studio unavailable: {str(e)}")
+
+    if response_cache is not None:
+        await response_cache.store(req.message, model_name, req.temperature, answer, context)
+
+    history_id = await run_in_threadpool(save_chat_history, req, answer, context)
+    return ChatResponse(answer=answer, history_id=history_id)
+
 
-    history = ChatHistory(
-        user_id=req.user_id,
-        session_id=req.session_id,
-        question=req.message,
-        answer=answer,
-        rating=req.rating,
+@app.get("/chat/cache/stats")
+def chat_cache_stats():
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.get_stats()}
+
+
+def _sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    Stream the answer as Server-Sent Events.
+
+    Emits `data: {"delta": ...}` per token chunk, then `event: done` with the
+    history_id once the ChatHistory row is written. If the client disconnects
+    or LM Studio fails mid-generation, whatever was generated so far is saved
+    as a partial answer; on failure the client gets `event: error` (with the
+    partial answer's history_id, if any).
+    """
+    model_name = os.getenv("LMSTUDIO_MODEL", "microsoft/phi-4-mini-reasoning")
+    client = get_async_lm_client()
+
+    async def event_stream():
+        context = await retrieve_context(req.message)
+
+        if response_cache is not None:
+            hit = await response_cache.lookup(req.message, model_name, req.temperature, context)
+            if hit is not None:
+                history_id = await run_in_threadpool(save_chat_history, req, hit["answer"], context)
+                yield _sse({"delta": hit["answer"]})
+                yield _sse({"history_id": history_id, "cached": True}, event="done")
+                return
+
+        parts: List[str] = []
+
+        def save_partial(note: str):
+            # Scheduled on the executor rather than awaited, so it also works
+            # when the generator is being cancelled (any await would be too)
+            return asyncio.get_running_loop().run_in_executor(
+                None, lambda: save_chat_history(req, "".join(parts), context, review_notes=f"partial: {note}")
+            )
+
+        try:
+            async for delta in client.stream_chat(
+                model=model_name,
+                messages=build_chat_messages(req, context),
+                temperature=req.temperature,
+                timeout=float(os.getenv("CHAT_REQUEST_TIMEOUT", "120")),
+            ):
+                parts.append(delta)
+                yield _sse({"delta": delta})
+        except (openai.APIError, httpx.TransportError) as e:
+            # httpx errors (ReadError, RemoteProtocolError, ...) surface unwrapped mid-stream
+            error: Dict[str, Any] = {"detail": f"LM Studio error: {str(e)}"}
+            if parts:
+                error["history_id"] = await save_partial("upstream error")
+            yield _sse(error, event="error")
+            return
+        except (asyncio.CancelledError, GeneratorExit):
+            if parts:
+                save_partial("client disconnected")
+            raise
+
+        answer = "".join(parts)
+        if response_cache is not None:
+            await response_cache.store(req.message, model_name, req.temperature, answer, context)
+        history_id = await run_in_threadpool(save_chat_history, req, answer, context)
+        yield _sse({"history_id": history_id}, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    db.add(history)
-    db.commit()
-    db.refresh(history)
-    return ChatResponse(answer=answer, history_id=history.id)
 
 
 class RateRequest(BaseModel):
@@ -130,19 +285,251 @@ def kb_create(payload: KBCreate, db: Session = Depends(get_db)):
         created_by=payload.created_by,
     )
     db.add(item)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="An active KB item with the same content already exists")
     db.refresh(item)
     return item
 
 
-@app.get("/kb", response_model=List[KBItem])
-def kb_list(category: Optional[str] = None, active_only: bool = True, db: Session = Depends(get_db)):
-    q = db.query(KnowledgeBase)
+def encode_cursor(values: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+KB_LIST_FIELDS = ("id", "title", "content", "category", "created_by", "is_active", "created_at", "updated_at")
+KB_DEFAULT_FIELDS = ("id", "title", "category", "created_by", "is_active")
+
+
+class KBPage(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """Validate a comma-separated `fields=` projection; content is only loaded when requested."""
+    if not fields:
+        return list(KB_DEFAULT_FIELDS)
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in names if f not in KB_LIST_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return names if "id" in names else ["id", *names]
+
+
+def kb_list_filters(category: Optional[str], active_only: bool) -> List[Any]:
+    filters = []
     if category:
-        q = q.filter(KnowledgeBase.category == category)
+        filters.append(KnowledgeBase.category == category)
     if active_only:
-        q = q.filter(KnowledgeBase.is_active.is_(True))
-    return q.order_by(KnowledgeBase.id.desc()).all()
+        filters.append(KnowledgeBase.is_active.is_(True))
+    return filters
+
+
+def serialize_row(row: Any) -> Dict[str, Any]:
+    return {key: value.isoformat() if hasattr(value, "isoformat") else value for key, value in row._mapping.items()}
+
+
+@app.get("/kb", response_model=KBPage)
+def kb_list(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    active_only: bool = True,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    One page of KB items, newest first, paged with an id keyset cursor.
+
+    The ETag hashes the page's own (id, updated_at) pairs plus the table-wide
+    max(updated_at) (an index lookup), so it costs no more than the page
+    itself; an unchanged page answers If-None-Match with 304 without being
+    serialized or sent.
+    """
+    names = parse_fields(fields)
+    filters = kb_list_filters(category, active_only)
+
+    stmt = select(
+        *[getattr(KnowledgeBase, name) for name in names],
+        KnowledgeBase.updated_at.label("etag_version"),
+    ).where(*filters)
+    if cursor:
+        try:
+            last_id = int(decode_cursor(cursor)["id"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(KnowledgeBase.id < last_id)
+    rows = db.execute(stmt.order_by(KnowledgeBase.id.desc()).limit(limit + 1)).all()
+
+    table_version = db.execute(select(func.max(KnowledgeBase.updated_at))).scalar()
+    page_version = [[row.id, str(row.etag_version)] for row in rows]
+    etag = 'W/"{}"'.format(
+        hashlib.md5(
+            json.dumps([str(table_version), page_version, category, active_only, limit, names]).encode("utf-8")
+        ).hexdigest()
+    )
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor({"id": rows[-1].id})
+    items = [serialize_row(row) for row in rows]
+    for item in items:
+        item.pop("etag_version")
+    return KBPage(items=items, next_cursor=next_cursor)
+
+
+@app.get("/kb/export")
+def kb_export(category: Optional[str] = None, active_only: bool = True, fields: Optional[str] = None):
+    """Stream the whole (filtered) KB as a JSON array without holding it in memory."""
+    names = parse_fields(fields or ",".join(KB_LIST_FIELDS))
+    filters = [KnowledgeBase.category == category] if category else []
+
+    def generate():
+        yield "["
+        first = True
+        for row in scan_knowledge_base(columns=names, active_only=active_only, filters=filters):
+            yield ("" if first else ",") + json.dumps(serialize_row(row), ensure_ascii=False)
+            first = False
+        yield "]"
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/json",
+        headers={"Content-Disposition": 'attachment; filename="knowledge_base.json"'},
+    )
+
+
+class KBSearchHit(BaseModel):
+    id: int
+    title: str
+    category: str
+    created_by: str
+    rank: float
+    snippet: str
+
+
+class KBSearchResponse(BaseModel):
+    items: List[KBSearchHit]
+    next_cursor: Optional[str] = None
+
+
+@app.get("/kb/search", response_model=KBSearchResponse)
+def kb_search(
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    fuzzy: bool = False,
+    db: Session = Depends(get_db),
+):
+    """
+    Full-text search over the generated search_vector column (GIN index).
+
+    Results are ordered by ts_rank (title hits weigh more than content hits) and
+    paged with an opaque (rank, id) cursor. Snippets come from ts_headline and
+    are only computed for the returned page. With fuzzy=true and no full-text
+    match, falls back to trigram similarity on the title (typos, partial words).
+    """
+    tsquery = func.websearch_to_tsquery("simple", q)
+    # ts_rank is float4; as float8 the value survives the JSON cursor round trip
+    # exactly, so the rank == last_rank tie-break below matches tied rows
+    rank = cast(func.ts_rank(KnowledgeBase.search_vector, tsquery), Float(53))
+    page = (
+        select(KnowledgeBase.id, rank.label("rank"))
+        .where(KnowledgeBase.is_active.is_(True))
+        .where(KnowledgeBase.search_vector.op("@@")(tsquery))
+    )
+    if cursor:
+        last = decode_cursor(cursor)
+        try:
+            last_rank, last_id = float(last["rank"]), int(last["id"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        page = page.where(or_(rank < last_rank, and_(rank == last_rank, KnowledgeBase.id < last_id)))
+    page = page.order_by(rank.desc(), KnowledgeBase.id.desc()).limit(limit + 1).subquery()
+
+    snippet = func.ts_headline(
+        "simple",
+        KnowledgeBase.content,
+        tsquery,
+        "StartSel=<b>, StopSel=</b>, MaxWords=35, MinWords=15, MaxFragments=2",
+    )
+    rows = db.execute(
+        select(
+            KnowledgeBase.id,
+            KnowledgeBase.title,
+            KnowledgeBase.category,
+            KnowledgeBase.created_by,
+            page.c.rank,
+            snippet.label("snippet"),
+        )
+        .join(page, page.c.id == KnowledgeBase.id)
+        .order_by(page.c.rank.desc(), KnowledgeBase.id.desc())
+    ).all()
+
+    if not rows and fuzzy and not cursor:
+        similarity = func.similarity(KnowledgeBase.title, q)
+        rows = db.execute(
+            select(
+                KnowledgeBase.id,
+                KnowledgeBase.title,
+                KnowledgeBase.category,
+                KnowledgeBase.created_by,
+                similarity.label("rank"),
+                func.left(KnowledgeBase.content, 200).label("snippet"),
+            )
+            .where(KnowledgeBase.is_active.is_(True))
+            .where(KnowledgeBase.title.op("%")(q))
+            .order_by(similarity.desc(), KnowledgeBase.id.desc())
+            .limit(limit)
+        ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor({"rank": rows[-1].rank, "id": rows[-1].id})
+    return KBSearchResponse(items=[KBSearchHit(**row._mapping) for row in rows], next_cursor=next_cursor)
+
+
+class KBSemanticHit(BaseModel):
+    es_id: str
+    kb_id: int
+    title: str
+    content: str
+    category: str
+    slide_start: Optional[int] = None
+    slide_end: Optional[int] = None
+    score: float
+
+
+@app.get("/kb/semantic-search", response_model=List[KBSemanticHit])
+async def kb_semantic_search(
+    q: str,
+    k: int = Query(10, ge=1, le=100),
+    nprobe: int = Query(8, ge=1, le=1024),
+):
+    """Paraphrase-tolerant passage search over the local embedding index (build_embedding_index.py)."""
+    if not os.getenv("LMSTUDIO_EMBEDDING_MODEL"):
+        raise HTTPException(status_code=503, detail="LMSTUDIO_EMBEDDING_MODEL is not configured")
+    try:
+        vector = await _embed_question(q)
+    except (openai.APITimeoutError, openai.APIConnectionError) as e:
+        raise HTTPException(status_code=502, detail=f"Embedding model unavailable: {e}")
+    return await run_in_threadpool(search_semantic_passages, vector, size=k, nprobe=nprobe)
 
 
 @app.get("/kb/{item_id}", response_model=KBItem)
@@ -157,7 +544,11 @@ def kb_update(item_id: int, payload: KBUpdate, db: Session = Depends(get_db)):
         return None
     for field, value in payload.model_dump(exclude_unset=True).items():
         setattr(item, field, value)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="An active KB item with the same content already exists")
     db.refresh(item)
     return item
 
@@ -167,23 +558,13 @@ def kb_delete(item_id: int, db: Session = Depends(get_db)):
     item = db.query(KnowledgeBase).filter(KnowledgeBase.id == item_id).first()
     if not item:
         return {"ok": False}
-    db.delete(item)
+    # Soft delete: the ES/passage syncs see it through updated_at instead of
+    # diffing every id, and a re-import can still deactivate-and-replace it
+    item.is_active = False
     db.commit()
     return {"ok": True}
 
 
-@app.get("/kb/search", response_model=List[KBItem])
-def kb_search(q: str, db: Session = Depends(get_db)):
-    pattern = f"%{q}%"
-    return (
-        db.query(KnowledgeBase)
-        .filter(KnowledgeBase.is_active.is_(True))
-        .filter((KnowledgeBase.title.ilike(pattern)) | (KnowledgeBase.content.ilike(pattern)))
-        .order_by(KnowledgeBase.id.desc())
-        .all()
-    )
-
-
 # ----------------------------- Elasticsearch Search ----------------------------- #
 
 class ESSearchRequest(BaseModel):
@@ -192,6 +573,7 @@ class ESSearchRequest(BaseModel):
     categories: Optional[List[str]] = None
     save_to_postgres: bool = True
     created_by: str = "api_user"
+    mode: Literal["lexical", "hybrid"] = "lexical"
 
 
 class ESSearchResponse(BaseModel):
@@ -202,6 +584,7 @@ class ESSearchResponse(BaseModel):
     total_results: int
     categories_found: List[str]
     rejected_by_guardrails: int
+    rejection_reasons: Dict[str, int] = {}
     query: str
     timestamp: str
 
@@ -218,7 +601,8 @@ def es_search(request: ESSearchRequest):
             top_n_per_category=request.top_n_per_category,
             categories=request.categories,
             save_to_postgres=request.save_to_postgres,
-            created_by=request.created_by
+            created_by=request.created_by,
+            mode=request.mode
         )
         return ESSearchResponse(**result)
     except Exception as e:
@@ -227,10 +611,17 @@ def es_search(request: ESSearchRequest):
 
 @app.get("/es/categories")
 def get_es_categories():
-    """Get available categories from Elasticsearch."""
+    """Get available categories from Elasticsearch, with document counts (served from cache)."""
     try:
-        categories = es_search_service.get_categories()
-        return {"categories": categories, "count": len(categories)}
+        cached = es_search_service.categories_cache.get()
+        counts = cached["categories"]
+        return {
+            "categories": [item["category"] for item in counts],
+            "count": len(counts),
+            "doc_counts": {item["category"]: item["doc_count"] for item in counts},
+            "fetched_at": cached["fetched_at"],
+            "stale": cached["stale"],
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get categories: {str(e)}")
 
@@ -280,7 +671,8 @@ def es_search_simple(
     q: str = Query("*", description="Search query"),
     categories: Optional[str] = Query(None, description="Comma-separated categories"),
     top_n: int = Query(10, description="Top N results per category"),
-    save: bool = Query(False, description="Save results to PostgreSQL")
+    save: bool = Query(False, description="Save results to PostgreSQL"),
+    mode: Literal["lexical", "hybrid"] = Query("lexical", description="lexical (ES) or hybrid (ES + embedding index)")
 ):
     """
     Simple GET endpoint for Elasticsearch search with query parameters.
@@ -295,7 +687,8 @@ def es_search_simple(
             top_n_per_category=top_n,
             categories=category_list,
             save_to_postgres=save,
-            created_by="simple_search"
+            created_by="simple_search",
+            mode=mode
         )
 
         return {
@@ -329,7 +722,8 @@ def comprehensive_es_search(request: ESSearchRequest):
             top_n_per_category=request.top_n_per_category,
             categories=request.categories,
             save_to_postgres=request.save_to_postgres,
-            created_by=request.created_by
+            created_by=request.created_by,
+            mode=request.mode
         )
 
         # Add summary statistics
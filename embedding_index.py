@@ -0,0 +1,370 @@
+"""
+CPU-only embedding index over KB passages.
+
+Vectors are L2-normalized and stored as a NumPy matrix (float32, or int8 with a
+per-row scale) that is memory-mapped on load, so the API process starts fast
+and the OS page cache shares the matrix between workers. Search is a blocked
+matrix-vector product plus argpartition top-k; an optional IVF partition
+(k-means centroids + per-row list assignment) limits the scan to the `nprobe`
+closest lists on large corpora.
+
+Rows are keyed by (kb_id, chunk_index) from kb_chunking, matching the passage
+ids "<kb_id>:<chunk_index>" in the ES passage index. add()/remove() work per KB
+id: removals are tombstoned and additions buffered until save() compacts
+everything into new files.
+
+Each save() writes a new version directory and then atomically replaces
+meta.json, which names it. Files that a running API process has memory-mapped
+are never overwritten (Windows refuses to replace a mapped file); the API
+picks up the new version on its next get_embedding_index() call and old
+versions are deleted by later saves once nothing maps them.
+
+Layout of index_dir:
+    meta.json        dim, dtype, model, nlist, docs {kb_id: content_hash}, version
+    <version>/       one directory per save:
+    vectors.npy      (n, dim) float32 or int8
+    scales.npy       (n,) float32, int8 only
+    kb_ids.npy       (n,) int64
+    chunk_ids.npy    (n,) int32
+    centroids.npy    (nlist, dim) float32, IVF only
+    lists.npy        (n,) int32 list assignment, IVF only
+"""
+
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+EMBEDDING_INDEX_DIR = os.getenv("EMBEDDING_INDEX_DIR", "data/index/embeddings")
+SEARCH_BLOCK_ROWS = 32768  # rows converted/scored at a time, bounds temporary memory
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize_int8(vectors: np.ndarray):
+    """Symmetric per-row int8 quantization; returns (codes, scales)."""
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means (cosine) on normalized vectors; returns (nlist, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = vectors[assign == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+            else:
+                centroids[c] = vectors[rng.integers(len(vectors))]
+        centroids = normalize(centroids)
+    return centroids
+
+
+class EmbeddingIndex:
+    """
+    Usage:
+        index = EmbeddingIndex.load()            # or EmbeddingIndex(dim=768) for a new one
+        index.add(kb_id, [0, 1], vectors)         # replaces any previous rows of kb_id
+        index.remove(other_kb_id)
+        index.save()
+        index.search(query_vector, k=10)          # [{"kb_id", "chunk_index", "score"}]
+    """
+
+    def __init__(
+        self,
+        index_dir: str = EMBEDDING_INDEX_DIR,
+        dim: Optional[int] = None,
+        dtype: str = "float32",
+        model: str = "",
+    ) -> None:
+        if dtype not in ("float32", "int8"):
+            raise ValueError("dtype must be 'float32' or 'int8'")
+        self.index_dir = index_dir
+        self.dim = dim
+        self.dtype = dtype
+        self.model = model
+        self.docs: Dict[str, str] = {}
+        self.vectors: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.kb_ids = np.empty(0, dtype=np.int64)
+        self.chunk_ids = np.empty(0, dtype=np.int32)
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: Optional[np.ndarray] = None
+        self._removed: set = set()
+        self._live: Optional[np.ndarray] = None
+        self._pending: List[Any] = []  # (kb_id, chunk_ids, normalized vectors)
+        self._pending_cache: Optional[Any] = None
+
+    # ------------------------------------------------------------------ io
+
+    @classmethod
+    def load(cls, index_dir: str = EMBEDDING_INDEX_DIR) -> "EmbeddingIndex":
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(index_dir, dim=meta["dim"], dtype=meta["dtype"], model=meta.get("model", ""))
+        index.docs = meta.get("docs", {})
+        # Indexes saved before versioning keep their arrays directly in index_dir
+        data_dir = os.path.join(index_dir, meta["version"]) if meta.get("version") else index_dir
+        path = lambda name: os.path.join(data_dir, name)  # noqa: E731
+        index.vectors = np.load(path("vectors.npy"), mmap_mode="r")
+        index.kb_ids = np.load(path("kb_ids.npy"))
+        index.chunk_ids = np.load(path("chunk_ids.npy"))
+        if index.dtype == "int8":
+            index.scales = np.load(path("scales.npy"))
+        if meta.get("nlist"):
+            index.centroids = np.load(path("centroids.npy"))
+            index.lists = np.load(path("lists.npy"))
+        return index
+
+    def save(self) -> None:
+        """Compact tombstones and pending rows into a new version directory, then switch meta.json to it."""
+        vectors = self._materialize()
+        live = self._live_mask()
+        kb_ids = self.kb_ids[live]
+        chunk_ids = self.chunk_ids[live]
+        lists = self.lists[live] if self.lists is not None else None
+        vectors = vectors[live]
+        if self._pending:
+            pending_kb, pending_chunks, pending_vectors = self._pending_arrays()
+            kb_ids = np.concatenate([kb_ids, pending_kb])
+            chunk_ids = np.concatenate([chunk_ids, pending_chunks])
+            vectors = np.concatenate([vectors, pending_vectors])
+            if self.centroids is not None:
+                lists = np.concatenate([lists, self._assign(pending_vectors)])
+
+        previous = self._current_version()
+        version = f"v{time.time_ns()}"
+        data_dir = os.path.join(self.index_dir, version)
+        os.makedirs(data_dir)
+        arrays = {"kb_ids.npy": kb_ids, "chunk_ids.npy": chunk_ids}
+        if self.dtype == "int8":
+            arrays["vectors.npy"], arrays["scales.npy"] = quantize_int8(vectors)
+        else:
+            arrays["vectors.npy"] = vectors.astype(np.float32)
+        if self.centroids is not None:
+            arrays["centroids.npy"] = self.centroids
+            arrays["lists.npy"] = lists.astype(np.int32)
+        for name, array in arrays.items():
+            with open(os.path.join(data_dir, name), "wb") as f:
+                np.save(f, array)
+
+        meta = {
+            "dim": self.dim,
+            "dtype": self.dtype,
+            "model": self.model,
+            "nlist": 0 if self.centroids is None else len(self.centroids),
+            "docs": self.docs,
+            "version": version,
+        }
+        tmp = os.path.join(self.index_dir, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.index_dir, "meta.json"))
+        self._prune_versions(keep={version, previous}, legacy=previous is not None)
+
+        reloaded = EmbeddingIndex.load(self.index_dir)
+        self.__dict__.update(reloaded.__dict__)
+
+    def _current_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.index_dir, "meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f).get("version")
+        except (OSError, ValueError):
+            return None
+
+    def _prune_versions(self, keep: set, legacy: bool) -> None:
+        """
+        Delete version directories other than `keep` (the new one and the one it
+        replaces, which readers may still be opening). Directories still mapped by
+        another process cannot be deleted on Windows and are retried next save.
+        """
+        for name in os.listdir(self.index_dir):
+            path = os.path.join(self.index_dir, name)
+            if name.startswith("v") and name not in keep and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+        if not legacy:
+            return
+        # Arrays from before versioning; kept for one save like any previous version
+        for name in ("vectors.npy", "scales.npy", "kb_ids.npy", "chunk_ids.npy", "centroids.npy", "lists.npy"):
+            try:
+                os.remove(os.path.join(self.index_dir, name))
+            except OSError:
+                pass
+
+    # ------------------------------------------------------------ mutation
+
+    def __len__(self) -> int:
+        return int(self._live_mask().sum()) + sum(len(p[1]) for p in self._pending)
+
+    def add(
+        self,
+        kb_id: int,
+        chunk_ids: Sequence[int],
+        vectors: Any,
+        content_hash: Optional[str] = None,
+    ) -> None:
+        """Index the passages of one KB row, replacing whatever was indexed for it before."""
+        vectors = normalize(np.atleast_2d(vectors))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dim vectors, got {vectors.shape[1]}")
+        self.remove(kb_id)
+        self._pending.append((kb_id, np.asarray(chunk_ids, dtype=np.int32), vectors))
+        self._pending_cache = None
+        if content_hash is not None:
+            self.docs[str(kb_id)] = content_hash
+
+    def remove(self, kb_id: int) -> None:
+        if np.any(self.kb_ids == kb_id):
+            self._removed.add(kb_id)
+            self._live = None
+        if any(p[0] == kb_id for p in self._pending):
+            self._pending = [p for p in self._pending if p[0] != kb_id]
+            self._pending_cache = None
+        self.docs.pop(str(kb_id), None)
+
+    def build_ivf(self, nlist: int, iterations: int = 10, sample_size: int = 50000) -> None:
+        """Train IVF centroids on a sample and assign every row; call save() to persist."""
+        self.save()
+        n = 0 if self.vectors is None else len(self.vectors)
+        if n < nlist:
+            raise ValueError(f"Need at least {nlist} vectors to build {nlist} lists")
+        rng = np.random.default_rng(0)
+        sample = rng.choice(n, size=min(sample_size, n), replace=False)
+        self.centroids = kmeans(self._dequantize(np.sort(sample)), nlist, iterations)
+        self.lists = np.concatenate([
+            self._assign(self._dequantize(np.arange(start, min(start + SEARCH_BLOCK_ROWS, n))))
+            for start in range(0, n, SEARCH_BLOCK_ROWS)
+        ]).astype(np.int32)
+        self.save()
+
+    # -------------------------------------------------------------- search
+
+    def search(self, query: Any, k: int = 10, nprobe: int = 8) -> List[Dict[str, Any]]:
+        """Top-k passages by cosine similarity."""
+        if self.dim is None:
+            return []
+        query = normalize(np.asarray(query, dtype=np.float32).reshape(-1))
+        scores: List[np.ndarray] = []
+        kb_ids: List[np.ndarray] = []
+        chunk_ids: List[np.ndarray] = []
+
+        if self.vectors is not None and len(self.vectors):
+            if self.centroids is not None:
+                probe = np.argsort(self.centroids @ query)[::-1][:nprobe]
+                rows = np.flatnonzero(np.isin(self.lists, probe) & self._live_mask())
+            else:
+                rows = None
+            base_scores = self._score(query, rows)
+            if rows is None:
+                live = self._live_mask()
+                rows = np.flatnonzero(live) if self._removed else slice(None)
+                base_scores = base_scores[rows]
+            scores.append(base_scores)
+            kb_ids.append(self.kb_ids[rows])
+            chunk_ids.append(self.chunk_ids[rows])
+
+        if self._pending:
+            pending_kb, pending_chunks, pending_vectors = self._pending_arrays()
+            scores.append(pending_vectors @ query)
+            kb_ids.append(pending_kb)
+            chunk_ids.append(pending_chunks)
+
+        if not scores:
+            return []
+        all_scores = np.concatenate(scores)
+        all_kb = np.concatenate(kb_ids)
+        all_chunks = np.concatenate(chunk_ids)
+        k = min(k, len(all_scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-all_scores, k - 1)[:k]
+        top = top[np.argsort(-all_scores[top])]
+        return [
+            {"kb_id": int(all_kb[i]), "chunk_index": int(all_chunks[i]), "score": float(all_scores[i])}
+            for i in top
+        ]
+
+    # ------------------------------------------------------------- helpers
+
+    def _live_mask(self) -> np.ndarray:
+        if self._live is None:
+            if self._removed:
+                self._live = ~np.isin(self.kb_ids, np.fromiter(self._removed, dtype=np.int64))
+            else:
+                self._live = np.ones(len(self.kb_ids), dtype=bool)
+        return self._live
+
+    def _materialize(self) -> np.ndarray:
+        if self.vectors is None:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return self._dequantize(np.arange(len(self.vectors)))
+
+    def _dequantize(self, rows: np.ndarray) -> np.ndarray:
+        block = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.dtype == "int8":
+            block *= self.scales[rows, None]
+        return block
+
+    def _score(self, query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """Cosine scores for `rows` (all rows when None), in blocks to bound the float32 copy."""
+        if rows is None:
+            n = len(self.vectors)
+            if self.dtype == "float32":
+                return self.vectors @ query
+            return np.concatenate([
+                (self.vectors[s:s + SEARCH_BLOCK_ROWS].astype(np.float32) @ query) * self.scales[s:s + SEARCH_BLOCK_ROWS]
+                for s in range(0, n, SEARCH_BLOCK_ROWS)
+            ])
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.float32)
+        return np.concatenate([
+            self._dequantize(rows[s:s + SEARCH_BLOCK_ROWS]) @ query
+            for s in range(0, len(rows), SEARCH_BLOCK_ROWS)
+        ])
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _pending_arrays(self):
+        if self._pending_cache is None:
+            self._pending_cache = (
+                np.concatenate([np.full(len(c), kb, dtype=np.int64) for kb, c, _ in self._pending]),
+                np.concatenate([c for _, c, _ in self._pending]),
+                np.concatenate([v for _, _, v in self._pending]),
+            )
+        return self._pending_cache
+
+
+_index: Optional[EmbeddingIndex] = None
+_index_mtime: Optional[float] = None
+
+
+def get_embedding_index() -> Optional[EmbeddingIndex]:
+    """
+    Process-wide read-only index, reloaded when build_embedding_index.py rewrites it.
+
+    Returns None when no index has been built yet.
+    """
+    global _index, _index_mtime
+    meta_path = os.path.join(EMBEDDING_INDEX_DIR, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    mtime = os.path.getmtime(meta_path)
+    if _index is None or mtime != _index_mtime:
+        _index = EmbeddingIndex.load(EMBEDDING_INDEX_DIR)
+        _index_mtime = mtime
+    return _index
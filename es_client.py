@@ -1,56 +1,258 @@
+import asyncio
 import os
-import hashlib
+import random
+import threading
+import time
 from typing import Any, Dict, List, Set, Optional
-from collections import defaultdict
 
 from dotenv import load_dotenv
 
+from models import compute_content_hash
+
 try:
-    from elasticsearch import Elasticsearch
+    from elasticsearch import AsyncElasticsearch, Elasticsearch
+    from elastic_transport import AsyncTransport, ConnectionError, ConnectionTimeout, Transport
+    from elastic_transport.client_utils import DEFAULT
 except Exception:  # pragma: no cover
     Elasticsearch = None  # type: ignore
+    AsyncElasticsearch = None  # type: ignore
 
 
 load_dotenv()
 
 
-def get_es_client() -> "Elasticsearch":
-    if Elasticsearch is None:
-        raise RuntimeError("elasticsearch package not installed. Install from requirements-es.txt")
-    url = os.getenv("ES_URL", "http://127.0.0.1:9200")
+ES_CONNECTIONS_PER_NODE = int(os.getenv("ES_CONNECTIONS_PER_NODE", "25"))
+ES_REQUEST_TIMEOUT = float(os.getenv("ES_REQUEST_TIMEOUT", "10"))
+ES_MAX_RETRIES = int(os.getenv("ES_MAX_RETRIES", "3"))
+ES_RETRY_BACKOFF = float(os.getenv("ES_RETRY_BACKOFF", "0.2"))  # seconds, doubled per attempt
+ES_RETRY_BACKOFF_MAX = float(os.getenv("ES_RETRY_BACKOFF_MAX", "5"))
+RETRY_ON_STATUS = (429, 502, 503, 504)
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter (half fixed, half random) so retrying workers spread out."""
+    delay = min(ES_RETRY_BACKOFF_MAX, ES_RETRY_BACKOFF * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _retry_policy(transport: Any, kwargs: Dict[str, Any]):
+    """Resolve per-request overrides (es.options(max_retries=...)) against the transport defaults."""
+    max_retries = kwargs.pop("max_retries", DEFAULT)
+    retry_on_status = kwargs.pop("retry_on_status", DEFAULT)
+    retry_on_timeout = kwargs.pop("retry_on_timeout", DEFAULT)
+    return (
+        transport.max_retries if max_retries is DEFAULT else max_retries,
+        transport.retry_on_status if retry_on_status is DEFAULT else retry_on_status,
+        transport.retry_on_timeout if retry_on_timeout is DEFAULT else retry_on_timeout,
+    )
+
+
+if Elasticsearch is not None:
+
+    class BackoffTransport(Transport):
+        """Transport that sleeps with jittered backoff between retries instead of retrying at once."""
+
+        def perform_request(self, method: str, target: str, **kwargs: Any):  # type: ignore[override]
+            max_retries, retry_on_status, retry_on_timeout = _retry_policy(self, kwargs)
+            for attempt in range(max_retries + 1):
+                last = attempt >= max_retries
+                try:
+                    response = super().perform_request(method, target, max_retries=0, **kwargs)
+                except ConnectionTimeout:
+                    if last or not retry_on_timeout:
+                        raise
+                except ConnectionError:
+                    if last:
+                        raise
+                else:
+                    if last or response.meta.status not in retry_on_status:
+                        return response
+                time.sleep(_backoff_delay(attempt))
+
+    class AsyncBackoffTransport(AsyncTransport):
+        """Async twin of BackoffTransport."""
+
+        async def perform_request(self, method: str, target: str, **kwargs: Any):  # type: ignore[override]
+            max_retries, retry_on_status, retry_on_timeout = _retry_policy(self, kwargs)
+            for attempt in range(max_retries + 1):
+                last = attempt >= max_retries
+                try:
+                    response = await super().perform_request(method, target, max_retries=0, **kwargs)
+                except ConnectionTimeout:
+                    if last or not retry_on_timeout:
+                        raise
+                except ConnectionError:
+                    if last:
+                        raise
+                else:
+                    if last or response.meta.status not in retry_on_status:
+                        return response
+                await asyncio.sleep(_backoff_delay(attempt))
+
+
+def _client_kwargs() -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {
+        "connections_per_node": ES_CONNECTIONS_PER_NODE,
+        "request_timeout": ES_REQUEST_TIMEOUT,
+        "max_retries": ES_MAX_RETRIES,
+        "retry_on_status": RETRY_ON_STATUS,
+        "retry_on_timeout": True,
+        # Single-node / proxied setups: sniffing would replace the configured URL
+        "sniff_on_start": False,
+        "sniff_before_requests": False,
+        "sniff_on_node_failure": False,
+    }
     api_key = os.getenv("ES_API_KEY")
-    if api_key:
-        return Elasticsearch(url, api_key=api_key)
     username = os.getenv("ES_USERNAME")
     password = os.getenv("ES_PASSWORD")
-    if username and password:
-        return Elasticsearch(url, basic_auth=(username, password))
-    return Elasticsearch(url)
+    if api_key:
+        kwargs["api_key"] = api_key
+    elif username and password:
+        kwargs["basic_auth"] = (username, password)
+    return kwargs
+
+
+_es_client: Optional["Elasticsearch"] = None
+_async_es_client: Optional["AsyncElasticsearch"] = None
+_es_client_lock = threading.Lock()
 
 
-def ensure_index(index_name: str) -> None:
+def get_es_client() -> "Elasticsearch":
+    """
+    Return the process-wide Elasticsearch client, creating it on first use.
+
+    The client is thread-safe and keeps a keep-alive pool of
+    ES_CONNECTIONS_PER_NODE connections; per-request settings go through
+    es.options(request_timeout=...), which shares the same pool.
+    """
+    global _es_client
+    if Elasticsearch is None:
+        raise RuntimeError("elasticsearch package not installed. Install from requirements-es.txt")
+    if _es_client is None:
+        with _es_client_lock:
+            if _es_client is None:
+                _es_client = Elasticsearch(
+                    os.getenv("ES_URL", "http://127.0.0.1:9200"),
+                    transport_class=BackoffTransport,
+                    **_client_kwargs(),
+                )
+    return _es_client
+
+
+def get_async_es_client() -> "AsyncElasticsearch":
+    """Process-wide AsyncElasticsearch for async endpoints (needs elasticsearch[async], i.e. aiohttp)."""
+    global _async_es_client
+    if AsyncElasticsearch is None:
+        raise RuntimeError("elasticsearch package not installed. Install from requirements-es.txt")
+    if _async_es_client is None:
+        _async_es_client = AsyncElasticsearch(
+            os.getenv("ES_URL", "http://127.0.0.1:9200"),
+            transport_class=AsyncBackoffTransport,
+            **_client_kwargs(),
+        )
+    return _async_es_client
+
+
+def close_es_client() -> None:
+    global _es_client
+    if _es_client is not None:
+        _es_client.close()
+        _es_client = None
+
+
+async def close_async_es_client() -> None:
+    global _async_es_client
+    if _async_es_client is not None:
+        await _async_es_client.close()
+        _async_es_client = None
+
+
+# Ingest processes touch this file; the API's categories cache compares its mtime
+CATEGORIES_STAMP_FILE = os.getenv("ES_CATEGORIES_STAMP_FILE", "data/cache/es_categories.stamp")
+
+
+def invalidate_categories() -> None:
+    """Mark cached /es/categories results as outdated (works across processes)."""
+    os.makedirs(os.path.dirname(CATEGORIES_STAMP_FILE) or ".", exist_ok=True)
+    with open(CATEGORIES_STAMP_FILE, "a", encoding="utf-8"):
+        pass
+    os.utime(CATEGORIES_STAMP_FILE, None)
+
+
+def categories_stamp() -> int:
+    try:
+        return os.stat(CATEGORIES_STAMP_FILE).st_mtime_ns
+    except OSError:
+        return 0
+
+
+KB_MAPPINGS = {
+    "properties": {
+        "title": {"type": "text"},
+        "content": {"type": "text"},
+        "category": {"type": "keyword"},
+        "created_by": {"type": "keyword"},
+        "is_active": {"type": "boolean"},
+        "content_hash": {"type": "keyword"},
+        # Digest of the synced row (index_kb_to_es.row_hash), to skip unchanged rows
+        "sync_hash": {"type": "keyword", "index": False},
+    }
+}
+
+# One document per chunk of a KnowledgeBase row (see kb_chunking.py)
+PASSAGE_MAPPINGS = {
+    "properties": {
+        **KB_MAPPINGS["properties"],
+        "kb_id": {"type": "integer"},
+        "chunk_index": {"type": "integer"},
+        "chunk_count": {"type": "integer"},
+        "slide_start": {"type": "integer"},
+        "slide_end": {"type": "integer"},
+        "chunk_hash": {"type": "keyword"},
+    }
+}
+
+
+def ensure_index(index_name: str, mappings: Optional[Dict[str, Any]] = None) -> None:
     es = get_es_client()
+    mappings = mappings or KB_MAPPINGS
     if es.indices.exists(index=index_name):
+        # Add fields introduced after the index was created (existing fields are left as-is)
+        current = es.indices.get_mapping(index=index_name)[index_name]["mappings"].get("properties", {})
+        missing = {name: spec for name, spec in mappings["properties"].items() if name not in current}
+        if missing:
+            es.indices.put_mapping(index=index_name, properties=missing)
         return
-    es.indices.create(
-        index=index_name,
-        mappings={
-            "properties": {
-                "title": {"type": "text"},
-                "content": {"type": "text"},
-                "category": {"type": "keyword"},
-                "created_by": {"type": "keyword"},
-                "is_active": {"type": "boolean"},
-            }
-        },
-    )
+    es.indices.create(index=index_name, mappings=mappings)
+
+
+def bulk_failures(response: Any) -> List[Dict[str, Any]]:
+    """
+    Items of a bulk response that failed, as {"op", "_id", "status", "error"}.
+
+    A bulk call returns 200 even when items fail, so callers must check. A
+    delete of a doc that is already gone (404 without "error") is not a failure.
+    """
+    if not response.get("errors"):
+        return []
+    failures = []
+    for item in response["items"]:
+        op, result = next(iter(item.items()))
+        if "error" in result:
+            failures.append({"op": op, "_id": result.get("_id"), "status": result.get("status"), "error": result["error"]})
+    return failures
 
 
 def _generate_content_hash(content: str) -> str:
-    """Generate a hash for content deduplication."""
-    # Normalize content: strip whitespace, convert to lowercase
-    normalized = content.strip().lower()
-    return hashlib.md5(normalized.encode('utf-8')).hexdigest()
+    """Generate a hash for content deduplication (same key as knowledge_base.content_hash)."""
+    return compute_content_hash(content)
+
+
+# Upper bound on category buckets when no categories are requested
+CATEGORY_AGG_SIZE = int(os.getenv("ES_CATEGORY_AGG_SIZE", "200"))
+# ES caps top_hits size at index.max_inner_result_window (default 100)
+MAX_TOP_HITS = 100
+RESULT_SOURCE_FIELDS = ["title", "content", "category", "created_by", "is_active", "content_hash"]
 
 
 def search_es_by_category(
@@ -63,6 +265,13 @@ def search_es_by_category(
     """
     Search Elasticsearch and return top-N results per category with deduplication.
 
+    Grouping happens server-side: a terms aggregation on category (buckets
+    ordered by their best score) with a top_hits sub-aggregation, and no
+    top-level hits. The payload is categories x 2N filtered _source documents,
+    and every category gets its own top N instead of competing for a shared
+    window of hits. The 2x headroom absorbs duplicates and short content,
+    which are dropped here.
+
     Args:
         query: Search query (default: "*" for all)
         index_name: ES index name
@@ -75,40 +284,40 @@ def search_es_by_category(
     """
     es = get_es_client()
 
-    # Build search query
+    filters: List[Dict[str, Any]] = [{"term": {"is_active": True}}]
     if categories:
-        # Search specific categories
-        search_body = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"query_string": {"query": query}} if query != "*" else {"match_all": {}},
-                        {"terms": {"category": categories}}
-                    ],
-                    "filter": [
-                        {"term": {"is_active": True}}
-                    ]
-                }
-            },
-            "size": top_n_per_category * len(categories) * 2,  # Get extra to account for deduplication
-            "sort": [{"_score": {"order": "desc"}}]
-        }
-    else:
-        # Search all categories, then group
-        search_body = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"query_string": {"query": query}} if query != "*" else {"match_all": {}}
-                    ],
-                    "filter": [
-                        {"term": {"is_active": True}}
-                    ]
+        filters.append({"terms": {"category": categories}})
+
+    search_body = {
+        "query": {
+            "bool": {
+                "must": [
+                    {"query_string": {"query": query}} if query != "*" else {"match_all": {}}
+                ],
+                "filter": filters
+            }
+        },
+        "size": 0,
+        "aggs": {
+            "by_category": {
+                "terms": {
+                    "field": "category",
+                    "size": len(categories) if categories else CATEGORY_AGG_SIZE,
+                    "order": {"best_score": "desc"}
+                },
+                "aggs": {
+                    "best_score": {"max": {"script": "_score"}},
+                    "top": {
+                        "top_hits": {
+                            "size": min(top_n_per_category * 2, MAX_TOP_HITS),
+                            "_source": {"includes": RESULT_SOURCE_FIELDS},
+                            "sort": [{"_score": {"order": "desc"}}]
+                        }
+                    }
                 }
-            },
-            "size": 1000,  # Get a large number to group by category
-            "sort": [{"_score": {"order": "desc"}}]
+            }
         }
+    }
 
     try:
         response = es.search(index=index_name, body=search_body)
@@ -116,40 +325,105 @@ def search_es_by_category(
         print(f"Elasticsearch search error: {e}")
         return {}
 
-    # Group results by category and deduplicate
-    category_results = defaultdict(list)
+    # Deduplicate across categories (buckets are visited best-first)
+    category_results: Dict[str, List[Dict[str, Any]]] = {}
     seen_hashes: Set[str] = set()
 
-    for hit in response["hits"]["hits"]:
-        source = hit["_source"]
-        category = source.get("category", "unknown")
-        content = source.get("content", "")
+    for bucket in response["aggregations"]["by_category"]["buckets"]:
+        results: List[Dict[str, Any]] = []
+        for hit in bucket["top"]["hits"]["hits"]:
+            source = hit["_source"]
+            content = source.get("content", "")
 
-        # Apply guardrails: minimum content length
-        if len(content.strip()) < min_content_length:
-            continue
+            # Apply guardrails: minimum content length
+            if len(content.strip()) < min_content_length:
+                continue
 
-        # Generate content hash for deduplication
-        content_hash = _generate_content_hash(content)
-        if content_hash in seen_hashes:
-            continue
+            # Indexed hash when present (index_kb_to_es writes it), same key otherwise
+            content_hash = source.get("content_hash") or _generate_content_hash(content)
+            if content_hash in seen_hashes:
+                continue
 
-        seen_hashes.add(content_hash)
+            seen_hashes.add(content_hash)
+            results.append({
+                **source,
+                "score": hit["_score"],
+                "es_id": hit["_id"],
+                "content_hash": content_hash
+            })
+            if len(results) >= top_n_per_category:
+                break
 
-        # Add score and other metadata
-        result_item = {
-            **source,
-            "score": hit["_score"],
+        if results:
+            category_results[bucket["key"]] = results
+
+    return category_results
+
+
+def _passage_query(query: str) -> Dict[str, Any]:
+    return {
+        "bool": {
+            "must": [{"multi_match": {"query": query, "fields": ["title^2", "content"]}}],
+            "filter": [{"term": {"is_active": True}}],
+        }
+    }
+
+
+PASSAGE_SOURCE_FIELDS = ["title", "content", "category", "kb_id", "slide_start", "slide_end"]
+
+
+def _passage_hits(response: Any) -> List[Dict[str, Any]]:
+    return [
+        {
             "es_id": hit["_id"],
-            "content_hash": content_hash
+            "title": hit["_source"].get("title", ""),
+            "content": hit["_source"].get("content", ""),
+            "category": hit["_source"].get("category", "unknown"),
+            "kb_id": hit["_source"].get("kb_id"),
+            "slide_start": hit["_source"].get("slide_start"),
+            "slide_end": hit["_source"].get("slide_end"),
+            "score": hit["_score"],
         }
+        for hit in response["hits"]["hits"]
+    ]
 
-        category_results[category].append(result_item)
 
-    # Limit results per category
-    for category in category_results:
-        category_results[category] = category_results[category][:top_n_per_category]
+def search_passages(
+    query: str,
+    index_name: str = "kb_software_engineering",
+    size: int = 5,
+    request_timeout: float = 1.0,
+) -> List[Dict[str, Any]]:
+    """
+    BM25 search over title^2/content for chat retrieval (same query shape as scripts/es_search.py).
 
-    return dict(category_results)
+    Works against both the whole-document KB index and the passage index;
+    passage hits also carry kb_id and the slide range. No retries: the
+    caller's latency budget is shorter than a backoff.
+    Returns a list of {"es_id", "title", "content", "category", "score", ...} ordered by score.
+    """
+    es = get_es_client()
+    response = es.options(request_timeout=request_timeout, max_retries=0).search(
+        index=index_name,
+        query=_passage_query(query),
+        source=PASSAGE_SOURCE_FIELDS,
+        size=size,
+    )
+    return _passage_hits(response)
 
 
+async def async_search_passages(
+    query: str,
+    index_name: str = "kb_software_engineering",
+    size: int = 5,
+    request_timeout: float = 1.0,
+) -> List[Dict[str, Any]]:
+    """search_passages on the AsyncElasticsearch client, for use directly inside async endpoints."""
+    es = get_async_es_client()
+    response = await es.options(request_timeout=request_timeout, max_retries=0).search(
+        index=index_name,
+        query=_passage_query(query),
+        source=PASSAGE_SOURCE_FIELDS,
+        size=size,
+    )
+    return _passage_hits(response)
@@ -1,17 +1,68 @@
 import os
 import re
-from typing import List, Dict, Any, Optional, Set
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Set, Tuple
 from datetime import datetime
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
-
-from es_client import search_es_by_category, get_es_client
-from models import KnowledgeBase
+from sqlalchemy import and_, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from es_client import CATEGORY_AGG_SIZE, categories_stamp, get_es_client, search_es_by_category
+from hybrid_search import (
+    HYBRID_LEXICAL_TIMEOUT_MS,
+    HYBRID_METHOD,
+    HYBRID_SEMANTIC_TIMEOUT_MS,
+    embed_query,
+    fan_out,
+    fuse,
+    semantic_enabled,
+)
+from rag import search_semantic_passages
+from models import KnowledgeBase, compute_content_hash
 from database import SessionLocal
 
 
+WORD_RE = re.compile(r"\w+")
+REPEATED_CHARS_RE = re.compile(r"^(.)\1{10,}", re.IGNORECASE)
+ALPHA_RE = re.compile(r"[a-zA-Z]")
+
+
+def word_set(text: str) -> Set[str]:
+    """
+    Distinct \\w+ tokens of `text`, same result as set(re.findall(r"\\w+", text)).
+
+    Whitespace is never a word character, so split() first (C speed) and only
+    run the regex on the distinct tokens that carry punctuation.
+    """
+    words: Set[str] = set()
+    for token in set(text.split()):
+        if token.isalnum():
+            words.add(token)
+        else:
+            words.update(WORD_RE.findall(token))
+    return words
+
+
+def _check_chunk(args) -> List[Optional[Tuple[str, str]]]:
+    """Process-pool worker: run one guardrails config over a chunk of (content, title) pairs."""
+    config, pairs = args
+    guardrails = ContentGuardrails(**config)
+    return [guardrails.check(content, title) for content, title in pairs]
+
+
 class ContentGuardrails:
-    """Content quality validation and filtering."""
+    """
+    Content quality validation and filtering.
+
+    Patterns are compiled once and each document is tokenized once: the
+    lowercase word set feeds both the spam-word check (a hash-set
+    intersection, i.e. whole-word multi-pattern matching in O(tokens)) and the
+    title-overlap check.
+    """
+
+    # Rejection codes, in the order checks run
+    REASONS = ("empty", "too_short", "too_long", "repeated_chars", "no_alpha", "spam_words", "title_overlap")
 
     def __init__(self, min_content_length: int = 50, max_content_length: int = 10000):
         self.min_content_length = min_content_length
@@ -25,71 +76,105 @@ class ContentGuardrails:
         ]
 
         # Common spam/placeholder words
-        self.spam_words = {
+        self.spam_words = frozenset({
             'lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur',
             'test', 'testing', 'placeholder', 'example', 'sample',
             'todo', 'fixme', 'xxx', 'yyy', 'zzz'
-        }
+        })
 
-    def is_valid_content(self, content: str, title: str = "") -> tuple[bool, str]:
-        """
-        Validate content quality.
-
-        Returns:
-            (is_valid, reason) - True if content passes all checks
-        """
-        if not content or not content.strip():
-            return False, "Empty content"
-
-        content_clean = content.strip()
+    def check(self, content: str, title: str = "") -> Optional[Tuple[str, str]]:
+        """Return None for valid content, else (reason_code, message)."""
+        content_clean = content.strip() if content else ""
+        if not content_clean:
+            return "empty", "Empty content"
 
         # Length checks
-        if len(content_clean) < self.min_content_length:
-            return False, f"Content too short ({len(content_clean)} < {self.min_content_length})"
-
-        if len(content_clean) > self.max_content_length:
-            return False, f"Content too long ({len(content_clean)} > {self.max_content_length})"
+        length = len(content_clean)
+        if length < self.min_content_length:
+            return "too_short", f"Content too short ({length} < {self.min_content_length})"
+        if length > self.max_content_length:
+            return "too_long", f"Content too long ({length} > {self.max_content_length})"
 
         # Spam pattern checks
-        for pattern in self.spam_patterns:
-            if re.search(pattern, content_clean, re.IGNORECASE):
-                return False, f"Matches spam pattern: {pattern}"
+        if REPEATED_CHARS_RE.match(content_clean):
+            return "repeated_chars", f"Matches spam pattern: {self.spam_patterns[0]}"
+        if not ALPHA_RE.search(content_clean):
+            return "no_alpha", f"Matches spam pattern: {self.spam_patterns[2]}"
+
+        # Single tokenization pass shared by the remaining checks
+        words = word_set(content_clean.lower())
 
         # Check for excessive spam words
-        words = set(re.findall(r'\b\w+\b', content_clean.lower()))
-        spam_word_count = len(words.intersection(self.spam_words))
+        spam_word_count = len(self.spam_words.intersection(words))
         if spam_word_count > 3:
-            return False, f"Too many spam words ({spam_word_count})"
+            return "spam_words", f"Too many spam words ({spam_word_count})"
 
         # Check content-to-title ratio (avoid very repetitive content)
-        if title and len(title.strip()) > 0:
-            title_words = set(re.findall(r'\b\w+\b', title.lower()))
-            content_words = set(re.findall(r'\b\w+\b', content_clean.lower()))
+        if title and title.strip() and words:
+            title_words = word_set(title.lower())
+            if len(title_words.intersection(words)) / len(words) > 0.8:  # More than 80% overlap
+                return "title_overlap", "Content too similar to title"
 
-            if len(content_words) > 0:
-                overlap_ratio = len(title_words.intersection(content_words)) / len(content_words)
-                if overlap_ratio > 0.8:  # More than 80% overlap
-                    return False, "Content too similar to title"
+        return None
 
-        return True, "Valid content"
+    def is_valid_content(self, content: str, title: str = "") -> tuple[bool, str]:
+        """
+        Validate content quality.
 
-    def filter_results(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Filter results based on content quality."""
-        filtered = []
+        Returns:
+            (is_valid, reason) - True if content passes all checks
+        """
+        rejection = self.check(content, title)
+        if rejection is None:
+            return True, "Valid content"
+        return False, rejection[1]
 
-        for item in results:
-            content = item.get("content", "")
-            title = item.get("title", "")
+    def validate_batch(
+        self,
+        items: List[Dict[str, Any]],
+        workers: int = 0,
+        chunksize: int = 500,
+        min_items_for_pool: int = 5000
+    ) -> Dict[str, Any]:
+        """
+        Validate many items ({"content", "title", ...}) at once.
 
-            is_valid, reason = self.is_valid_content(content, title)
+        With workers > 1 and at least `min_items_for_pool` items, chunks are
+        checked on a process pool (worth it for large exports; below that the
+        pickling costs more than the checks).
 
-            if is_valid:
-                filtered.append(item)
-            else:
-                # Add rejection reason to metadata for debugging
-                item["rejection_reason"] = reason
+        Returns:
+            {"accepted": [...], "rejected": [...], "rejection_counts": {code: n}};
+            rejected items get "rejection_reason" (message) and "rejection_code".
+        """
+        pairs = [(item.get("content", ""), item.get("title", "")) for item in items]
+        if workers > 1 and len(pairs) >= min_items_for_pool:
+            config = {"min_content_length": self.min_content_length, "max_content_length": self.max_content_length}
+            chunks = [(config, pairs[i:i + chunksize]) for i in range(0, len(pairs), chunksize)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                verdicts = [verdict for chunk in pool.map(_check_chunk, chunks) for verdict in chunk]
+        else:
+            verdicts = [self.check(content, title) for content, title in pairs]
+
+        accepted: List[Dict[str, Any]] = []
+        rejected: List[Dict[str, Any]] = []
+        rejection_counts: Dict[str, int] = {}
+        for item, verdict in zip(items, verdicts):
+            if verdict is None:
+                accepted.append(item)
+                continue
+            code, message = verdict
+            # Add rejection reason to metadata for debugging
+            item["rejection_reason"] = message
+            item["rejection_code"] = code
+            rejected.append(item)
+            rejection_counts[code] = rejection_counts.get(code, 0) + 1
+
+        return {"accepted": accepted, "rejected": rejected, "rejection_counts": rejection_counts}
 
-        return filtered
+    def filter_results(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Filter results based on content quality."""
+        return self.validate_batch(results)["accepted"]
 
 
 class ESSearchService:
@@ -106,6 +191,14 @@ class ESSearchService:
             min_content_length=self.min_content_length,
             max_content_length=self.max_content_length
         )
+        # >1 moves large guardrail batches onto a process pool
+        self.guardrails_workers = int(os.getenv("GUARDRAILS_WORKERS", "0"))
+
+        self.categories_cache = CategoriesCache(
+            self.fetch_category_counts,
+            ttl=float(os.getenv("ES_CATEGORIES_TTL", "300")),
+            stale_ttl=float(os.getenv("ES_CATEGORIES_STALE_TTL", "3600"))
+        )
     
     def search_and_save_to_kb(
         self,
@@ -113,7 +206,8 @@ class ESSearchService:
         top_n_per_category: Optional[int] = None,
         categories: Optional[List[str]] = None,
         save_to_postgres: bool = True,
-        created_by: str = "es_search_auto"
+        created_by: str = "es_search_auto",
+        mode: str = "lexical"
     ) -> Dict[str, Any]:
         """
         Search ES, apply guardrails, optionally save to PostgreSQL, and return SFT-ready data.
@@ -124,6 +218,7 @@ class ESSearchService:
             categories: Specific categories to search
             save_to_postgres: Whether to save new knowledge to PostgreSQL
             created_by: Who created the knowledge (for PostgreSQL records)
+            mode: "lexical" (ES only) or "hybrid" (ES fused with the embedding index)
         
         Returns:
             Dict with search results, saved items, and SFT-ready pairs
@@ -131,22 +226,27 @@ class ESSearchService:
         if top_n_per_category is None:
             top_n_per_category = self.default_top_n
             
-        # Search Elasticsearch with deduplication
-        category_results = search_es_by_category(
-            query=query,
-            index_name=self.index_name,
-            top_n_per_category=top_n_per_category,
-            min_content_length=self.min_content_length,
-            categories=categories
-        )
+        if mode == "hybrid":
+            category_results = self._hybrid_search_by_category(query, top_n_per_category, categories)
+        else:
+            # Search Elasticsearch with deduplication
+            category_results = search_es_by_category(
+                query=query,
+                index_name=self.index_name,
+                top_n_per_category=top_n_per_category,
+                min_content_length=self.min_content_length,
+                categories=categories
+            )
+
+        # Apply enhanced guardrails to all categories in one batch
+        all_results = [item for results in category_results.values() for item in results]
+        report = self.guardrails.validate_batch(all_results, workers=self.guardrails_workers)
+        accepted_ids = {id(item) for item in report["accepted"]}
+        rejected_count = len(report["rejected"])
 
-        # Apply enhanced guardrails to filter results
         filtered_results = {}
-        rejected_count = 0
-
         for category, results in category_results.items():
-            filtered = self.guardrails.filter_results(results)
-            rejected_count += len(results) - len(filtered)
+            filtered = [item for item in results if id(item) in accepted_ids]
             if filtered:  # Only include categories with valid results
                 filtered_results[category] = filtered
 
@@ -167,90 +267,161 @@ class ESSearchService:
             "total_results": sum(len(results) for results in filtered_results.values()),
             "categories_found": list(filtered_results.keys()),
             "rejected_by_guardrails": rejected_count,
+            "rejection_reasons": report["rejection_counts"],
             "query": query,
+            "mode": mode,
             "timestamp": datetime.utcnow().isoformat()
         }
     
+    def _hybrid_search_by_category(
+        self,
+        query: str,
+        top_n_per_category: int,
+        categories: Optional[List[str]] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        ES results and embedding-index documents fetched in parallel, fused, regrouped by category.
+
+        Whole-document ES hits and KB rows are matched on content_hash, since ES
+        docs are not guaranteed to carry a KB id. Semantic hits are passages, so
+        they are collapsed to their KB row (best passage rank) first.
+        """
+        backends = {
+            "lexical": lambda: self._flatten_by_score(search_es_by_category(
+                query=query,
+                index_name=self.index_name,
+                top_n_per_category=top_n_per_category,
+                min_content_length=self.min_content_length,
+                categories=categories
+            )),
+        }
+        timeouts = {"lexical": HYBRID_LEXICAL_TIMEOUT_MS}
+        if semantic_enabled() and query.strip() not in ("", "*"):
+            pool_size = top_n_per_category * max(len(categories or []), 1) * 4
+            backends["semantic"] = lambda: self._semantic_documents(query, pool_size, categories)
+            timeouts["semantic"] = HYBRID_SEMANTIC_TIMEOUT_MS
+
+        fused = fuse(fan_out(backends, timeouts), key="content_hash", method=HYBRID_METHOD)
+        category_results: Dict[str, List[Dict[str, Any]]] = {}
+        for item in fused:
+            bucket = category_results.setdefault(item.get("category", "unknown"), [])
+            if len(bucket) < top_n_per_category:
+                bucket.append(item)
+        return category_results
+
+    @staticmethod
+    def _flatten_by_score(category_results: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        return sorted(
+            (item for results in category_results.values() for item in results),
+            key=lambda item: item.get("score", 0),
+            reverse=True,
+        )
+
+    def _semantic_documents(
+        self,
+        query: str,
+        size: int,
+        categories: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Embedding-index hits collapsed to whole KB rows, in best-passage order."""
+        passages = search_semantic_passages(embed_query(query), size=size)
+        kb_ids: List[int] = []
+        for passage in passages:
+            if passage["kb_id"] not in kb_ids:
+                kb_ids.append(passage["kb_id"])
+        if not kb_ids:
+            return []
+
+        db = SessionLocal()
+        try:
+            rows = db.query(KnowledgeBase).filter(KnowledgeBase.id.in_(kb_ids)).all()
+        finally:
+            db.close()
+        by_id = {row.id: row for row in rows}
+        best_score = {}
+        for passage in passages:
+            best_score.setdefault(passage["kb_id"], passage["score"])
+
+        documents = []
+        for kb_id in kb_ids:
+            row = by_id.get(kb_id)
+            if row is None or (categories and row.category not in categories):
+                continue
+            if len(row.content.strip()) < self.min_content_length:
+                continue
+            documents.append({
+                "title": row.title,
+                "content": row.content,
+                "category": row.category,
+                "created_by": row.created_by,
+                "is_active": row.is_active,
+                "kb_id": row.id,
+                "score": best_score[kb_id],
+                "es_id": None,
+                "content_hash": row.content_hash or compute_content_hash(row.content),
+            })
+        return documents
+
     def _save_to_postgres(
         self,
         category_results: Dict[str, List[Dict[str, Any]]],
         created_by: str
     ) -> List[Dict[str, Any]]:
-        """Save new knowledge items to PostgreSQL knowledge_base table with enhanced tracking."""
+        """
+        Save new knowledge items to PostgreSQL knowledge_base table with enhanced tracking.
+
+        Dedup is a single INSERT ... ON CONFLICT DO NOTHING RETURNING against the
+        unique partial index on content_hash, so cost no longer grows with the KB.
+        """
         db = SessionLocal()
-        saved_items = []
         skipped_items = []
-        error_items = []
+        candidates: List[Dict[str, Any]] = []
 
-        try:
-            # Get existing content hashes to avoid duplicates
-            existing_hashes = self._get_existing_content_hashes(db)
-
-            for category, results in category_results.items():
-                for item in results:
-                    content_hash = item.get("content_hash")
-                    title = item.get("title", "").strip()
-                    content = item.get("content", "").strip()
-
-                    # Skip if already exists in PostgreSQL
-                    if content_hash in existing_hashes:
-                        skipped_items.append({
-                            "title": title,
-                            "reason": "duplicate_content_hash",
-                            "content_hash": content_hash
-                        })
-                        continue
-
-                    # Additional validation before saving
-                    if not title or not content:
-                        skipped_items.append({
-                            "title": title or "No title",
-                            "reason": "missing_title_or_content",
-                            "content_hash": content_hash
-                        })
-                        continue
-
-                    try:
-                        # Create new knowledge base entry
-                        kb_item = KnowledgeBase(
-                            title=title[:200],  # Respect DB column limit
-                            content=content,
-                            category=category,
-                            created_by=f"{created_by}_es_auto",  # Mark as ES auto-imported
-                            is_active=True
-                        )
-
-                        db.add(kb_item)
-                        db.flush()  # Get the ID without committing
-
-                        saved_items.append({
-                            "id": kb_item.id,
-                            "title": kb_item.title,
-                            "category": category,
-                            "content_length": len(kb_item.content),
-                            "es_score": item.get("score", 0),
-                            "es_id": item.get("es_id"),
-                            "content_hash": content_hash,
-                            "created_by": kb_item.created_by
-                        })
-
-                        # Add to existing hashes to prevent duplicates in same batch
-                        existing_hashes.add(content_hash)
-
-                    except Exception as item_error:
-                        error_items.append({
-                            "title": title,
-                            "error": str(item_error),
-                            "content_hash": content_hash
-                        })
-                        continue
-
-            # Commit all successful items
-            db.commit()
+        for category, results in category_results.items():
+            for item in results:
+                title = item.get("title", "").strip()
+                content = item.get("content", "").strip()
+                content_hash = compute_content_hash(content)
 
-            # Log summary
-            print(f"PostgreSQL save summary: {len(saved_items)} saved, {len(skipped_items)} skipped, {len(error_items)} errors")
+                # Additional validation before saving
+                if not title or not content:
+                    skipped_items.append({
+                        "title": title or "No title",
+                        "reason": "missing_title_or_content",
+                        "content_hash": content_hash
+                    })
+                    continue
+
+                candidates.append({
+                    "row": {
+                        "title": title[:200],  # Respect DB column limit
+                        "content": content,
+                        "category": category,
+                        "created_by": f"{created_by}_es_auto",  # Mark as ES auto-imported
+                        "is_active": True,
+                        "content_hash": content_hash,
+                    },
+                    "es_score": item.get("score", 0),
+                    "es_id": item.get("es_id"),
+                })
+
+        if not candidates:
+            print(f"PostgreSQL save summary: 0 saved, {len(skipped_items)} skipped")
+            db.close()
+            return []
 
+        try:
+            stmt = (
+                pg_insert(KnowledgeBase)
+                .values([c["row"] for c in candidates])
+                .on_conflict_do_nothing(
+                    index_elements=[KnowledgeBase.content_hash],
+                    index_where=text("is_active"),
+                )
+                .returning(KnowledgeBase.id, KnowledgeBase.content_hash)
+            )
+            inserted = {content_hash: kb_id for kb_id, content_hash in db.execute(stmt)}
+            db.commit()
         except Exception as e:
             db.rollback()
             print(f"Error saving to PostgreSQL: {e}")
@@ -258,22 +429,34 @@ class ESSearchService:
         finally:
             db.close()
 
-        # Return detailed results
-        for item in saved_items:
-            item["save_status"] = "success"
+        saved_items = []
+        for c in candidates:
+            row = c["row"]
+            kb_id = inserted.pop(row["content_hash"], None)
+            if kb_id is None:
+                skipped_items.append({
+                    "title": row["title"],
+                    "reason": "duplicate_content_hash",
+                    "content_hash": row["content_hash"]
+                })
+                continue
+            saved_items.append({
+                "id": kb_id,
+                "title": row["title"],
+                "category": row["category"],
+                "content_length": len(row["content"]),
+                "es_score": c["es_score"],
+                "es_id": c["es_id"],
+                "content_hash": row["content_hash"],
+                "created_by": row["created_by"],
+                "save_status": "success",
+            })
+
+        # Log summary
+        print(f"PostgreSQL save summary: {len(saved_items)} saved, {len(skipped_items)} skipped")
 
         return saved_items
-    
-    def _get_existing_content_hashes(self, db: Session) -> Set[str]:
-        """Get content hashes of existing knowledge base items."""
-        from es_client import _generate_content_hash
-        
-        existing_items = db.query(KnowledgeBase).filter(
-            KnowledgeBase.is_active == True
-        ).all()
-        
-        return {_generate_content_hash(item.content) for item in existing_items}
-    
+
     def _generate_sft_pairs(
         self, 
         category_results: Dict[str, List[Dict[str, Any]]]
@@ -316,35 +499,100 @@ class ESSearchService:
         return sft_pairs
     
     def get_categories(self) -> List[str]:
-        """Get available categories from Elasticsearch."""
+        """Get available categories from Elasticsearch (cached, see CategoriesCache)."""
+        return [item["category"] for item in self.categories_cache.get()["categories"]]
+
+    def fetch_category_counts(self) -> List[Dict[str, Any]]:
+        """Terms aggregation over category: [{"category", "doc_count"}], most documents first."""
         es = get_es_client()
-        
-        try:
-            # Use aggregation to get unique categories
-            search_body = {
-                "size": 0,
-                "aggs": {
-                    "categories": {
-                        "terms": {
-                            "field": "category",
-                            "size": 100
-                        }
+        search_body = {
+            "size": 0,
+            "query": {"term": {"is_active": True}},
+            "aggs": {
+                "categories": {
+                    "terms": {
+                        "field": "category",
+                        "size": CATEGORY_AGG_SIZE
                     }
                 }
             }
-            
-            response = es.search(index=self.index_name, body=search_body)
-            
-            categories = []
-            if "aggregations" in response and "categories" in response["aggregations"]:
-                for bucket in response["aggregations"]["categories"]["buckets"]:
-                    categories.append(bucket["key"])
-            
-            return categories
-            
+        }
+        response = es.search(index=self.index_name, body=search_body)
+        return [
+            {"category": bucket["key"], "doc_count": bucket["doc_count"]}
+            for bucket in response.get("aggregations", {}).get("categories", {}).get("buckets", [])
+        ]
+
+
+class CategoriesCache:
+    """
+    In-memory categories view with TTL and stale-while-revalidate.
+
+    Fresh entries are served straight from memory. Once older than `ttl`, or
+    after an ingest run touched the invalidation stamp, the old value is still
+    served (up to `ttl + stale_ttl`) while a single background thread refreshes
+    it. Only a cold cache, or one past the stale window, waits for ES.
+    """
+
+    def __init__(self, fetch, ttl: float = 300.0, stale_ttl: float = 3600.0):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._value: Optional[Dict[str, Any]] = None
+        self._fetched_at = 0.0
+        self._stamp = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _load(self) -> Dict[str, Any]:
+        stamp = categories_stamp()
+        counts = self.fetch()
+        value = {
+            "categories": counts,
+            "fetched_at": datetime.utcnow().isoformat(),
+        }
+        with self._lock:
+            self._value, self._fetched_at, self._stamp = value, time.monotonic(), stamp
+        return value
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run() -> None:
+            try:
+                self._load()
+            except Exception as e:
+                print(f"Error refreshing categories: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="categories-refresh", daemon=True).start()
+
+    def get(self) -> Dict[str, Any]:
+        """Return {"categories": [{"category", "doc_count"}], "fetched_at", "stale"}."""
+        value = self._value
+        if value is not None:
+            age = time.monotonic() - self._fetched_at
+            outdated = age >= self.ttl or categories_stamp() != self._stamp
+            if not outdated:
+                return {**value, "stale": False}
+            if age < self.ttl + self.stale_ttl:
+                self._refresh_in_background()
+                return {**value, "stale": True}
+        try:
+            return {**self._load(), "stale": False}
         except Exception as e:
             print(f"Error getting categories: {e}")
-            return []
+            if value is not None:
+                return {**value, "stale": True}
+            return {"categories": [], "fetched_at": None, "stale": True}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._fetched_at = time.monotonic() - self.ttl  # next get() refreshes, serving the stale value meanwhile
 
 
 # Global service instance
@@ -0,0 +1,94 @@
+"""
+On-disk cache of extracted document text for the dataset importers.
+
+The manifest maps each source path to its size, mtime, file SHA-1, the hash of
+the cleaned text and the KnowledgeBase row it produced. Cleaned text itself is
+stored content-addressed as <sha1>.txt, so renamed or copied files are never
+re-parsed either. A re-run therefore costs one stat() per unchanged file.
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+
+class ExtractionCache:
+    def __init__(self, cache_dir: str = "data/cache/extract") -> None:
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.manifest: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    @staticmethod
+    def _stat(path: str) -> Dict[str, int]:
+        st = os.stat(path)
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        return self.manifest.get(self._key(path))
+
+    def is_unchanged(self, path: str) -> bool:
+        """True when size and mtime match the manifest (no read needed)."""
+        entry = self.get(path)
+        if entry is None:
+            return False
+        stat = self._stat(path)
+        return entry.get("size") == stat["size"] and entry.get("mtime_ns") == stat["mtime_ns"]
+
+    def touch(self, path: str) -> None:
+        """Refresh the stat fields of a file whose content turned out to be unchanged."""
+        self.manifest[self._key(path)].update(self._stat(path))
+
+    def get_text(self, sha1: str) -> Optional[str]:
+        text_path = os.path.join(self.cache_dir, f"{sha1}.txt")
+        if not os.path.exists(text_path):
+            return None
+        with open(text_path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def put(self, path: str, sha1: str, text: str, text_hash: str) -> None:
+        text_path = os.path.join(self.cache_dir, f"{sha1}.txt")
+        if not os.path.exists(text_path):
+            with open(text_path, "w", encoding="utf-8") as f:
+                f.write(text)
+        entry = self.manifest.setdefault(self._key(path), {})
+        entry.update({**self._stat(path), "sha1": sha1, "text_hash": text_hash})
+
+    def set_kb_id(self, path: str, kb_id: int) -> None:
+        entry = self.get(path)
+        if entry is not None:
+            entry["kb_id"] = kb_id
+
+    def invalidate(self, path: str) -> None:
+        """
+        Make the next run process a file again.
+
+        kb_id is kept: when the failed batch was replacing an older row, that
+        deactivation was rolled back too, and the retry must still replace it.
+        """
+        entry = self.get(path)
+        if entry is not None:
+            for field in ("size", "mtime_ns", "sha1", "text_hash"):
+                entry.pop(field, None)
+
+    def save(self) -> None:
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, self.manifest_path)
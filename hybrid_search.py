@@ -0,0 +1,150 @@
+"""
+Fusion of lexical (ES BM25) and semantic (embedding index) result lists.
+
+Backends run in parallel, each on its own thread pool and with its own
+timeout; a backend that times out or errors is simply left out of the
+fusion, so hybrid search degrades to whichever backend answered. A timed-out
+call keeps running (threads cannot be cancelled), so per-backend pools keep
+a slow embedding server from occupying the workers lexical search needs, and
+the embedding request itself gives up at the semantic timeout. Fusion itself is a
+dictionary pass over a few dozen hits (well under a millisecond).
+
+Methods:
+    rrf       reciprocal-rank fusion, score = sum(w / (k + rank)); scale-free
+    weighted  min-max normalize each backend's scores, then weighted sum
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional
+
+from embedding_index import get_embedding_index
+from lm_client import LMStudioClient
+
+
+RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_METHOD = os.getenv("HYBRID_METHOD", "rrf")
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+HYBRID_SEMANTIC_WEIGHT = float(os.getenv("HYBRID_SEMANTIC_WEIGHT", "1.0"))
+HYBRID_LEXICAL_TIMEOUT_MS = int(os.getenv("HYBRID_LEXICAL_TIMEOUT_MS", "300"))
+HYBRID_SEMANTIC_TIMEOUT_MS = int(os.getenv("HYBRID_SEMANTIC_TIMEOUT_MS", "300"))
+
+HYBRID_WORKERS = int(os.getenv("HYBRID_WORKERS", "8"))  # per backend
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_embed_client: Optional[LMStudioClient] = None
+
+
+def default_weights() -> Dict[str, float]:
+    return {"lexical": HYBRID_LEXICAL_WEIGHT, "semantic": HYBRID_SEMANTIC_WEIGHT}
+
+
+def semantic_enabled() -> bool:
+    """An embedding model is configured and an embedding index has been built."""
+    return bool(os.getenv("LMSTUDIO_EMBEDDING_MODEL")) and get_embedding_index() is not None
+
+
+def _executor(name: str) -> ThreadPoolExecutor:
+    executor = _executors.get(name)
+    if executor is None:
+        executor = _executors.setdefault(
+            name, ThreadPoolExecutor(max_workers=HYBRID_WORKERS, thread_name_prefix=f"hybrid-{name}")
+        )
+    return executor
+
+
+def embed_query(text: str) -> List[float]:
+    """Embed a query with the LM Studio embedding model (sync; runs on the fan-out pool)."""
+    global _embed_client
+    if _embed_client is None:
+        _embed_client = LMStudioClient(
+            base_url=os.getenv("LMSTUDIO_BASE_URL", "http://127.0.0.1:1234/v1"),
+            api_key=os.getenv("LMSTUDIO_API_KEY", "lm-studio"),
+            # A late embedding is useless to fan_out; don't let it hold a worker
+            timeout=HYBRID_SEMANTIC_TIMEOUT_MS / 1000,
+            max_retries=0,
+        )
+    return _embed_client.embed(os.getenv("LMSTUDIO_EMBEDDING_MODEL", ""), [text])[0]
+
+
+def fan_out(
+    backends: Dict[str, Callable[[], List[Dict[str, Any]]]],
+    timeouts_ms: Dict[str, int],
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Run backends concurrently; return {name: results} for those that finished in time.
+
+    Each backend's deadline is measured from submission, so the total wait is
+    bounded by the slowest allowed backend, not the sum.
+    """
+    started = time.perf_counter()
+    futures = {name: _executor(name).submit(fn) for name, fn in backends.items()}
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    for name, future in futures.items():
+        remaining = timeouts_ms[name] / 1000 - (time.perf_counter() - started)
+        try:
+            results[name] = future.result(timeout=max(remaining, 0))
+        except FutureTimeoutError:
+            future.cancel()
+            print(f"Hybrid search: {name} backend exceeded {timeouts_ms[name]} ms, skipped")
+        except Exception as e:
+            print(f"Hybrid search: {name} backend failed, skipped: {e}")
+    return results
+
+
+def rrf_fuse(
+    ranked: Dict[str, List[Dict[str, Any]]],
+    key: str,
+    k: int = RRF_K,
+    weights: Optional[Dict[str, float]] = None,
+) -> List[Dict[str, Any]]:
+    """Reciprocal-rank fusion; items keep the first backend's payload plus "score" and "ranks"."""
+    weights = weights or default_weights()
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for name, hits in ranked.items():
+        weight = weights.get(name, 1.0)
+        for rank, hit in enumerate(hits, start=1):
+            item = fused.get(hit[key])
+            if item is None:
+                item = fused[hit[key]] = {**hit, "score": 0.0, "ranks": {}}
+            item["score"] += weight / (k + rank)
+            item["ranks"][name] = rank
+    return sorted(fused.values(), key=lambda item: item["score"], reverse=True)
+
+
+def weighted_fuse(
+    ranked: Dict[str, List[Dict[str, Any]]],
+    key: str,
+    weights: Optional[Dict[str, float]] = None,
+) -> List[Dict[str, Any]]:
+    """Min-max normalize each backend's scores to [0, 1] and sum them with weights."""
+    weights = weights or default_weights()
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for name, hits in ranked.items():
+        if not hits:
+            continue
+        scores = [hit.get("score") or 0.0 for hit in hits]
+        low, high = min(scores), max(scores)
+        span = (high - low) or 1.0
+        weight = weights.get(name, 1.0)
+        for rank, (hit, score) in enumerate(zip(hits, scores), start=1):
+            item = fused.get(hit[key])
+            if item is None:
+                item = fused[hit[key]] = {**hit, "score": 0.0, "ranks": {}}
+            item["score"] += weight * (score - low) / span
+            item["ranks"][name] = rank
+    return sorted(fused.values(), key=lambda item: item["score"], reverse=True)
+
+
+def fuse(
+    ranked: Dict[str, List[Dict[str, Any]]],
+    key: str,
+    method: str = HYBRID_METHOD,
+    weights: Optional[Dict[str, float]] = None,
+) -> List[Dict[str, Any]]:
+    if method == "weighted":
+        return weighted_fuse(ranked, key, weights)
+    if method == "rrf":
+        return rrf_fuse(ranked, key, weights=weights)
+    raise ValueError(f"Unknown fusion method: {method}")
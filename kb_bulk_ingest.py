@@ -0,0 +1,273 @@
+"""
+Batched, deduplicating writer for knowledge_base imports.
+
+Rows are buffered and flushed as one multi-row
+INSERT ... ON CONFLICT (content_hash) WHERE is_active DO NOTHING RETURNING
+per batch, each in its own transaction, so a bad batch only loses that batch
+and ORM unit-of-work overhead disappears from large imports.
+
+A row can replace an older one (e.g. a modified source file): the old row is
+deactivated in the same transaction as the insert, which also lets the
+incremental ES sync drop it.
+
+With a near_dup.NearDuplicateIndex, rows whose text is a near duplicate of an
+indexed KB row (or of an earlier row in the same run) are skipped too. The
+persisted index is not updated by kb_delete/kb_update or by importers that
+bypass this writer, so matched KB ids are checked against active rows first
+and stale ones are dropped from the index. A skipped row still deactivates
+the row it replaces: the source changed, and its new text already exists.
+"""
+
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select, text, update
+from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database import engine
+from es_client import invalidate_categories
+from models import KnowledgeBase, compute_content_hash
+from near_dup import NearDuplicateIndex, minhash_signature
+
+
+DEFAULT_BATCH_SIZE = int(os.getenv("KB_IMPORT_BATCH_SIZE", "500"))
+
+
+class IngestStats:
+    """Counters and throughput for one import run."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.received = 0
+        self.inserted = 0
+        self.replaced = 0
+        self.duplicates = 0
+        self.near_duplicates = 0
+        self.failed = 0
+        self.batches = 0
+        self.bytes = 0
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.perf_counter() - self.started, 1e-9)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "replaced": self.replaced,
+            "duplicates": self.duplicates,
+            "near_duplicates": self.near_duplicates,
+            "failed": self.failed,
+            "batches": self.batches,
+            "seconds": round(self.elapsed, 2),
+            "rows_per_sec": round(self.received / self.elapsed, 1),
+            "mb_per_sec": round(self.bytes / self.elapsed / 1_000_000, 2),
+        }
+
+    def summary(self) -> str:
+        d = self.as_dict()
+        return (
+            f"{d['inserted']} inserted, {d['replaced']} replaced, {d['duplicates']} duplicates, "
+            f"{d['near_duplicates']} near duplicates, {d['failed']} failed "
+            f"in {d['seconds']}s ({d['rows_per_sec']} rows/s, {d['mb_per_sec']} MB/s)"
+        )
+
+
+class BulkKBWriter:
+    """
+    Buffer KnowledgeBase rows and insert them in committed batches.
+
+    Usage:
+        with BulkKBWriter(batch_size=500) as writer:
+            writer.add("Title", "content...", "category", "importer", meta={"path": path})
+        print(writer.stats.summary())
+        writer.inserted  # meta dicts (plus "id") of rows that were actually inserted
+        writer.existing  # meta dicts (plus "id") of rows skipped because the content already exists
+        writer.failed    # meta dicts of rows lost with a failed batch (incl. skipped rows whose replaces it carried)
+        writer.near_duplicates  # meta dicts (plus "near_duplicate_of", "similarity") of skipped near duplicates
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, near_dup: Optional[NearDuplicateIndex] = None) -> None:
+        self.batch_size = batch_size
+        self.near_dup = near_dup
+        self.near_duplicates: List[Dict[str, Any]] = []
+        self._pending_keys = 0
+        self.stats = IngestStats()
+        self.inserted: List[Dict[str, Any]] = []
+        self.existing: List[Dict[str, Any]] = []
+        self.failed: List[Dict[str, Any]] = []
+        self._replaces: List[int] = []
+        self._rows: List[Dict[str, Any]] = []
+        self._meta: List[Dict[str, Any]] = []
+        self._batch_hashes: set = set()
+        self._active_ids: set = set()  # near-dup matches confirmed active
+        self._skipped_metas: List[Dict[str, Any]] = []  # skipped rows whose replaces is queued
+
+    def __enter__(self) -> "BulkKBWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.flush()
+        if self.stats.inserted or self.stats.replaced:
+            invalidate_categories()
+
+    def add(
+        self,
+        title: str,
+        content: str,
+        category: str,
+        created_by: str,
+        meta: Optional[Dict[str, Any]] = None,
+        replaces: Optional[int] = None,
+    ) -> None:
+        """Queue a row; `replaces` is the id of an older row for the same source to deactivate."""
+        self.stats.received += 1
+        self.stats.bytes += len(content.encode("utf-8"))
+        content_hash = compute_content_hash(content)
+        # Queued before any skip: the source changed, so its old row goes either way
+        if replaces is not None:
+            self._replaces.append(replaces)
+        if content_hash in self._batch_hashes:
+            self.stats.duplicates += 1
+            self._skipped_replacing(replaces, meta)
+            return
+        signature = None
+        if self.near_dup is not None:
+            signature = minhash_signature(content)
+            matches = self._live_matches(
+                self.near_dup.query(signature, exclude=() if replaces is None else (replaces,))
+            )
+            if matches:
+                key, similarity = matches[0]
+                self.stats.near_duplicates += 1
+                self.near_duplicates.append({
+                    **(meta or {}),
+                    "near_duplicate_of": key if isinstance(key, int) else None,  # None: earlier row of this run
+                    "similarity": round(similarity, 3),
+                })
+                self._skipped_replacing(replaces, meta)
+                return
+        self._batch_hashes.add(content_hash)
+        if signature is not None:
+            # Provisional key until the row has an id; lets later rows of the same batch match it
+            self._pending_keys += 1
+            pending_key = ("pending", self._pending_keys)
+            self.near_dup.insert(pending_key, signature)
+            meta = {**(meta or {}), "_near_dup_key": pending_key}
+        self._rows.append({
+            "title": title[:200],  # Respect DB column limits
+            "content": content,
+            "category": category[:100],
+            "created_by": created_by[:100],
+            "is_active": True,
+            "content_hash": content_hash,
+        })
+        self._meta.append(meta or {})
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def _skipped_replacing(self, replaces: Optional[int], meta: Optional[Dict[str, Any]]) -> None:
+        """Track a skipped row whose deactivation rides in the next batch (reported failed if it fails)."""
+        if replaces is None:
+            return
+        self._skipped_metas.append(meta or {})
+        if len(self._replaces) >= self.batch_size:
+            self.flush()
+
+    def _live_matches(self, matches: List[Any]) -> List[Any]:
+        """Drop matches on KB rows that are no longer active (and remove them from the index)."""
+        unknown = [key for key, _ in matches if isinstance(key, int) and key not in self._active_ids]
+        if unknown:
+            with engine.connect() as conn:
+                active = set(conn.scalars(
+                    select(KnowledgeBase.id)
+                    .where(KnowledgeBase.id.in_(unknown))
+                    .where(KnowledgeBase.is_active.is_(True))
+                ))
+            for key in unknown:
+                if key in active:
+                    self._active_ids.add(key)
+                else:
+                    self.near_dup.remove(key)
+        return [m for m in matches if not isinstance(m[0], int) or m[0] in self._active_ids]
+
+    def flush(self) -> None:
+        if not self._rows and not self._replaces:
+            return
+        rows, metas, replaces, skipped = self._rows, self._meta, self._replaces, self._skipped_metas
+        self._rows, self._meta, self._replaces, self._batch_hashes = [], [], [], set()
+        self._skipped_metas = []
+
+        stmt = (
+            pg_insert(KnowledgeBase)
+            .values(rows)
+            .on_conflict_do_nothing(
+                index_elements=[KnowledgeBase.content_hash],
+                index_where=text("is_active"),
+            )
+            .returning(KnowledgeBase.id, KnowledgeBase.content_hash)
+        )
+        try:
+            with engine.begin() as conn:
+                if replaces:
+                    conn.execute(
+                        update(KnowledgeBase)
+                        .where(KnowledgeBase.id.in_(replaces))
+                        .values(is_active=False, updated_at=func.now())
+                    )
+                ids = {content_hash: kb_id for kb_id, content_hash in conn.execute(stmt)} if rows else {}
+                missing = [row["content_hash"] for row in rows if row["content_hash"] not in ids]
+                existing_ids = {}
+                if missing:
+                    existing_ids = {
+                        content_hash: kb_id
+                        for kb_id, content_hash in conn.execute(
+                            select(KnowledgeBase.id, KnowledgeBase.content_hash)
+                            .where(KnowledgeBase.is_active.is_(True))
+                            .where(KnowledgeBase.content_hash.in_(missing))
+                        )
+                    }
+        except Exception as e:
+            self.stats.failed += len(rows)
+            # Skipped rows too: their old row's deactivation was rolled back with the batch
+            self.failed.extend(metas + skipped)
+            if self.near_dup is not None:
+                for meta in metas:
+                    self.near_dup.remove(meta.pop("_near_dup_key", None))
+            print(f"✗ Batch of {len(rows)} rows failed: {e}")
+            return
+
+        self.stats.batches += 1
+        if self.near_dup is not None:
+            self._rekey_near_dup(rows, metas, replaces, ids)
+        self.stats.inserted += len(ids)
+        self.stats.replaced += len(replaces)
+        self.stats.duplicates += len(rows) - len(ids)
+        for row, meta in zip(rows, metas):
+            kb_id = ids.get(row["content_hash"])
+            if kb_id is not None:
+                self.inserted.append({**meta, "id": kb_id})
+            elif row["content_hash"] in existing_ids:
+                self.existing.append({**meta, "id": existing_ids[row["content_hash"]]})
+
+    def _rekey_near_dup(
+        self,
+        rows: List[Dict[str, Any]],
+        metas: List[Dict[str, Any]],
+        replaces: List[int],
+        ids: Dict[str, int],
+    ) -> None:
+        """Move provisional near-dup keys to the new KB ids and drop deactivated rows."""
+        for kb_id in replaces:
+            self.near_dup.remove(kb_id)
+            self._active_ids.discard(kb_id)
+        for row, meta in zip(rows, metas):
+            pending_key = meta.pop("_near_dup_key", None)
+            signature = self.near_dup.signatures.get(pending_key)
+            self.near_dup.remove(pending_key)
+            kb_id = ids.get(row["content_hash"])
+            if kb_id is not None and signature is not None:
+                self.near_dup.insert(kb_id, signature)
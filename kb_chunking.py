@@ -0,0 +1,99 @@
+"""
+Split KnowledgeBase documents into small passages for retrieval.
+
+Slide decks imported by scripts/ingest/import_dataset_to_kb.py carry
+"--- Slide N ---" markers; passages follow slide boundaries first and are
+then cut into word windows with overlap so no passage exceeds max_words.
+"""
+
+import hashlib
+import re
+from typing import Any, Dict, List, Tuple
+
+
+# clean_content() rewrites a leading "-" into "• ", so stored markers may look
+# like "• -- Slide 3 ---"; accept any non-word prefix.
+SLIDE_MARKER = re.compile(r"^\W*-+\s*Slide\s+(\d+)\s*-+\s*$", re.MULTILINE)
+
+
+def split_slides(content: str) -> List[Tuple[int, str]]:
+    """Return [(slide_number, text)]; documents without markers become a single slide 0."""
+    matches = list(SLIDE_MARKER.finditer(content))
+    if not matches:
+        return [(0, content.strip())] if content.strip() else []
+
+    slides = []
+    preamble = content[: matches[0].start()].strip()
+    if preamble:
+        slides.append((0, preamble))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(content)
+        text = content[match.end():end].strip()
+        if text:
+            slides.append((int(match.group(1)), text))
+    return slides
+
+
+def _windows(words: List[str], max_words: int, overlap: int) -> List[List[str]]:
+    step = max(1, max_words - overlap)
+    windows = []
+    for start in range(0, len(words), step):
+        windows.append(words[start:start + max_words])
+        if start + max_words >= len(words):
+            break
+    return windows
+
+
+def chunk_document(
+    content: str,
+    max_words: int = 200,
+    overlap_words: int = 40,
+) -> List[Dict[str, Any]]:
+    """
+    Chunk a document into passages.
+
+    Consecutive small slides are merged until max_words; slides longer than
+    max_words are split into overlapping windows. Each passage is
+    {"chunk_index", "slide_start", "slide_end", "text", "chunk_hash"}.
+    """
+    pieces: List[Tuple[int, int, str]] = []
+    buffer: List[str] = []
+    buffer_words = 0
+    buffer_start = buffer_end = 0
+
+    def flush() -> None:
+        nonlocal buffer, buffer_words
+        if buffer:
+            pieces.append((buffer_start, buffer_end, "\n\n".join(buffer)))
+        buffer, buffer_words = [], 0
+
+    for slide_number, text in split_slides(content):
+        words = text.split()
+        if len(words) > max_words:
+            flush()
+            for window in _windows(words, max_words, overlap_words):
+                pieces.append((slide_number, slide_number, " ".join(window)))
+            continue
+        if buffer_words + len(words) > max_words:
+            flush()
+        if not buffer:
+            buffer_start = slide_number
+        buffer.append(text)
+        buffer_words += len(words)
+        buffer_end = slide_number
+    flush()
+
+    return [
+        {
+            "chunk_index": i,
+            "slide_start": start,
+            "slide_end": end,
+            "text": text,
+            "chunk_hash": hashlib.md5(text.encode("utf-8")).hexdigest(),
+        }
+        for i, (start, end, text) in enumerate(pieces)
+    ]
+
+
+def passage_id(kb_id: int, chunk_index: int) -> str:
+    return f"{kb_id}:{chunk_index}"
@@ -0,0 +1,57 @@
+"""
+Bounded-memory scans over knowledge_base.
+
+Pages with keyset pagination on the primary key (WHERE id > :last ORDER BY id
+LIMIT :n) instead of OFFSET, and selects only the requested columns, so a full
+pass over a large table costs O(n) and holds at most one batch in memory.
+"""
+
+from typing import Any, Iterator, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import KnowledgeBase
+
+
+def scan_knowledge_base(
+    columns: Sequence[str] = ("id", "title", "content", "category", "created_by", "is_active"),
+    active_only: bool = True,
+    filters: Sequence[Any] = (),
+    batch_size: int = 1000,
+    session: Optional[Session] = None,
+) -> Iterator[Any]:
+    """
+    Yield KnowledgeBase rows as lightweight Row tuples (attribute access by column name).
+
+    Args:
+        columns: Column names to load; "id" is always included for the keyset.
+        active_only: Restrict to is_active rows.
+        filters: Extra SQLAlchemy where-clauses, e.g. KnowledgeBase.updated_at >= since.
+        batch_size: Rows fetched per round trip.
+        session: Reuse an existing session instead of opening (and closing) one.
+    """
+    names = list(columns) if "id" in columns else ["id", *columns]
+    selected = [getattr(KnowledgeBase, name) for name in names]
+
+    own_session = session is None
+    db = session or SessionLocal()
+    try:
+        last_id = 0
+        while True:
+            stmt = select(*selected).where(KnowledgeBase.id > last_id)
+            if active_only:
+                stmt = stmt.where(KnowledgeBase.is_active.is_(True))
+            for clause in filters:
+                stmt = stmt.where(clause)
+            rows = db.execute(stmt.order_by(KnowledgeBase.id).limit(batch_size)).all()
+            if not rows:
+                break
+            yield from rows
+            last_id = rows[-1].id
+            if len(rows) < batch_size:
+                break
+    finally:
+        if own_session:
+            db.close()
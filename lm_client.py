@@ -1,6 +1,8 @@
-from typing import List, Dict, Any
+import os
+from typing import List, Dict, Any, Optional, AsyncIterator
 
-from openai import OpenAI
+import httpx
+from openai import OpenAI, AsyncOpenAI
 
 
 class LMStudioClient:
@@ -14,8 +16,20 @@ class LMStudioClient:
         )
     """
 
-    def __init__(self, base_url: str = "http://127.0.0.1:1234/v1", api_key: str = "lm-studio") -> None:
-        self._client = OpenAI(base_url=base_url, api_key=api_key)
+    def __init__(
+        self,
+        base_url: str = "http://127.0.0.1:1234/v1",
+        api_key: str = "lm-studio",
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+    ) -> None:
+        # Unset keeps the openai defaults (600 s timeout, 2 retries)
+        kwargs: Dict[str, Any] = {}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        if max_retries is not None:
+            kwargs["max_retries"] = max_retries
+        self._client = OpenAI(base_url=base_url, api_key=api_key, **kwargs)
 
     def chat(self, model: str, messages: List[Dict[str, Any]], **kwargs: Any) -> str:
         response = self._client.chat.completions.create(
@@ -25,4 +39,114 @@ class LMStudioClient:
         )
         return response.choices[0].message.content
 
+    def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        response = self._client.embeddings.create(model=model, input=texts)
+        return [item.embedding for item in response.data]
 
+
+class AsyncLMStudioClient:
+    """Async twin of LMStudioClient with a pooled keep-alive HTTP client.
+
+    Create it once per process (see get_async_lm_client) and share it between
+    requests, so connections to LM Studio are reused instead of re-opened.
+
+    Usage:
+        client = get_async_lm_client()
+        reply = await client.chat(
+            model="microsoft/phi-4-mini-reasoning",
+            messages=[{"role": "user", "content": "Xin chào"}],
+            timeout=60,
+        )
+    """
+
+    def __init__(
+        self,
+        base_url: str = "http://127.0.0.1:1234/v1",
+        api_key: str = "lm-studio",
+        max_connections: int = 200,
+        max_keepalive_connections: int = 50,
+        timeout: float = 120.0,
+        connect_timeout: float = 5.0,
+    ) -> None:
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+        self._client = AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=self._http)
+
+    async def chat(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> str:
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        response = await self._client.chat.completions.create(
+            model=model,
+            messages=messages,
+            **kwargs,
+        )
+        return response.choices[0].message.content
+
+    async def stream_chat(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        """Yield content deltas as LM Studio generates them (stream=True)."""
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        stream = await self._client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            **kwargs,
+        )
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        finally:
+            await stream.close()
+
+    async def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        response = await self._client.embeddings.create(model=model, input=texts)
+        return [item.embedding for item in response.data]
+
+    async def aclose(self) -> None:
+        await self._client.close()
+
+
+_async_client: Optional[AsyncLMStudioClient] = None
+
+
+def get_async_lm_client() -> AsyncLMStudioClient:
+    """Return the process-wide AsyncLMStudioClient, creating it on first use."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncLMStudioClient(
+            base_url=os.getenv("LMSTUDIO_BASE_URL", "http://127.0.0.1:1234/v1"),
+            api_key=os.getenv("LMSTUDIO_API_KEY", "lm-studio"),
+            max_connections=int(os.getenv("LMSTUDIO_MAX_CONNECTIONS", "200")),
+            max_keepalive_connections=int(os.getenv("LMSTUDIO_MAX_KEEPALIVE", "50")),
+            timeout=float(os.getenv("LMSTUDIO_TIMEOUT", "120")),
+            connect_timeout=float(os.getenv("LMSTUDIO_CONNECT_TIMEOUT", "5")),
+        )
+    return _async_client
+
+
+async def close_async_lm_client() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -1,10 +1,20 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean
+import hashlib
+
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Index, Computed, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import validates
 from sqlalchemy.sql import func
 from datetime import datetime
 
 Base = declarative_base()
 
+
+def compute_content_hash(content: str) -> str:
+    """MD5 of stripped, lowercased content; the dedup key for knowledge_base."""
+    return hashlib.md5((content or "").strip().lower().encode("utf-8")).hexdigest()
+
+
 class ChatHistory(Base):
     __tablename__ = "chat_history"
     
@@ -28,7 +38,39 @@ class KnowledgeBase(Base):
     category = Column(String(100), nullable=False)  # Programming, Database, etc.
     created_by = Column(String(100), nullable=False)  # Faculty who added
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)  # ES sync high-water mark
     is_active = Column(Boolean, default=True)
+    content_hash = Column(String(32), nullable=True)  # compute_content_hash(content), kept in sync below
+    search_vector = Column(
+        TSVECTOR,
+        Computed(
+            "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(content, '')), 'B')",
+            persisted=True,
+        ),
+    )  # full-text search for /kb/search
+
+    __table_args__ = (
+        # One active row per content; inserts use ON CONFLICT DO NOTHING against it
+        Index(
+            "ix_knowledge_base_content_hash_active",
+            "content_hash",
+            unique=True,
+            postgresql_where=text("is_active"),
+        ),
+        Index("ix_knowledge_base_search_vector", "search_vector", postgresql_using="gin"),
+        Index(
+            "ix_knowledge_base_title_trgm",
+            "title",
+            postgresql_using="gin",
+            postgresql_ops={"title": "gin_trgm_ops"},
+        ),
+    )
+
+    @validates("content")
+    def _sync_content_hash(self, key, value):
+        self.content_hash = compute_content_hash(value)
+        return value
 
 class UserProfile(Base):
     __tablename__ = "user_profiles"
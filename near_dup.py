@@ -0,0 +1,216 @@
+"""
+Near-duplicate detection for knowledge_base content (MinHash + LSH banding).
+
+compute_content_hash() only catches byte-identical text (after lowercasing).
+Slide decks that differ by a footer or a re-export survive it, so documents
+are also compared by the Jaccard similarity of their word 5-gram shingles,
+estimated with MinHash signatures. An LSH index splits each signature into
+bands; only documents sharing at least one band bucket are compared, so a
+lookup touches a handful of candidates instead of the whole corpus.
+
+With the defaults (128 permutations = 16 bands x 8 rows) a pair at Jaccard
+0.8 becomes a candidate with probability ~0.9999, one at 0.5 with ~0.06.
+Candidates are then checked against NEAR_DUP_THRESHOLD.
+
+Used by:
+    kb_bulk_ingest.BulkKBWriter(near_dup=...)   incremental, during ingest
+    scripts/ingest/dedup_kb_near_duplicates.py  batch over knowledge_base
+    scripts/sft/kb_to_sft.py --near-dup         drop near-duplicates from SFT exports
+"""
+
+import os
+import pickle
+import re
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, Hashable, Iterable, List, Set, Tuple
+
+import numpy as np
+
+
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.8"))
+NEAR_DUP_INDEX_PATH = os.getenv("NEAR_DUP_INDEX_PATH", "data/index/near_dup.pkl")
+NUM_PERM = 128
+BANDS = 16
+SHINGLE_WORDS = 5
+
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_SHIFT = np.uint64(32)
+_rng = np.random.RandomState(1)
+# Fixed seed: signatures stay comparable across processes and runs
+_PERM_A = _rng.randint(0, 1 << 63, size=NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)  # odd
+_PERM_B = _rng.randint(0, 1 << 63, size=NUM_PERM, dtype=np.uint64)
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> Set[str]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """NUM_PERM-long uint64 MinHash signature of the text's word shingles."""
+    values = np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles(text)),
+        dtype=np.uint64,
+    )
+    if values.size == 0:
+        return np.full(NUM_PERM, _MAX_HASH, dtype=np.uint64)
+    # Multiply-add-shift hashing: ((a * x + b) mod 2^64) >> 32, 2-independent for
+    # 32-bit x; uint64 arithmetic wraps, so no modulo is needed
+    hashed = (np.outer(values, _PERM_A) + _PERM_B) >> _SHIFT
+    return hashed.min(axis=0)
+
+
+def jaccard_estimate(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+class NearDuplicateIndex:
+    """
+    LSH index of MinHash signatures keyed by KB id (or any hashable key).
+
+    Usage:
+        index = NearDuplicateIndex.load()           # or NearDuplicateIndex()
+        sig = minhash_signature(content)
+        matches = index.query(sig)                  # [(key, similarity)], best first
+        index.insert(kb_id, sig)
+        index.remove(old_kb_id)
+        index.save()
+    """
+
+    def __init__(self, threshold: float = NEAR_DUP_THRESHOLD, bands: int = BANDS) -> None:
+        if NUM_PERM % bands:
+            raise ValueError(f"bands must divide {NUM_PERM}")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self.signatures: Dict[Hashable, np.ndarray] = {}
+        self.buckets: List[Dict[bytes, Set[Hashable]]] = [defaultdict(set) for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def insert(self, key: Hashable, signature: np.ndarray) -> None:
+        if key in self.signatures:
+            self.remove(key)
+        self.signatures[key] = signature
+        for band, band_key in enumerate(self._band_keys(signature)):
+            self.buckets[band][band_key].add(key)
+
+    def remove(self, key: Hashable) -> None:
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, band_key in enumerate(self._band_keys(signature)):
+            bucket = self.buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band][band_key]
+
+    def query(
+        self,
+        signature: np.ndarray,
+        exclude: Iterable[Hashable] = (),
+    ) -> List[Tuple[Hashable, float]]:
+        """Keys whose estimated Jaccard similarity is at least the threshold, best first."""
+        excluded = set(exclude)
+        candidates: Set[Hashable] = set()
+        for band, band_key in enumerate(self._band_keys(signature)):
+            bucket = self.buckets[band].get(band_key)
+            if bucket:
+                candidates.update(bucket)
+        matches = []
+        for key in candidates - excluded:
+            similarity = jaccard_estimate(signature, self.signatures[key])
+            if similarity >= self.threshold:
+                matches.append((key, similarity))
+        return sorted(matches, key=lambda m: m[1], reverse=True)
+
+    def save(self, path: str = NEAR_DUP_INDEX_PATH) -> None:
+        """Persist signatures (buckets are rebuilt on load)."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({"threshold": self.threshold, "bands": self.bands, "signatures": self.signatures}, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = NEAR_DUP_INDEX_PATH) -> "NearDuplicateIndex":
+        """Load a saved index, or return an empty one when none exists yet."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        index = cls(threshold=data["threshold"], bands=data["bands"])
+        for key, signature in data["signatures"].items():
+            index.insert(key, signature)
+        return index
+
+
+def cluster_near_duplicates(
+    docs: Iterable[Tuple[Hashable, str]],
+    threshold: float = NEAR_DUP_THRESHOLD,
+    canonical: str = "oldest",
+) -> Tuple[List[Dict[str, Any]], NearDuplicateIndex]:
+    """
+    Group (key, text) documents into near-duplicate clusters.
+
+    Each document is queried against the index built so far and then
+    inserted, and matches are merged with union-find, so clusters are
+    transitive. The canonical representative is the smallest key
+    ("oldest", matching the exact-duplicate policy of keeping the first
+    active row) or the longest text ("longest").
+
+    Returns (clusters, index). Each cluster is {"canonical", "members",
+    "similarity"}, and only clusters with 2+ members are returned. The
+    index holds every document and can be saved for incremental use.
+    """
+    index = NearDuplicateIndex(threshold=threshold)
+    parent: Dict[Hashable, Hashable] = {}
+    lengths: Dict[Hashable, int] = {}
+    best: Dict[Hashable, float] = {}
+
+    def find(key: Hashable) -> Hashable:
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for key, text in docs:
+        signature = minhash_signature(text)
+        parent[key] = key
+        lengths[key] = len(text)
+        for other, similarity in index.query(signature):
+            root_a, root_b = find(key), find(other)
+            if root_a != root_b:
+                parent[root_a] = root_b
+            best[key] = max(best.get(key, 0.0), similarity)
+            best[other] = max(best.get(other, 0.0), similarity)
+        index.insert(key, signature)
+
+    groups: Dict[Hashable, List[Hashable]] = defaultdict(list)
+    for key in parent:
+        groups[find(key)].append(key)
+
+    clusters = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        if canonical == "longest":
+            representative = max(members, key=lambda k: (lengths[k], -k if isinstance(k, int) else 0))
+        else:
+            representative = min(members)
+        clusters.append({
+            "canonical": representative,
+            "members": sorted(members),
+            "similarity": round(min(best[k] for k in members), 3),
+        })
+    clusters.sort(key=lambda c: len(c["members"]), reverse=True)
+    return clusters, index
@@ -0,0 +1,219 @@
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+
+from sqlalchemy import select
+
+from database import SessionLocal
+from embedding_index import get_embedding_index
+from es_client import async_search_passages, search_passages
+from hybrid_search import (
+    HYBRID_LEXICAL_TIMEOUT_MS,
+    HYBRID_METHOD,
+    HYBRID_SEMANTIC_TIMEOUT_MS,
+    embed_query,
+    fan_out,
+    fuse,
+    semantic_enabled,
+)
+from kb_chunking import chunk_document, passage_id
+from models import KnowledgeBase
+
+
+load_dotenv()
+
+
+RAG_ENABLED = os.getenv("RAG_ENABLED", "true").lower() in ("1", "true", "yes")
+# Chunked passages (scripts/ingest/index_kb_passages_to_es.py); set RAG_INDEX to
+# the whole-document KB index to retrieve full documents instead.
+RAG_INDEX = os.getenv("RAG_INDEX", os.getenv("KB_PASSAGES_INDEX", "kb_passages"))
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+RAG_TOKEN_BUDGET = int(os.getenv("RAG_TOKEN_BUDGET", "1500"))
+RAG_TIMEOUT_MS = int(os.getenv("RAG_TIMEOUT_MS", "300"))
+# "hybrid" fuses BM25 and embedding-index passages; without an embedding
+# model/index it uses the async lexical path, and if the semantic backend is
+# too slow the lexical results are used alone.
+RAG_MODE = os.getenv("RAG_MODE", "hybrid")
+# Must match the chunking used by scripts/ingest/build_embedding_index.py
+PASSAGE_MAX_WORDS = int(os.getenv("PASSAGE_MAX_WORDS", "200"))
+PASSAGE_OVERLAP_WORDS = int(os.getenv("PASSAGE_OVERLAP_WORDS", "40"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) so packing needs no tokenizer."""
+    return max(1, len(text) // 4)
+
+
+def pack_passages(
+    passages: List[Dict[str, Any]],
+    token_budget: int = RAG_TOKEN_BUDGET,
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Pack passages in score order into a numbered context block under token_budget.
+
+    The last passage that does not fit whole is truncated to the remaining budget.
+    Returns (context_text, passages_used).
+    """
+    blocks: List[str] = []
+    used: List[Dict[str, Any]] = []
+    remaining = token_budget
+
+    for passage in passages:
+        content = passage.get("content", "").strip()
+        if not content:
+            continue
+        header = f"[{len(used) + 1}] {passage.get('title', '').strip()}"
+        start, end = passage.get("slide_start"), passage.get("slide_end")
+        if start:
+            header += f" (slide {start})" if start == end else f" (slides {start}-{end})"
+        cost = estimate_tokens(header) + estimate_tokens(content)
+        if cost > remaining:
+            room_chars = (remaining - estimate_tokens(header)) * 4
+            if room_chars < 200:  # not worth a fragment
+                break
+            content = content[:room_chars].rsplit(" ", 1)[0] + " ..."
+            cost = remaining
+        blocks.append(f"{header}\n{content}")
+        used.append(passage)
+        remaining -= cost
+        if remaining <= 0:
+            break
+
+    return "\n\n".join(blocks), used
+
+
+def search_semantic_passages(
+    query_vector: List[float],
+    size: int = 5,
+    nprobe: int = 8,
+) -> List[Dict[str, Any]]:
+    """
+    Cosine top-k over the local embedding index (embedding_index.py).
+
+    The index only stores (kb_id, chunk_index); passage text is rebuilt by
+    re-chunking the matched KB rows, which is deterministic. Hits have the
+    same shape as es_client.search_passages, with es_id "<kb_id>:<chunk_index>".
+    Rows deactivated since the index was built are dropped.
+    """
+    index = get_embedding_index()
+    if index is None:
+        return []
+    hits = index.search(query_vector, k=size, nprobe=nprobe)
+    if not hits:
+        return []
+
+    kb_ids = sorted({hit["kb_id"] for hit in hits})
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(KnowledgeBase.id, KnowledgeBase.title, KnowledgeBase.content, KnowledgeBase.category)
+            .where(KnowledgeBase.id.in_(kb_ids))
+            .where(KnowledgeBase.is_active.is_(True))
+        ).all()
+    finally:
+        db.close()
+    by_id = {row.id: row for row in rows}
+    chunks = {
+        row.id: chunk_document(row.content, max_words=PASSAGE_MAX_WORDS, overlap_words=PASSAGE_OVERLAP_WORDS)
+        for row in rows
+    }
+
+    passages = []
+    for hit in hits:
+        row = by_id.get(hit["kb_id"])
+        row_chunks = chunks.get(hit["kb_id"], [])
+        if row is None or hit["chunk_index"] >= len(row_chunks):
+            continue
+        chunk = row_chunks[hit["chunk_index"]]
+        passages.append({
+            "es_id": passage_id(row.id, chunk["chunk_index"]),
+            "title": row.title,
+            "content": chunk["text"],
+            "category": row.category,
+            "kb_id": row.id,
+            "slide_start": chunk["slide_start"],
+            "slide_end": chunk["slide_end"],
+            "score": hit["score"],
+        })
+    return passages
+
+
+def search_hybrid_passages(
+    query: str,
+    index_name: str = RAG_INDEX,
+    size: int = 5,
+    method: str = HYBRID_METHOD,
+    lexical_timeout_ms: int = HYBRID_LEXICAL_TIMEOUT_MS,
+    semantic_timeout_ms: int = HYBRID_SEMANTIC_TIMEOUT_MS,
+) -> List[Dict[str, Any]]:
+    """
+    BM25 passages and embedding-index passages fetched in parallel and fused.
+
+    Both backends return passage ids "<kb_id>:<chunk_index>", so fusion keys on
+    es_id. Each backend contributes 2 * size candidates.
+    """
+    backends = {
+        "lexical": lambda: search_passages(
+            query, index_name=index_name, size=size * 2, request_timeout=lexical_timeout_ms / 1000
+        ),
+    }
+    timeouts = {"lexical": lexical_timeout_ms}
+    if semantic_enabled():
+        backends["semantic"] = lambda: search_semantic_passages(embed_query(query), size=size * 2)
+        timeouts["semantic"] = semantic_timeout_ms
+    ranked = fan_out(backends, timeouts)
+    return fuse(ranked, key="es_id", method=method)[:size]
+
+
+async def retrieve_context(question: str) -> Optional[str]:
+    """
+    Retrieve and pack KB passages for a chat question within the RAG latency budget.
+
+    Returns None when RAG is disabled, nothing matched, or retrieval is slow/unavailable,
+    so chat always falls back to answering without context.
+    """
+    if not RAG_ENABLED:
+        return None
+
+    timeout = RAG_TIMEOUT_MS / 1000
+    if RAG_MODE == "hybrid" and semantic_enabled():
+        search = run_in_threadpool(
+            search_hybrid_passages,
+            question,
+            index_name=RAG_INDEX,
+            size=RAG_TOP_K,
+            lexical_timeout_ms=RAG_TIMEOUT_MS,
+            semantic_timeout_ms=RAG_TIMEOUT_MS,
+        )
+        timeout += 0.05  # backends are bounded by the fan-out; leave room for fusion
+    else:
+        search = async_search_passages(
+            question,
+            index_name=RAG_INDEX,
+            size=RAG_TOP_K,
+            request_timeout=timeout,
+        )
+    try:
+        passages = await asyncio.wait_for(search, timeout=timeout)
+    except asyncio.TimeoutError:
+        print(f"RAG retrieval exceeded {RAG_TIMEOUT_MS} ms, answering without context")
+        return None
+    except Exception as e:
+        print(f"RAG retrieval error: {e}")
+        return None
+
+    context, _ = pack_passages(passages)
+    return context or None
+
+
+def build_system_prompt(context: Optional[str]) -> str:
+    base = "You are a helpful assistant."
+    if not context:
+        return base
+    return (
+        f"{base} Use the following knowledge base passages when they are relevant "
+        f"to the question, and say so when they are not.\n\n{context}"
+    )
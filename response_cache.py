@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+try:
+    import redis.asyncio as aioredis
+except Exception:  # pragma: no cover
+    aioredis = None  # type: ignore
+
+
+load_dotenv()
+
+
+EmbedFn = Callable[[str], Awaitable[List[float]]]
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so trivial variants share a key."""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def temperature_bucket(temperature: float, step: float = 0.1) -> str:
+    return f"{round(temperature / step) * step:.2f}"
+
+
+def context_fingerprint(context: Optional[str]) -> str:
+    if not context:
+        return "-"
+    return hashlib.md5(context.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with per-entry TTL."""
+
+    def __init__(self, max_entries: int = 2048) -> None:
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: int) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def clear(self) -> None:
+        self._data.clear()
+
+    def size(self) -> int:
+        return len(self._data)
+
+
+class RedisCacheBackend:
+    """Shared cache backend so every uvicorn worker sees the same entries."""
+
+    def __init__(self, url: str, prefix: str = "hannah:chat:") -> None:
+        if aioredis is None:
+            raise RuntimeError("redis package not installed. Install with: pip install redis")
+        self._redis = aioredis.from_url(url)
+        self.prefix = prefix
+        self.evictions = 0  # Redis evicts on its own (maxmemory-policy)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = await self._redis.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: int) -> None:
+        await self._redis.set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=ttl)
+
+    async def clear(self) -> None:
+        async for key in self._redis.scan_iter(match=self.prefix + "*"):
+            await self._redis.delete(key)
+
+    def size(self) -> int:
+        return -1  # unknown without a SCAN
+
+
+class ResponseCache:
+    """
+    Answer cache in front of LM Studio.
+
+    Entries are keyed on normalized question + model + temperature bucket +
+    retrieved-context fingerprint. Exact hits are a single backend lookup.
+    When an embedding function is configured, a miss falls back to cosine
+    similarity against recently stored questions with the same model,
+    temperature bucket and context (the "scope").
+    """
+
+    def __init__(
+        self,
+        backend: Any,
+        ttl: int = 3600,
+        embed_fn: Optional[EmbedFn] = None,
+        similarity_threshold: float = 0.92,
+        max_semantic_entries: int = 512,
+    ) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self.max_semantic_entries = max_semantic_entries
+        # key -> (scope, unit-length embedding); process-local even with a shared backend
+        self._vectors: "OrderedDict[str, Tuple[str, np.ndarray]]" = OrderedDict()
+        # _vectors stacked for one matmul per lookup; rebuilt after entries change
+        self._matrix: Optional[Tuple[List[str], np.ndarray, np.ndarray]] = None
+        # Recent question embeddings, so a miss followed by store() embeds only once
+        self._recent_embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "errors": 0}
+
+    @staticmethod
+    def _scope(model: str, temperature: float, context: Optional[str]) -> str:
+        return f"{model}|{temperature_bucket(temperature)}|{context_fingerprint(context)}"
+
+    @staticmethod
+    def _key(scope: str, question: str) -> str:
+        raw = f"{scope}|{normalize_question(question)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def _embed(self, question: str) -> Optional[np.ndarray]:
+        if self.embed_fn is None:
+            return None
+        normalized = normalize_question(question)
+        cached = self._recent_embeddings.get(normalized)
+        if cached is not None:
+            return cached
+        vector = np.asarray(await self.embed_fn(normalized), dtype=np.float32)
+        vector /= float(np.linalg.norm(vector)) or 1.0
+        self._recent_embeddings[normalized] = vector
+        while len(self._recent_embeddings) > 256:
+            self._recent_embeddings.popitem(last=False)
+        return vector
+
+    async def lookup(
+        self,
+        question: str,
+        model: str,
+        temperature: float,
+        context: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Return {"answer", "match", "similarity"} on a hit, None on a miss."""
+        scope = self._scope(model, temperature, context)
+        key = self._key(scope, question)
+        try:
+            value = await self.backend.get(key)
+            if value is not None:
+                self.stats["exact_hits"] += 1
+                return {"answer": value["answer"], "match": "exact", "similarity": 1.0}
+
+            query = await self._embed(question)
+            if query is not None and self._vectors:
+                best_key, best_sim = self._nearest(scope, query)
+                if best_key is not None and best_sim >= self.similarity_threshold:
+                    value = await self.backend.get(best_key)
+                    if value is not None:
+                        self._vectors.move_to_end(best_key)
+                        self.stats["semantic_hits"] += 1
+                        return {"answer": value["answer"], "match": "semantic", "similarity": best_sim}
+                    self._vectors.pop(best_key, None)  # expired in the backend
+                    self._matrix = None
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Response cache lookup error: {e}")
+
+        self.stats["misses"] += 1
+        return None
+
+    def _nearest(self, scope: str, query: np.ndarray) -> Tuple[Optional[str], float]:
+        """Most similar stored question in `scope`: one matmul over the stacked vectors."""
+        if self._matrix is None:
+            keys = list(self._vectors)
+            scopes = np.array([self._vectors[k][0] for k in keys])
+            self._matrix = (keys, scopes, np.stack([self._vectors[k][1] for k in keys]))
+        keys, scopes, matrix = self._matrix
+        rows = np.flatnonzero(scopes == scope)
+        if not len(rows):
+            return None, 0.0
+        sims = matrix[rows] @ query
+        best = int(np.argmax(sims))
+        return keys[rows[best]], float(sims[best])
+
+    async def store(
+        self,
+        question: str,
+        model: str,
+        temperature: float,
+        answer: str,
+        context: Optional[str] = None,
+    ) -> None:
+        if not answer:
+            return
+        scope = self._scope(model, temperature, context)
+        key = self._key(scope, question)
+        try:
+            await self.backend.set(key, {"answer": answer, "question": question}, self.ttl)
+            vector = await self._embed(question)
+            if vector is not None:
+                self._vectors[key] = (scope, vector)
+                self._vectors.move_to_end(key)
+                while len(self._vectors) > self.max_semantic_entries:
+                    self._vectors.popitem(last=False)
+                self._matrix = None
+            self.stats["stores"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Response cache store error: {e}")
+
+    async def clear(self) -> None:
+        await self.backend.clear()
+        self._vectors.clear()
+        self._matrix = None
+        self._recent_embeddings.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+        total = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "entries": self.backend.size(),
+            "semantic_entries": len(self._vectors),
+            "evictions": self.backend.evictions,
+        }
+
+
+def build_response_cache(embed_fn: Optional[EmbedFn] = None) -> Optional[ResponseCache]:
+    """Build the cache from environment settings; None when CHAT_CACHE_ENABLED is off."""
+    if os.getenv("CHAT_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    backend_name = os.getenv("CHAT_CACHE_BACKEND", "memory")
+    if backend_name == "redis":
+        backend: Any = RedisCacheBackend(os.getenv("CHAT_CACHE_REDIS_URL", "redis://127.0.0.1:6379/0"))
+    else:
+        backend = MemoryCacheBackend(max_entries=int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "2048")))
+    return ResponseCache(
+        backend=backend,
+        ttl=int(os.getenv("CHAT_CACHE_TTL", "3600")),
+        embed_fn=embed_fn,
+        similarity_threshold=float(os.getenv("CHAT_CACHE_SIMILARITY_THRESHOLD", "0.92")),
+        max_semantic_entries=int(os.getenv("CHAT_CACHE_SEMANTIC_MAX_ENTRIES", "512")),
+    )
@@ -6,11 +6,145 @@ Daily Training Agent - Tự động chạy daily training pipeline
 import os
 import sys
 import json
+import hashlib
+import tempfile
 import subprocess
 import logging
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+
+
+MERGE_PARTITION_BYTES = int(os.getenv("MERGE_PARTITION_BYTES", str(256 * 1024 * 1024)))
+MERGE_MAX_PARTITIONS = int(os.getenv("MERGE_MAX_PARTITIONS", "256"))
+# "brace": chỉ kiểm tra dòng có dạng {...}; "json": parse đầy đủ (orjson nếu có)
+MERGE_VALIDATE = os.getenv("MERGE_VALIDATE", "brace")
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+def _valid_line(line: bytes, validate: str) -> bool:
+    if not (line.startswith(b"{") and line.endswith(b"}")):
+        return False
+    if validate == "json":
+        try:
+            return isinstance(_json_loads(line), dict)
+        except ValueError:
+            return False
+    return True
+
+
+def _line_key(line: bytes) -> bytes:
+    return hashlib.blake2b(line, digest_size=16).digest()
+
+
+def merge_jsonl_sources(
+    sources: List[Tuple[str, Path]],
+    output_file: Path,
+    partition_bytes: int = MERGE_PARTITION_BYTES,
+    validate: str = MERGE_VALIDATE,
+) -> Dict:
+    """
+    Stream-merge JSONL sources into output_file, dropping exact duplicate lines.
+
+    Lines are copied as raw bytes (no JSON round-trip); duplicates are found by
+    a 16-byte blake2b digest of the stripped line, first occurrence wins.
+
+    When the sources total at most partition_bytes the merge is one pass with
+    an in-memory digest set, preserving source order. Larger inputs are first
+    hash-partitioned into temp files so that each partition's digest set fits
+    in memory, then deduped partition by partition; memory is bounded by
+    partition_bytes, and output is grouped by partition (order within a
+    partition is kept, which is enough since training shuffles anyway).
+
+    The output is written to a temp file next to output_file and moved into
+    place with os.replace, so output_file may also be one of the sources.
+    """
+    started = datetime.now()
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    existing = [(name, path) for name, path in sources if path.exists()]
+    total_bytes = sum(path.stat().st_size for _, path in existing)
+    partitions = min(max(1, -(-total_bytes // max(partition_bytes, 1))), MERGE_MAX_PARTITIONS)
+
+    counts = {
+        name: {"read": 0, "written": 0, "duplicates": 0, "invalid": 0}
+        for name, _ in sources
+    }
+
+    def source_lines():
+        for index, (name, path) in enumerate(existing):
+            with open(path, 'rb', buffering=1024 * 1024) as f:
+                for raw in f:
+                    line = raw.strip()
+                    if not line:
+                        continue
+                    counts[name]["read"] += 1
+                    if not _valid_line(line, validate):
+                        counts[name]["invalid"] += 1
+                        continue
+                    yield index, name, line
+
+    fd, tmp_path = tempfile.mkstemp(prefix=output_file.name + ".", suffix=".tmp", dir=output_file.parent)
+    try:
+        with os.fdopen(fd, 'wb', buffering=1024 * 1024) as out:
+            if partitions == 1:
+                seen = set()
+                for _, name, line in source_lines():
+                    key = _line_key(line)
+                    if key in seen:
+                        counts[name]["duplicates"] += 1
+                        continue
+                    seen.add(key)
+                    out.write(line + b"\n")
+                    counts[name]["written"] += 1
+            else:
+                with tempfile.TemporaryDirectory(prefix="merge_", dir=output_file.parent) as part_dir:
+                    part_paths = [Path(part_dir) / f"part_{i:03d}" for i in range(partitions)]
+                    part_files = [open(p, 'wb', buffering=256 * 1024) for p in part_paths]
+                    try:
+                        for index, _, line in source_lines():
+                            key = _line_key(line)
+                            part = int.from_bytes(key[:4], "little") % partitions
+                            part_files[part].write(b"%d\t%s\n" % (index, line))
+                    finally:
+                        for f in part_files:
+                            f.close()
+                    for part_path in part_paths:
+                        seen = set()
+                        with open(part_path, 'rb', buffering=1024 * 1024) as f:
+                            for raw in f:
+                                index, line = raw.rstrip(b"\n").split(b"\t", 1)
+                                name = existing[int(index)][0]
+                                key = _line_key(line)
+                                if key in seen:
+                                    counts[name]["duplicates"] += 1
+                                    continue
+                                seen.add(key)
+                                out.write(line + b"\n")
+                                counts[name]["written"] += 1
+                        part_path.unlink()
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+    return {
+        "timestamp": started.isoformat(),
+        "output": str(output_file),
+        "partitions": partitions,
+        "input_bytes": total_bytes,
+        "written": sum(c["written"] for c in counts.values()),
+        "duplicates": sum(c["duplicates"] for c in counts.values()),
+        "invalid": sum(c["invalid"] for c in counts.values()),
+        "duration_s": round((datetime.now() - started).total_seconds(), 2),
+        "sources": counts,
+    }
 
 
 class DailyTrainingAgent:
@@ -52,7 +186,9 @@ class DailyTrainingAgent:
                 "base_model": "microsoft/Phi-4-mini-instruct",
                 "max_seq_length": 4096,
                 "output_dir": "artifacts/lora",
-                "data_file": "data/daily/latest.jsonl"
+                "data_file": "data/daily/latest.jsonl",
+                "continual": True,
+                "replay_ratio": 0.5
             },
             "lora": {
                 "r": 16,
@@ -114,7 +250,7 @@ class DailyTrainingAgent:
         
         return default_config
     
-    def run_command(self, command: List[str], description: str) -> bool:
+    def run_command(self, command: List[str], description: str, env: Optional[Dict[str, str]] = None) -> bool:
         """Chạy command và log kết quả"""
         self.logger.info(f"🔄 {description}...")
         self.logger.debug(f"Command: {' '.join(command)}")
@@ -123,6 +259,7 @@ class DailyTrainingAgent:
             result = subprocess.run(
                 command,
                 cwd=self.project_root,
+                env={**os.environ, **env} if env else None,
                 capture_output=True,
                 text=True,
                 check=True
@@ -170,55 +307,35 @@ class DailyTrainingAgent:
         return self.run_command(command, "Export dataset data")
     
     def merge_datasets(self) -> bool:
-        """Merge datasets thành training data"""
+        """Merge datasets thành training data (streaming, xem merge_jsonl_sources)"""
         self.logger.info("🔄 Merging datasets...")
         
         try:
             daily_file = self.project_root / "data/daily/latest.jsonl"
-            kb_file = self.project_root / "data/kb_es_sft.jsonl"
-            dataset_file = self.project_root / "data/kb_sft.jsonl"
-            
-            merged_data = []
-            
-            # Add daily data
-            if daily_file.exists():
-                with open(daily_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if line.strip():
-                            merged_data.append(json.loads(line))
-                self.logger.info(f"📊 Added {len(merged_data)} daily samples")
-            
-            # Add KB data
-            if kb_file.exists():
-                kb_count = 0
-                with open(kb_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if line.strip():
-                            merged_data.append(json.loads(line))
-                            kb_count += 1
-                self.logger.info(f"📚 Added {kb_count} KB samples")
+            sources = [
+                ("daily", daily_file),
+                ("kb", self.project_root / "data/kb_es_sft.jsonl"),
+                ("dataset", self.project_root / "data/kb_sft.jsonl"),
+            ]
             
-            # Add dataset data
-            if dataset_file.exists():
-                dataset_count = 0
-                with open(dataset_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if line.strip():
-                            merged_data.append(json.loads(line))
-                            dataset_count += 1
-                self.logger.info(f"📁 Added {dataset_count} dataset samples")
+            stats = merge_jsonl_sources(sources, daily_file)
             
-            # Write merged data
-            merged_file = self.project_root / "data/daily/latest_merged.jsonl"
-            with open(merged_file, 'w', encoding='utf-8') as f:
-                for item in merged_data:
-                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            icons = {"daily": "📊", "kb": "📚", "dataset": "📁"}
+            for name, counts in stats["sources"].items():
+                self.logger.info(
+                    f"{icons.get(name, '📄')} {name}: {counts['written']} added, "
+                    f"{counts['duplicates']} duplicates, {counts['invalid']} invalid "
+                    f"({counts['read']} lines read)"
+                )
             
-            # Update latest file
-            daily_file.unlink(missing_ok=True)
-            merged_file.rename(daily_file)
+            stats_file = daily_file.with_name("merge_stats.json")
+            with open(stats_file, 'w', encoding='utf-8') as f:
+                json.dump(stats, f, indent=2, ensure_ascii=False)
             
-            self.logger.info(f"✅ Merged {len(merged_data)} total samples")
+            self.logger.info(
+                f"✅ Merged {stats['written']} total samples "
+                f"({stats['partitions']} partition(s), {stats['duration_s']}s)"
+            )
             return True
             
         except Exception as e:
@@ -226,9 +343,21 @@ class DailyTrainingAgent:
             return False
     
     def train_lora_model(self) -> bool:
-        """Train LoRA model"""
+        """Train LoRA model (continual: tiếp tục từ adapter hôm trước, chỉ train mẫu mới + replay)"""
+        training = self.config["training"]
+        env = {
+            "SFT_CONTINUAL": "1" if training.get("continual", False) else "0",
+            "SFT_REPLAY_RATIO": str(training.get("replay_ratio", 0.5)),
+        }
         command = [sys.executable, "scripts/train/train_lora_unsloth.py"]
-        return self.run_command(command, "Train LoRA model")
+        return self.run_command(command, "Train LoRA model", env=env)
+    
+    def rollback_adapter(self, version: Optional[str] = None) -> bool:
+        """Rollback LoRA adapter về version trước (hoặc version chỉ định) rồi convert + deploy lại"""
+        command = [sys.executable, "scripts/train/rollback_lora.py", version or "--previous"]
+        if not self.run_command(command, "Rollback LoRA adapter"):
+            return False
+        return self.convert_to_gguf() and self.deploy_to_lm_studio()
     
     def convert_to_gguf(self) -> bool:
         """Convert model to GGUF format"""
@@ -360,6 +489,11 @@ def main():
     """Main function"""
     agent = DailyTrainingAgent()
     
+    # --rollback [version]: khôi phục adapter cũ thay vì chạy pipeline
+    if "--rollback" in sys.argv[1:]:
+        args = sys.argv[sys.argv.index("--rollback") + 1:]
+        sys.exit(0 if agent.rollback_adapter(args[0] if args else None) else 1)
+    
     try:
         success = agent.run_daily_training()
         agent.save_training_report(success)
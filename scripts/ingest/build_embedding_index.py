@@ -0,0 +1,103 @@
+import os
+import sys
+from typing import Any, Dict, List
+
+from embedding_index import EMBEDDING_INDEX_DIR, EmbeddingIndex
+from kb_chunking import chunk_document
+from kb_scan import scan_knowledge_base
+from lm_client import LMStudioClient
+
+
+MODEL = os.getenv("LMSTUDIO_EMBEDDING_MODEL", "")
+DTYPE = os.getenv("EMBEDDING_INDEX_DTYPE", "float32")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+MAX_WORDS = int(os.getenv("PASSAGE_MAX_WORDS", "200"))
+OVERLAP_WORDS = int(os.getenv("PASSAGE_OVERLAP_WORDS", "40"))
+
+
+def open_index(full: bool) -> EmbeddingIndex:
+    if not full and os.path.exists(os.path.join(EMBEDDING_INDEX_DIR, "meta.json")):
+        index = EmbeddingIndex.load(EMBEDDING_INDEX_DIR)
+        if index.model == MODEL:
+            return index
+        print(f"Embedding model changed ({index.model} -> {MODEL}), rebuilding from scratch")
+    return EmbeddingIndex(EMBEDDING_INDEX_DIR, dtype=DTYPE, model=MODEL)
+
+
+def build(full: bool = False, nlist: int = 0) -> Dict[str, int]:
+    """
+    Embed KB passages into the local index.
+
+    Rows whose content_hash matches the hash recorded in the index are
+    skipped, rows that disappeared or were deactivated are removed, so
+    re-runs only embed what changed. Passages are the same chunks as the ES
+    passage index (kb_chunking.chunk_document).
+    """
+    client = LMStudioClient(
+        base_url=os.getenv("LMSTUDIO_BASE_URL", "http://127.0.0.1:1234/v1"),
+        api_key=os.getenv("LMSTUDIO_API_KEY", "lm-studio"),
+    )
+    index = open_index(full)
+    counts = {"seen": 0, "embedded": 0, "unchanged": 0, "removed": 0, "passages": 0}
+    live_ids = set()
+    batch: List[Any] = []  # (row, chunks)
+
+    def flush() -> None:
+        texts = [chunk["text"] for _, chunks in batch for chunk in chunks]
+        vectors = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            vectors.extend(client.embed(MODEL, texts[start:start + EMBED_BATCH_SIZE]))
+        offset = 0
+        for row, chunks in batch:
+            index.add(
+                row.id,
+                [chunk["chunk_index"] for chunk in chunks],
+                vectors[offset:offset + len(chunks)],
+                content_hash=row.content_hash,
+            )
+            offset += len(chunks)
+            counts["passages"] += len(chunks)
+        batch.clear()
+
+    for row in scan_knowledge_base(columns=("content", "content_hash"), batch_size=200):
+        counts["seen"] += 1
+        live_ids.add(str(row.id))
+        if index.docs.get(str(row.id)) == row.content_hash:
+            counts["unchanged"] += 1
+            continue
+        chunks = chunk_document(row.content, max_words=MAX_WORDS, overlap_words=OVERLAP_WORDS)
+        if not chunks:
+            continue
+        batch.append((row, chunks))
+        counts["embedded"] += 1
+        if sum(len(c) for _, c in batch) >= EMBED_BATCH_SIZE * 8:
+            flush()
+    if batch:
+        flush()
+
+    for kb_id in [k for k in index.docs if k not in live_ids]:
+        index.remove(int(kb_id))
+        counts["removed"] += 1
+
+    index.save()
+    if nlist:
+        index.build_ivf(nlist)
+    return counts
+
+
+def main() -> None:
+    if not MODEL:
+        print("❌ Set LMSTUDIO_EMBEDDING_MODEL to the embedding model loaded in LM Studio")
+        sys.exit(1)
+    args = sys.argv[1:]
+    full = "--full" in args
+    nlist = int(args[args.index("--ivf") + 1]) if "--ivf" in args else 0
+    counts = build(full=full, nlist=nlist)
+    print(
+        f"Embedding index at {EMBEDDING_INDEX_DIR}: {counts['seen']} rows read, {counts['embedded']} embedded "
+        f"({counts['passages']} passages), {counts['unchanged']} unchanged, {counts['removed']} removed"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import json
+import os
+import sys
+from typing import Any, Dict, List
+
+from sqlalchemy import update
+from sqlalchemy.sql import func
+
+from database import engine
+from es_client import invalidate_categories
+from kb_scan import scan_knowledge_base
+from models import KnowledgeBase
+from near_dup import NEAR_DUP_INDEX_PATH, NEAR_DUP_THRESHOLD, cluster_near_duplicates
+
+
+REPORT_FILE = os.getenv("NEAR_DUP_REPORT", "data/near_duplicates.json")
+
+
+def find_clusters(canonical: str = "oldest") -> Dict[str, Any]:
+    """Cluster all active KB rows; returns {"clusters", "index", "titles"}."""
+    titles: Dict[int, str] = {}
+
+    def docs():
+        for row in scan_knowledge_base(columns=("title", "content"), batch_size=500):
+            titles[row.id] = row.title
+            yield row.id, row.content
+
+    clusters, index = cluster_near_duplicates(docs(), threshold=NEAR_DUP_THRESHOLD, canonical=canonical)
+    return {"clusters": clusters, "index": index, "titles": titles}
+
+
+def deactivate(kb_ids: List[int]) -> None:
+    """Deactivate rows (bumping updated_at so the incremental ES sync removes them)."""
+    with engine.begin() as conn:
+        for start in range(0, len(kb_ids), 1000):
+            conn.execute(
+                update(KnowledgeBase)
+                .where(KnowledgeBase.id.in_(kb_ids[start:start + 1000]))
+                .values(is_active=False, updated_at=func.now())
+            )
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    apply = "--deactivate" in args
+    canonical = "longest" if "--keep-longest" in args else "oldest"
+
+    result = find_clusters(canonical=canonical)
+    clusters, index, titles = result["clusters"], result["index"], result["titles"]
+    redundant = [kb_id for c in clusters for kb_id in c["members"] if kb_id != c["canonical"]]
+
+    os.makedirs(os.path.dirname(REPORT_FILE) or ".", exist_ok=True)
+    with open(REPORT_FILE, "w", encoding="utf-8") as f:
+        json.dump(
+            [
+                {
+                    **c,
+                    "canonical_title": titles.get(c["canonical"]),
+                    "member_titles": {str(k): titles.get(k) for k in c["members"]},
+                }
+                for c in clusters
+            ],
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+
+    print(f"🔎 {len(titles)} active rows, {len(clusters)} near-duplicate clusters, {len(redundant)} redundant rows")
+    for c in clusters[:10]:
+        print(f"   • #{c['canonical']} {titles.get(c['canonical'])!r}: {len(c['members'])} members (≥{c['similarity']:.0%})")
+    print(f"📝 Report: {REPORT_FILE}")
+
+    if apply and redundant:
+        deactivate(redundant)
+        for kb_id in redundant:
+            index.remove(kb_id)
+        invalidate_categories()
+        print(f"🧹 Deactivated {len(redundant)} rows (keeping the {canonical} row of each cluster)")
+    elif redundant:
+        print("💡 Re-run with --deactivate to deactivate non-canonical rows")
+
+    # Seed the index used by incremental near-dup checks during import (IMPORT_NEAR_DUP=1)
+    index.save(NEAR_DUP_INDEX_PATH)
+    print(f"💾 Near-dup index ({len(index)} docs): {NEAR_DUP_INDEX_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,11 +7,16 @@ Hỗ trợ cả file PowerPoint (.ppt/.pptx) và có thể mở rộng cho các
 import glob
 import os
 import re
-from typing import Optional, Tuple, List
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import chain, islice
+from typing import Dict, Iterator, Optional, Tuple, List
 from pathlib import Path
 
-from database import SessionLocal
-from models import KnowledgeBase
+from extraction_cache import ExtractionCache
+from kb_bulk_ingest import BulkKBWriter, DEFAULT_BATCH_SIZE
+from models import compute_content_hash
+from near_dup import NEAR_DUP_INDEX_PATH, NearDuplicateIndex
 
 
 def extract_text_from_ppt(path: str) -> str:
@@ -124,79 +129,185 @@ def clean_content(content: str) -> str:
     return content.strip()
 
 
+def extract_chunk(paths: List[str]) -> List[dict]:
+    """Worker task: extract + clean một nhóm file, kèm thời gian xử lý từng file"""
+    results = []
+    for path in paths:
+        started = time.perf_counter()
+        try:
+            content = clean_content(extract_text_from_ppt(path))
+            error = None
+        except Exception as e:
+            content, error = "", str(e)
+        results.append({
+            "path": path,
+            "content": content,
+            "error": error,
+            "seconds": time.perf_counter() - started,
+        })
+    return results
+
+
+def iter_extracted(
+    paths: List[str],
+    workers: int = 1,
+    chunksize: int = 2,
+) -> Iterator[dict]:
+    """
+    Extract files song song bằng ProcessPoolExecutor.
+
+    Paths are submitted in chunks of `chunksize`, with at most 2 * workers
+    chunks in flight, so results stream to the DB writer as they finish and
+    memory stays flat no matter how many decks there are.
+    """
+    chunks = [paths[i:i + chunksize] for i in range(0, len(paths), chunksize)]
+    if workers <= 1:
+        for chunk in chunks:
+            yield from extract_chunk(chunk)
+        return
+
+    pending = iter(chunks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {executor.submit(extract_chunk, c) for c in islice(pending, workers * 2)}
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                next_chunk = next(pending, None)
+                if next_chunk is not None:
+                    in_flight.add(executor.submit(extract_chunk, next_chunk))
+                yield from future.result()
+
+
 def import_dataset_directory(
     directory: str,
     created_by: str = "dataset_import",
-    min_content_length: int = 100
+    min_content_length: int = 100,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = 1,
+    chunksize: int = 2,
+    cache_dir: Optional[str] = "data/cache/extract",
+    near_dup_path: Optional[str] = None,
 ) -> Tuple[int, List[dict]]:
     """
     Import toàn bộ dataset từ directory vào knowledge base
+
+    With a cache_dir, files whose size/mtime (or file hash) match the
+    extraction cache are skipped entirely; modified files replace the KB row
+    they produced last time instead of adding a new one.
+    With near_dup_path, decks that are near duplicates of KB content (e.g. a
+    re-export with a different footer) are skipped; build the index first with
+    scripts/ingest/dedup_kb_near_duplicates.py.
     
     Returns:
         Tuple[int, List[dict]]: (total_imported, import_details)
     """
-    session = SessionLocal()
-    count = 0
-    import_details = []
+    cache = ExtractionCache(cache_dir) if cache_dir else None
+
+    # Tìm tất cả file PowerPoint
+    patterns = ["**/*.ppt", "**/*.pptx"]
+    paths = []
+    for pattern in patterns:
+        paths.extend(glob.glob(os.path.join(directory, pattern), recursive=True))
+
+    # Stat walk: decide which files actually need parsing
+    to_extract: List[str] = []
+    cached_results: List[dict] = []
+    file_hashes: Dict[str, str] = {}
+    unchanged = 0
+    for path in paths:
+        if cache is None:
+            to_extract.append(path)
+            continue
+        if cache.is_unchanged(path):
+            unchanged += 1
+            continue
+        sha1 = ExtractionCache.file_hash(path)
+        entry = cache.get(path)
+        if entry is not None and entry.get("sha1") == sha1:
+            cache.touch(path)  # mtime changed, bytes did not
+            unchanged += 1
+            continue
+        file_hashes[path] = sha1
+        text = cache.get_text(sha1)
+        if text is not None:  # renamed/copied file seen before
+            cached_results.append({"path": path, "content": text, "error": None, "seconds": 0.0})
+        else:
+            to_extract.append(path)
+
+    if cache is not None:
+        print(f"🗂️  Extraction cache: {unchanged} unchanged, {len(cached_results)} from cache, {len(to_extract)} to parse")
+
+    near_dup = NearDuplicateIndex.load(near_dup_path) if near_dup_path else None
+
+    timings = []
+    with BulkKBWriter(batch_size=batch_size, near_dup=near_dup) as writer:
+        results = chain(cached_results, iter_extracted(to_extract, workers=workers, chunksize=chunksize))
+        for result in results:
+            path, content = result["path"], result["content"]
+            filename = os.path.basename(path)
+            timings.append((result["seconds"], filename))
+
+            if result["error"]:
+                print(f"✗ Failed to import {path}: {result['error']}")
+                continue
+
+            previous_kb_id = None
+            if cache is not None:
+                previous = dict(cache.get(path) or {})
+                previous_kb_id = previous.get("kb_id")
+                text_hash = compute_content_hash(content)
+                cache.put(path, file_hashes[path], content, text_hash)
+                if previous.get("text_hash") == text_hash:
+                    continue  # file bytes changed but the extracted text did not
+
+            # Skip nếu content quá ngắn
+            if len(content.strip()) < min_content_length:
+                continue
+            
+            # Generate title và category
+            title = os.path.splitext(filename)[0]
+            category = categorize_by_filename(filename)
+            
+            # Queue knowledge base entry (flushed in batches, dedup by content hash)
+            writer.add(
+                title=title,
+                content=content,
+                category=category,
+                created_by=created_by,
+                meta={
+                    "filename": filename,
+                    "title": title,
+                    "category": category,
+                    "content_length": len(content),
+                    "path": path,
+                    "extract_seconds": round(result["seconds"], 3),
+                },
+                replaces=previous_kb_id,
+            )
+            
+            print(f"✓ Extracted: {filename} -> {category} ({result['seconds']:.2f}s)")
+
+    if cache is not None:
+        for item in writer.inserted + writer.existing:
+            cache.set_kb_id(item["path"], item["id"])
+        for item in writer.failed:
+            cache.invalidate(item["path"])
+        cache.save()
+
+    if near_dup is not None:
+        near_dup.save(near_dup_path)
+        for item in writer.near_duplicates:
+            print(f"≈ Near duplicate skipped: {item['filename']} ~ KB #{item['near_duplicate_of'] or '(same run)'} ({item['similarity']:.0%})")
     
-    try:
-        # Tìm tất cả file PowerPoint
-        patterns = ["**/*.ppt", "**/*.pptx"]
-        
-        for pattern in patterns:
-            for path in glob.glob(os.path.join(directory, pattern), recursive=True):
-                try:
-                    # Extract content
-                    content = extract_text_from_ppt(path)
-                    content = clean_content(content)
-                    
-                    # Skip nếu content quá ngắn
-                    if len(content.strip()) < min_content_length:
-                        continue
-                    
-                    # Generate title và category
-                    filename = os.path.basename(path)
-                    title = os.path.splitext(filename)[0]
-                    category = categorize_by_filename(filename)
-                    
-                    # Tạo knowledge base entry
-                    item = KnowledgeBase(
-                        title=title,
-                        content=content,
-                        category=category,
-                        created_by=created_by,
-                        is_active=True,
-                    )
-                    
-                    session.add(item)
-                    count += 1
-                    
-                    # Track import details
-                    import_details.append({
-                        "filename": filename,
-                        "title": title,
-                        "category": category,
-                        "content_length": len(content),
-                        "path": path
-                    })
-                    
-                    print(f"✓ Imported: {filename} -> {category}")
-                    
-                except Exception as e:
-                    print(f"✗ Failed to import {path}: {str(e)}")
-                    continue
-        
-        session.commit()
-        print(f"\n🎉 Successfully imported {count} files from {directory}")
-        
-    except Exception as e:
-        session.rollback()
-        print(f"❌ Import failed: {str(e)}")
-        raise
-    finally:
-        session.close()
+    import_details = writer.inserted
+    print(f"\n🎉 Successfully imported {len(import_details)} files from {directory}")
+    print(f"📈 Throughput: {writer.stats.summary()}")
+    if timings:
+        print("🐢 Slowest files to extract:")
+        for seconds, filename in sorted(timings, reverse=True)[:5]:
+            print(f"   • {filename}: {seconds:.2f}s")
     
-    return count, import_details
+    return len(import_details), import_details
 
 
 def print_import_summary(import_details: List[dict]):
@@ -231,11 +342,17 @@ def main():
     dataset_dir = os.environ.get("DATASET_DIR", r"D:\Data_set")
     created_by = os.environ.get("IMPORT_CREATED_BY", "dataset_import")
     min_length = int(os.environ.get("MIN_CONTENT_LENGTH", "100"))
+    workers = int(os.environ.get("IMPORT_WORKERS", str(os.cpu_count() or 1)))
+    chunksize = int(os.environ.get("IMPORT_CHUNKSIZE", "2"))
+    use_cache = os.environ.get("IMPORT_USE_CACHE", "true").lower() in ("1", "true", "yes")
+    cache_dir = os.environ.get("EXTRACT_CACHE_DIR", "data/cache/extract") if use_cache else None
+    use_near_dup = os.environ.get("IMPORT_NEAR_DUP", "false").lower() in ("1", "true", "yes")
     
     print("🚀 Starting dataset import...")
     print(f"📂 Dataset directory: {dataset_dir}")
     print(f"👤 Created by: {created_by}")
     print(f"📏 Min content length: {min_length}")
+    print(f"⚙️  Extraction workers: {workers}")
     
     if not os.path.exists(dataset_dir):
         print(f"❌ Dataset directory not found: {dataset_dir}")
@@ -245,7 +362,11 @@ def main():
         count, details = import_dataset_directory(
             directory=dataset_dir,
             created_by=created_by,
-            min_content_length=min_length
+            min_content_length=min_length,
+            workers=workers,
+            chunksize=chunksize,
+            cache_dir=cache_dir,
+            near_dup_path=NEAR_DUP_INDEX_PATH if use_near_dup else None,
         )
         
         print_import_summary(details)
@@ -255,6 +376,7 @@ def main():
             print(f"📚 {count} files added to knowledge base")
             print("\n💡 Next steps:")
             print("   1. Run: python scripts/ingest/index_kb_to_es.py")
+            print("      and: python scripts/ingest/index_kb_passages_to_es.py")
             print("   2. Run: python scripts/sft/kb_to_sft.py")
             print("   3. Start training with: python scripts/train/train_lora_unsloth.py")
         else:
@@ -2,31 +2,23 @@ import glob
 import os
 from typing import Optional
 
-from database import SessionLocal
-from models import KnowledgeBase
+from kb_bulk_ingest import BulkKBWriter, DEFAULT_BATCH_SIZE
 
 
-def import_markdown_dir(directory: str, category: str, created_by: str = "import") -> int:
-    session = SessionLocal()
-    count = 0
-    try:
+def import_markdown_dir(
+    directory: str,
+    category: str,
+    created_by: str = "import",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    with BulkKBWriter(batch_size=batch_size) as writer:
         for path in glob.glob(os.path.join(directory, "**", "*.md"), recursive=True):
             with open(path, "r", encoding="utf-8") as f:
                 content = f.read()
             title = os.path.splitext(os.path.basename(path))[0]
-            item = KnowledgeBase(
-                title=title,
-                content=content,
-                category=category,
-                created_by=created_by,
-                is_active=True,
-            )
-            session.add(item)
-            count += 1
-        session.commit()
-    finally:
-        session.close()
-    return count
+            writer.add(title=title, content=content, category=category, created_by=created_by)
+    print(writer.stats.summary())
+    return writer.stats.inserted
 
 
 def main() -> None:
@@ -2,8 +2,7 @@ import glob
 import os
 from typing import Optional, Tuple
 
-from database import SessionLocal
-from models import KnowledgeBase
+from kb_bulk_ingest import BulkKBWriter, DEFAULT_BATCH_SIZE
 
 
 def extract_text_from_ppt(path: str) -> str:
@@ -30,10 +29,9 @@ def import_ppt_dir(
     directory: str,
     category: str,
     created_by: str = "ppt_import",
+    batch_size: int = DEFAULT_BATCH_SIZE,
 ) -> int:
-    session = SessionLocal()
-    count = 0
-    try:
+    with BulkKBWriter(batch_size=batch_size) as writer:
         patterns = ["**/*.ppt", "**/*.pptx"]
         for pattern in patterns:
             for path in glob.glob(os.path.join(directory, pattern), recursive=True):
@@ -41,19 +39,9 @@ def import_ppt_dir(
                 if not content or len(content.strip()) < 50:
                     continue
                 title = os.path.splitext(os.path.basename(path))[0]
-                item = KnowledgeBase(
-                    title=title,
-                    content=content,
-                    category=category,
-                    created_by=created_by,
-                    is_active=True,
-                )
-                session.add(item)
-                count += 1
-        session.commit()
-    finally:
-        session.close()
-    return count
+                writer.add(title=title, content=content, category=category, created_by=created_by)
+    print(writer.stats.summary())
+    return writer.stats.inserted
 
 
 def main() -> None:
@@ -0,0 +1,146 @@
+import os
+from typing import Any, Dict, Iterator, List, Sequence, Set
+
+from es_client import get_es_client, ensure_index, bulk_failures, PASSAGE_MAPPINGS
+from kb_chunking import chunk_document, passage_id
+from kb_scan import scan_knowledge_base
+
+
+INDEX = os.getenv("KB_PASSAGES_INDEX", "kb_passages")
+MAX_WORDS = int(os.getenv("PASSAGE_MAX_WORDS", "200"))
+OVERLAP_WORDS = int(os.getenv("PASSAGE_OVERLAP_WORDS", "40"))
+ROW_BATCH = 200
+
+
+def batch_passage_operations(es, rows: Sequence[Any]) -> List[Dict[str, Any]]:
+    """
+    Build bulk operations for a batch of KB rows, touching only chunks whose hash changed.
+
+    Chunk ids are "<kb_id>:<chunk_index>"; chunks left over from a longer
+    previous version of a document are deleted. When the chunk count
+    changes every chunk is rewritten so chunk_count stays consistent. The
+    stored hashes of the whole batch are fetched with a single mget.
+    """
+    planned = []
+    lookup_ids: List[str] = []
+    for row in rows:
+        chunks = chunk_document(row.content, max_words=MAX_WORDS, overlap_words=OVERLAP_WORDS)
+        ids = [passage_id(row.id, c["chunk_index"]) for c in chunks]
+        planned.append((row, chunks, ids))
+        lookup_ids.extend(ids or [passage_id(row.id, 0)])
+
+    existing: Dict[str, Dict[str, Any]] = {}
+    if lookup_ids:
+        resp = es.mget(index=INDEX, ids=lookup_ids, source=["chunk_hash", "chunk_count"])
+        existing = {doc["_id"]: doc["_source"] for doc in resp["docs"] if doc.get("found")}
+
+    operations: List[Dict[str, Any]] = []
+    for row, chunks, ids in planned:
+        previous_count = max(
+            (existing[i].get("chunk_count", 0) for i in ids or [passage_id(row.id, 0)] if i in existing),
+            default=0,
+        )
+        for doc_id, chunk in zip(ids, chunks):
+            unchanged = existing.get(doc_id, {}).get("chunk_hash") == chunk["chunk_hash"]
+            if unchanged and previous_count == len(chunks):
+                continue
+            operations.append({"index": {"_index": INDEX, "_id": doc_id}})
+            operations.append({
+                "kb_id": row.id,
+                "chunk_index": chunk["chunk_index"],
+                "chunk_count": len(chunks),
+                "slide_start": chunk["slide_start"],
+                "slide_end": chunk["slide_end"],
+                "chunk_hash": chunk["chunk_hash"],
+                "title": row.title,
+                "content": chunk["text"],
+                "category": row.category,
+                "created_by": row.created_by,
+                "is_active": row.is_active,
+            })
+
+        for i in range(len(chunks), previous_count):
+            operations.append({"delete": {"_index": INDEX, "_id": passage_id(row.id, i)}})
+    return operations
+
+
+def indexed_kb_ids(es) -> Iterator[int]:
+    """Every distinct kb_id in the passage index (composite aggregation, paged)."""
+    after = None
+    while True:
+        composite: Dict[str, Any] = {"size": 1000, "sources": [{"kb_id": {"terms": {"field": "kb_id"}}}]}
+        if after:
+            composite["after"] = after
+        resp = es.search(index=INDEX, size=0, aggs={"ids": {"composite": composite}})
+        agg = resp["aggregations"]["ids"]
+        for bucket in agg["buckets"]:
+            yield bucket["key"]["kb_id"]
+        after = agg.get("after_key")
+        if not agg["buckets"] or not after:
+            break
+
+
+def delete_orphans(es, live_ids: Set[int]) -> int:
+    """
+    Delete passages whose KB row is no longer active (deactivated, or deleted
+    outright), which the active-row scan never visits.
+    """
+    orphans = [kb_id for kb_id in indexed_kb_ids(es) if kb_id not in live_ids]
+    deleted = 0
+    for start in range(0, len(orphans), 1000):
+        resp = es.delete_by_query(
+            index=INDEX,
+            query={"terms": {"kb_id": orphans[start:start + 1000]}},
+            conflicts="proceed",
+            refresh=True,
+        )
+        if resp.get("failures"):
+            raise RuntimeError(f"Orphan passage delete failed: {resp['failures'][:3]}")
+        deleted += resp.get("deleted", 0)
+    return deleted
+
+
+def bulk(es, operations: List[Dict[str, Any]]) -> None:
+    failures = bulk_failures(es.bulk(operations=operations))
+    if failures:
+        raise RuntimeError(f"{len(failures)} passage bulk operations failed, e.g. {failures[:3]}")
+
+
+def main() -> None:
+    es = get_es_client()
+    ensure_index(INDEX, mappings=PASSAGE_MAPPINGS)
+    docs = written = deleted = 0
+    live_ids: Set[int] = set()
+    operations: List[Dict[str, Any]] = []
+    rows: List[Any] = []
+
+    def process(batch: List[Any]) -> None:
+        nonlocal docs, written, deleted, operations
+        batch_ops = batch_passage_operations(es, batch)
+        docs += len(batch)
+        written += sum(1 for op in batch_ops if "index" in op)
+        deleted += sum(1 for op in batch_ops if "delete" in op)
+        operations.extend(batch_ops)
+        if len(operations) >= 1000:
+            bulk(es, operations)
+            operations = []
+
+    for row in scan_knowledge_base(batch_size=ROW_BATCH):
+        live_ids.add(row.id)
+        rows.append(row)
+        if len(rows) >= ROW_BATCH:
+            process(rows)
+            rows = []
+    if rows:
+        process(rows)
+    if operations:
+        bulk(es, operations)
+    orphans = delete_orphans(es, live_ids)
+    print(
+        f"Indexed passages into {INDEX}: {docs} docs, {written} chunks written, "
+        f"{deleted} stale chunks deleted, {orphans} passages of inactive/deleted rows removed"
+    )
+
+
+if __name__ == "__main__":
+    main()
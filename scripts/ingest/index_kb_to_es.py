@@ -1,59 +1,172 @@
-from typing import Iterable
+import hashlib
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
 
-from database import SessionLocal
 from models import KnowledgeBase
-from es_client import get_es_client, ensure_index
+from es_client import get_es_client, ensure_index, invalidate_categories, bulk_failures
+from kb_scan import scan_knowledge_base
 
 
 INDEX = "kb_software_engineering"
+STATE_FILE = os.getenv("KB_ES_SYNC_STATE", "data/index_kb_to_es.state.json")
+# Transactions that commit after a later-stamped one would otherwise fall
+# behind the high-water mark; each run re-reads this window (unchanged rows
+# are skipped by the sync_hash stored in their ES doc)
+SYNC_LAG_SECONDS = int(os.getenv("KB_ES_SYNC_LAG_SECONDS", "300"))
 
 
-def fetch_rows(batch_size: int = 500) -> Iterable[KnowledgeBase]:
-    session = SessionLocal()
-    try:
-        offset = 0
-        while True:
-            rows = (
-                session.query(KnowledgeBase)
-                .filter(KnowledgeBase.is_active.is_(True))
-                .order_by(KnowledgeBase.id)
-                .offset(offset)
-                .limit(batch_size)
-                .all()
-            )
-            if not rows:
-                break
-            for r in rows:
-                yield r
-            offset += len(rows)
-    finally:
-        session.close()
+def fetch_rows(
+    batch_size: int = 1000,
+    since: Optional[datetime] = None,
+) -> Iterable[Any]:
+    """Active rows for a full sync, or every row touched at/after `since` (active or not)."""
+    return scan_knowledge_base(
+        columns=("id", "title", "content", "category", "created_by", "is_active", "updated_at", "content_hash"),
+        active_only=since is None,
+        filters=() if since is None else (KnowledgeBase.updated_at >= since,),
+        batch_size=batch_size,
+    )
 
 
-def main() -> None:
+def indexed_ids(es) -> Iterable[str]:
+    """Ids of every doc currently in the index."""
+    from elasticsearch.helpers import scan
+
+    for hit in scan(es, index=INDEX, query={"query": {"match_all": {}}}, _source=False, size=5000):
+        yield hit["_id"]
+
+
+def row_hash(row: Any) -> str:
+    raw = "\x1f".join([row.title or "", row.content or "", row.category or "", row.created_by or ""])
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def load_state() -> Dict[str, Any]:
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"high_water_mark": None}
+
+
+def save_state(state: Dict[str, Any]) -> None:
+    """Write the checkpoint atomically so a crash never leaves a half-written file."""
+    os.makedirs(os.path.dirname(STATE_FILE) or ".", exist_ok=True)
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, STATE_FILE)
+
+
+def sync(full: bool = False, batch_size: int = 500) -> Dict[str, int]:
+    """
+    Sync knowledge_base into ES.
+
+    Incremental mode reads only rows with updated_at at/after the stored
+    high-water mark (minus SYNC_LAG_SECONDS): changed rows are indexed and
+    deactivated ones deleted. kb_delete is a soft delete (is_active=False,
+    bumping updated_at), so deletions show up in the same scan and a run
+    costs O(changed rows). The first run, or `full=True`, re-reads every
+    active row and deletes every doc in the index that is not one of them
+    (rows removed with SQL, outside the API).
+
+    Rows whose sync_hash in ES already matches are skipped (one mget per
+    batch), so re-reading the lag window or a full pass rewrites nothing
+    unchanged. If any bulk item fails, the high-water mark is not advanced
+    and the run raises, so the next run retries those rows.
+    """
     es = get_es_client()
     ensure_index(INDEX)
-    operations = []
-    for row in fetch_rows():
-        operations.append({
-            "index": {"_index": INDEX, "_id": row.id}
-        })
-        operations.append({
-            "title": row.title,
-            "content": row.content,
-            "category": row.category,
-            "created_by": row.created_by,
-            "is_active": row.is_active,
-        })
-        if len(operations) >= 1000:
-            es.bulk(operations=operations)
+
+    state = {"high_water_mark": None} if full else load_state()
+    since = None if full or not state.get("high_water_mark") else datetime.fromisoformat(state["high_water_mark"])
+    max_updated_at = None
+
+    counts = {"seen": 0, "indexed": 0, "unchanged": 0, "deleted": 0}
+    operations: List[Dict[str, Any]] = []
+    failed: List[Dict[str, Any]] = []
+    seen_ids = set()
+
+    def flush() -> None:
+        nonlocal operations
+        if operations:
+            response = es.bulk(operations=operations)
+            failed.extend(bulk_failures(response))
+            counts["deleted"] += sum(1 for item in response["items"] if item.get("delete", {}).get("result") == "deleted")
             operations = []
-    if operations:
-        es.bulk(operations=operations)
-    print("Indexed KB into Elasticsearch")
 
+    def process(rows: List[Any]) -> None:
+        active = [row for row in rows if row.is_active]
+        stored = {}
+        if active:
+            resp = es.mget(index=INDEX, ids=[str(row.id) for row in active], source=["sync_hash"])
+            stored = {doc["_id"]: doc["_source"].get("sync_hash") for doc in resp["docs"] if doc.get("found")}
+        for row in rows:
+            if not row.is_active:
+                # A no-op (404) when the row was never indexed
+                operations.append({"delete": {"_index": INDEX, "_id": str(row.id)}})
+                continue
+            digest = row_hash(row)
+            if stored.get(str(row.id)) == digest:
+                counts["unchanged"] += 1
+                continue
+            operations.append({"index": {"_index": INDEX, "_id": str(row.id)}})
+            operations.append({
+                "title": row.title,
+                "content": row.content,
+                "category": row.category,
+                "created_by": row.created_by,
+                "is_active": row.is_active,
+                "content_hash": row.content_hash,
+                "sync_hash": digest,
+            })
+            counts["indexed"] += 1
+        if len(operations) >= 1000:
+            flush()
 
-if __name__ == "__main__":
-    main()
+    batch: List[Any] = []
+    for row in fetch_rows(since=since):
+        counts["seen"] += 1
+        seen_ids.add(str(row.id))
+        if row.updated_at is not None and (max_updated_at is None or row.updated_at > max_updated_at):
+            max_updated_at = row.updated_at
+        batch.append(row)
+        if len(batch) >= batch_size:
+            process(batch)
+            batch = []
+    if batch:
+        process(batch)
+
+    if full:
+        for doc_id in indexed_ids(es):
+            if doc_id not in seen_ids:
+                operations.append({"delete": {"_index": INDEX, "_id": doc_id}})
+                if len(operations) >= 1000:
+                    flush()
+    flush()
+    if counts["indexed"] or counts["deleted"]:
+        invalidate_categories()
 
+    if failed:
+        raise RuntimeError(f"{len(failed)} bulk operations failed (will retry next run), e.g. {failed[:3]}")
+    if max_updated_at is not None:
+        mark = max_updated_at - timedelta(seconds=SYNC_LAG_SECONDS)
+        state["high_water_mark"] = (mark if since is None else max(mark, since)).isoformat()
+    save_state({"high_water_mark": state.get("high_water_mark")})
+    return counts
 
+
+def main() -> None:
+    full = "--full" in sys.argv[1:]
+    counts = sync(full=full)
+    mode = "full" if full else "incremental"
+    print(
+        f"Indexed KB into Elasticsearch ({mode}): {counts['seen']} rows read, "
+        f"{counts['indexed']} indexed, {counts['unchanged']} unchanged, {counts['deleted']} deleted"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import os
+import sys
+
+from transformers import AutoTokenizer
+
+from sft_shards import SFT_SHARDS_DIR, build_shards, prune_shards
+
+
+BASE_MODEL = os.getenv("BASE_MODEL", "microsoft/Phi-4-mini-instruct")
+MAX_SEQ_LENGTH = int(os.getenv("MAX_SEQ_LENGTH", "4096"))
+DATA_FILE = os.getenv("DATA_FILE", "data/daily/latest.jsonl")
+
+
+def main() -> None:
+    # Pre-build shards ahead of training; train_lora_unsloth.py reuses them.
+    # --prune N: keep the newest N manifests and drop shards none of them use
+    args = sys.argv[1:]
+    data_file = next((a for a in args if not a.startswith("--") and a.endswith(".jsonl")), DATA_FILE)
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
+    manifest = build_shards(data_file, tokenizer, MAX_SEQ_LENGTH)
+    print(
+        f"Wrote {manifest['rows']} rows ({manifest['tokens']} tokens) in {len(manifest['shards'])} shards "
+        f"-> {manifest['path']} ({manifest['built']} built, {manifest['reused']} reused, "
+        f"{manifest['skipped']} rows skipped)"
+    )
+    if "--prune" in args:
+        keep = int(args[args.index("--prune") + 1])
+        removed = prune_shards(manifest["tokenizer_key"], keep=keep)
+        print(f"Pruned {removed} unused shards from {SFT_SHARDS_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,22 @@
 import json
-from database import SessionLocal
-from models import KnowledgeBase
+import sys
+
+from kb_scan import scan_knowledge_base
+from near_dup import NearDuplicateIndex, minhash_signature
 
 
 def main() -> None:
-    session = SessionLocal()
-    rows = (
-        session.query(KnowledgeBase)
-        .filter(KnowledgeBase.is_active.is_(True))
-        .all()
-    )
+    # --near-dup: keep only the first row of each near-duplicate group
+    near_dup = NearDuplicateIndex() if "--near-dup" in sys.argv[1:] else None
+    count = skipped = 0
     with open("data/kb_sft.jsonl", "w", encoding="utf-8") as f:
-        for r in rows:
+        for r in scan_knowledge_base(columns=("title", "content")):
+            if near_dup is not None:
+                signature = minhash_signature(r.content)
+                if near_dup.query(signature):
+                    skipped += 1
+                    continue
+                near_dup.insert(r.id, signature)
             # Turn KB entry into a simple instruction-answer pair
             item = {
                 "messages": [
@@ -21,10 +26,9 @@ def main() -> None:
                 "weight": 0.7,
             }
             f.write(json.dumps(item, ensure_ascii=False) + "\n")
-    print("Wrote data/kb_sft.jsonl")
+            count += 1
+    print(f"Wrote {count} rows -> data/kb_sft.jsonl" + (f" ({skipped} near duplicates skipped)" if skipped else ""))
 
 
 if __name__ == "__main__":
     main()
-
-
@@ -0,0 +1,30 @@
+import sys
+
+from adapter_versions import ADAPTER_ROOT, current_version, list_versions, read_version, rollback
+
+
+def main() -> None:
+    # No args: list versions. <version>: activate it. --previous: back to the current one's parent.
+    # Re-run merge_and_convert.py afterwards to rebuild the GGUF from the restored adapter.
+    args = sys.argv[1:]
+    if not args:
+        current = current_version()
+        for name in list_versions():
+            meta = read_version(name)
+            marker = "*" if name == current else " "
+            print(
+                f"{marker} {name}  {meta.get('mode', '?'):9}  parent={meta.get('parent')}  "
+                f"new={meta.get('rows_new', 0)} replay={meta.get('rows_replay', 0)}"
+            )
+        return
+    target = None if args[0] == "--previous" else args[0]
+    try:
+        name = rollback(target)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"✅ Adapter version {name} is now current in {ADAPTER_ROOT}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,137 @@
+import json
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+import torch
+from torch.utils.checkpoint import checkpoint
 from datasets import load_dataset
+from peft.utils import load_peft_weights, set_peft_model_state_dict
 from transformers import TrainingArguments
 from trl import SFTTrainer
 
 from unsloth import FastLanguageModel
 
+from adapter_versions import current_version, load_seen, publish, versions_dir
+from sft_packing import (
+    IGNORE_INDEX,
+    PackedDataset,
+    SFTCollator,
+    ThroughputCallback,
+    packing_isolated,
+    weighted_subset,
+)
+from sft_shards import build_shards, load_shards
+
 
 BASE_MODEL = "microsoft/Phi-4-mini-instruct"
 MAX_SEQ_LENGTH = 4096
 OUTPUT_DIR = "artifacts/lora"
 DATA_FILE = "data/daily/latest.jsonl"  # symlink/copy to the newest jsonl
+LORA_R = 16
+LORA_ALPHA = 32
+# SFT_FORMAT=shards: pre-tokenized Arrow shards (sft_shards.py), memory-mapped;
+# SFT_FORMAT=jsonl: the old path, load_dataset("json") + apply_chat_template each run
+SFT_FORMAT = os.getenv("SFT_FORMAT", "shards")
+# Shards only. SFT_PACKING=1: pack rows up to MAX_SEQ_LENGTH (batch 1 x 8 accumulation);
+# SFT_PACKING=0: one row per slot, length-bucketed batches of SFT_BUCKET_BATCH_SIZE.
+# Packing is dropped for bucketing when the model fails the row-isolation check
+SFT_PACKING = os.getenv("SFT_PACKING", "1") == "1"
+SFT_PACKING_CHECK_TOL = float(os.getenv("SFT_PACKING_CHECK_TOL", "0.05"))
+SFT_BUCKET_BATCH_SIZE = int(os.getenv("SFT_BUCKET_BATCH_SIZE", "8"))
+# Shards only. SFT_WEIGHTING=loss: scale each row's token losses by its SFT "weight";
+# sample: train on a weight-proportional SFT_SAMPLE_FRACTION of the rows; none: ignore weights.
+# "loss" is checked against the model's own loss at startup and falls back to "sample"
+SFT_WEIGHTING = os.getenv("SFT_WEIGHTING", "loss")
+SFT_SAMPLE_FRACTION = float(os.getenv("SFT_SAMPLE_FRACTION", "0.5"))
+# Positions per lm_head/cross-entropy chunk of the weighted loss
+SFT_LOSS_CHUNK = int(os.getenv("SFT_LOSS_CHUNK", "512"))
+# SFT_CONTINUAL=1 (shards only): resume from the current adapter version and train on rows
+# it has not seen plus SFT_REPLAY_RATIO replayed old rows per new row (adapter_versions.py)
+SFT_CONTINUAL = os.getenv("SFT_CONTINUAL", "0") == "1"
+SFT_REPLAY_RATIO = float(os.getenv("SFT_REPLAY_RATIO", "0.5"))
+# Seed of the replay/weighted samples; defaults to the run date (YYYYMMDD) so each night
+# draws a different sample. Recorded in version.json; set it to reproduce a run
+SFT_SAMPLE_SEED = int(os.getenv("SFT_SAMPLE_SEED") or datetime.now().strftime("%Y%m%d"))
+
+
+def _weighted_chunk_loss(lm_head, hidden, labels, weights):
+    logits = lm_head(hidden).float()
+    token_loss = torch.nn.functional.cross_entropy(
+        logits.reshape(-1, logits.size(-1)),
+        labels.reshape(-1),
+        ignore_index=IGNORE_INDEX,
+        reduction="none",
+    )
+    return (token_loss * weights.reshape(-1)).sum()
+
+
+def weighted_loss(model, inputs, labels, weights):
+    """
+    sum(row weight * token loss) / supervised tokens.
+
+    Full logits are never materialized: at a 200k vocab and 4096 positions
+    they are several GB. The decoder returns hidden states, and lm_head plus
+    cross-entropy run on SFT_LOSS_CHUNK positions at a time under activation
+    checkpointing, so only one chunk's fp32 logits are alive, in the forward
+    and again in the backward.
+    """
+    base = model.get_base_model() if hasattr(model, "get_base_model") else model
+    hidden = getattr(base, base.base_model_prefix)(**inputs)[0]
+    lm_head = model.get_output_embeddings()
+    # Same shift as the model's own loss: position t predicts labels at t + 1
+    hidden, labels, weights = hidden[:, :-1], labels[:, 1:], weights[:, 1:]
+    total = hidden.new_zeros((), dtype=torch.float32)
+    for start in range(0, hidden.size(1), SFT_LOSS_CHUNK):
+        end = start + SFT_LOSS_CHUNK
+        total = total + checkpoint(
+            _weighted_chunk_loss,
+            lm_head,
+            hidden[:, start:end],
+            labels[:, start:end],
+            weights[:, start:end],
+            use_reentrant=False,
+        )
+    return total / (labels != IGNORE_INDEX).sum().clamp(min=1)
+
+
+def weighted_loss_matches(model, ds, pad_token_id: int, tol: float = 1e-2) -> bool:
+    """
+    Check weighted_loss against the model's own loss on one row with weight 1.
+
+    Both must agree (relative difference <= tol) before the weighted loss is
+    trusted with training; a patched forward that weighted_loss bypasses
+    incorrectly (e.g. a missing final norm or logit scaling) shows up here.
+    """
+    row = {**ds[0], "weight": 1.0}
+    batch = SFTCollator(pad_token_id, MAX_SEQ_LENGTH, weighted=True)([row])
+    device = next(model.parameters()).device
+    batch = {k: v.to(device) for k, v in batch.items()}
+    weights = batch.pop("loss_weights")
+    was_training = model.training
+    model.eval()
+    try:
+        with torch.no_grad():
+            reference = model(**batch).loss.float().item()
+            labels = batch.pop("labels")
+            ours = weighted_loss(model, batch, labels, weights).item()
+    finally:
+        model.train(was_training)
+    print(f"Weighted loss check: {ours:.4f} vs model loss {reference:.4f}")
+    return abs(ours - reference) <= tol * max(abs(reference), 1.0)
+
+
+class WeightedSFTTrainer(SFTTrainer):
+    """SFTTrainer whose loss is weighted_loss() when the batch carries loss_weights."""
+
+    def compute_loss(self, model, inputs, return_outputs=False):
+        weights = inputs.pop("loss_weights", None)
+        if weights is None:
+            return super().compute_loss(model, inputs, return_outputs)
+        labels = inputs.pop("labels")
+        loss = weighted_loss(model, inputs, labels, weights)
+        return (loss, {"loss": loss}) if return_outputs else loss
 
 
 def load_model_and_tokenizer():
@@ -19,17 +142,15 @@ def load_model_and_tokenizer():
     )
     model = FastLanguageModel.get_peft_model(
         model,
-        r=16,
-        lora_alpha=32,
+        r=LORA_R,
+        lora_alpha=LORA_ALPHA,
         lora_dropout=0.05,
         target_modules="all-linear",
     )
     return model, tokenizer
 
 
-def main() -> None:
-    model, tokenizer = load_model_and_tokenizer()
-
+def load_jsonl_dataset(tokenizer):
     ds = load_dataset("json", data_files=DATA_FILE, split="train")
 
     def format_example(example):
@@ -39,33 +160,156 @@ def main() -> None:
             )
         }
 
-    ds = ds.map(format_example, remove_columns=ds.column_names)
+    return ds.map(format_example, remove_columns=ds.column_names)
+
 
-    trainer = SFTTrainer(
+def load_shard_dataset(tokenizer):
+    manifest = build_shards(DATA_FILE, tokenizer, MAX_SEQ_LENGTH)
+    print(
+        f"SFT shards: {manifest['rows']} rows, {manifest['tokens']} tokens, "
+        f"{manifest['reused']} shards reused, {manifest['built']} built -> {manifest['path']}"
+    )
+    return load_shards(manifest).remove_columns(["text"])
+
+
+def resume_adapter(model, version: str) -> bool:
+    """Load a published version's LoRA weights into the fresh PEFT model."""
+    path = versions_dir(OUTPUT_DIR) / version
+    with open(path / "adapter_config.json", "r", encoding="utf-8") as f:
+        config = json.load(f)
+    if config.get("r") != LORA_R or config.get("lora_alpha") != LORA_ALPHA:
+        print(f"Adapter {version} has a different LoRA shape, training from scratch")
+        return False
+    set_peft_model_state_dict(model, load_peft_weights(str(path)))
+    print(f"Resumed LoRA weights from adapter version {version}")
+    return True
+
+
+def select_continual_rows(ds, seen: np.ndarray, seed: int = SFT_SAMPLE_SEED):
+    """Indices of rows not in `seen` plus a weighted replay sample of rows that are."""
+    keys = np.asarray(ds["row_key"], dtype=np.int64)
+    is_seen = np.isin(keys, seen)
+    new_rows = np.flatnonzero(~is_seen)
+    old_rows = np.flatnonzero(is_seen)
+    replay_count = min(len(old_rows), int(round(SFT_REPLAY_RATIO * len(new_rows))))
+    replay = []
+    if replay_count:
+        weights = np.asarray(ds["weight"])[old_rows]
+        replay = old_rows[weighted_subset(weights, replay_count / len(old_rows), seed=seed)].tolist()
+    return new_rows.tolist(), replay
+
+
+def main() -> None:
+    model, tokenizer = load_model_and_tokenizer()
+
+    parent = current_version(OUTPUT_DIR)
+    resumed = bool(SFT_CONTINUAL and SFT_FORMAT != "jsonl" and parent and resume_adapter(model, parent))
+    meta = {
+        "parent": parent,
+        "mode": "continual" if resumed else "full",
+        "base_model": BASE_MODEL,
+        "data_file": DATA_FILE,
+        "sample_seed": SFT_SAMPLE_SEED,
+    }
+    seen = np.empty(0, dtype=np.int64)
+    trained_keys = np.empty(0, dtype=np.int64)
+
+    batch_size, accumulation = 1, 8
+    group_by_length = False
+    callbacks = []
+    if SFT_FORMAT == "jsonl":
+        ds = load_jsonl_dataset(tokenizer)
+        meta.update(rows_new=len(ds), rows_replay=0)
+        dataset_kwargs = {}
+        data_collator = None
+    else:
+        ds = load_shard_dataset(tokenizer)
+        # Rows are already tokenized; SFTTrainer must not re-tokenize them
+        dataset_kwargs = {"skip_prepare_dataset": True}
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        if resumed:
+            seen = load_seen(parent, OUTPUT_DIR)
+            new_rows, replay = select_continual_rows(ds, seen)
+            print(
+                f"Continual training from {parent}: {len(new_rows)} new rows, "
+                f"{len(replay)} replayed (seed {SFT_SAMPLE_SEED})"
+            )
+            if not new_rows:
+                print(f"No new rows since adapter version {parent}, keeping it")
+                return
+            meta.update(rows_new=len(new_rows), rows_replay=len(replay))
+            ds = ds.select(sorted(new_rows + replay))
+        else:
+            meta.update(rows_new=len(ds), rows_replay=0)
+        weighting = SFT_WEIGHTING
+        if weighting == "loss" and not weighted_loss_matches(model, ds, tokenizer.pad_token_id):
+            print("⚠️ Weighted loss does not match the model's loss, using weighted sampling instead")
+            weighting = "sample"
+        meta["weighting"] = weighting
+        if weighting == "sample":
+            keep = weighted_subset(ds["weight"], SFT_SAMPLE_FRACTION, seed=SFT_SAMPLE_SEED)
+            print(f"Weighted sampling: training on {len(keep)} of {len(ds)} rows (seed {SFT_SAMPLE_SEED})")
+            ds = ds.select(keep)
+        # Rows left out by sampling stay "new" for the next continual run
+        trained_keys = np.asarray(ds["row_key"], dtype=np.int64)
+        meta["rows_trained"] = len(trained_keys)
+        data_collator = SFTCollator(
+            tokenizer.pad_token_id,
+            MAX_SEQ_LENGTH,
+            dtype=torch.bfloat16,
+            weighted=weighting == "loss",
+        )
+        callbacks.append(ThroughputCallback(data_collator))
+        packed = PackedDataset(ds, MAX_SEQ_LENGTH) if SFT_PACKING else None
+        if packed is not None and not packing_isolated(model, packed, data_collator, SFT_PACKING_CHECK_TOL):
+            print("⚠️ Packed rows attend to each other in this model (4D mask ignored), using bucketed batches")
+            packed = None
+        if packed is not None:
+            ds = packed
+            print(f"Packed into {len(ds)} sequences of up to {MAX_SEQ_LENGTH} tokens")
+        else:
+            batch_size = SFT_BUCKET_BATCH_SIZE
+            accumulation = max(1, 8 // batch_size)
+            group_by_length = True
+
+    trainer = WeightedSFTTrainer(
         model=model,
         tokenizer=tokenizer,
         train_dataset=ds,
         dataset_text_field="text",
+        data_collator=data_collator,
+        dataset_kwargs=dataset_kwargs,
+        callbacks=callbacks,
         args=TrainingArguments(
             output_dir=OUTPUT_DIR,
-            per_device_train_batch_size=1,
-            gradient_accumulation_steps=8,
+            per_device_train_batch_size=batch_size,
+            gradient_accumulation_steps=accumulation,
             num_train_epochs=1,
             learning_rate=1e-4,
             logging_steps=10,
             save_strategy="epoch",
             bf16=True,
+            group_by_length=group_by_length,
+            length_column_name="length",
+            # The collator needs assistant_mask/weight, which the model does not take
+            remove_unused_columns=SFT_FORMAT == "jsonl",
         ),
         max_seq_length=MAX_SEQ_LENGTH,
     )
 
     trainer.train()
-    trainer.model.save_pretrained(OUTPUT_DIR)
-    tokenizer.save_pretrained(OUTPUT_DIR)
+    # Only a finished run extends the ledger (published with the adapter below)
+    seen = np.union1d(seen, trained_keys)
+
+    # Publish as a new date-stamped version; the current one is copied to OUTPUT_DIR
+    staging = versions_dir(OUTPUT_DIR) / f".staging-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    trainer.model.save_pretrained(str(staging))
+    tokenizer.save_pretrained(str(staging))
+    version = publish(str(staging), meta, seen, root=OUTPUT_DIR)
+    print(f"Published adapter version {version} ({meta['mode']}, parent {parent})")
 
 
 if __name__ == "__main__":
     main()
-
-
-
@@ -0,0 +1,263 @@
+"""
+Sequence packing, padding-aware collation and throughput reporting for SFT.
+
+Most SFT rows ("Explain: <title>" + slide text, short chat turns) are a few
+hundred tokens, so padding every row to its own batch slot wastes most of a
+4096-token step. Two modes, both over the pre-tokenized shards of
+sft_shards.py:
+
+    packed     rows are bin-packed (best-fit decreasing) into sequences of at
+               most max_seq_length; each packed sequence gets position_ids
+               that restart per row and a block-diagonal causal attention mask,
+               so rows never attend to each other. Only models that honor a
+               custom 4D mask isolate the rows (Unsloth's patched attention
+               may not), so trainers run packing_isolated() on the real model
+               first and fall back to bucketed when it fails
+    bucketed   one row per slot, batches drawn by the Trainer's
+               LengthGroupedSampler (group_by_length) so rows of similar
+               length are padded together
+
+In both modes labels are -100 outside assistant turns (assistant_mask), so
+the loss only covers answers, never user prompts or the chat template.
+
+Per-row SFT weights (the exporters' "weight" field) are honored either by
+scaling each row's token losses (SFTCollator(weighted=True) emits
+loss_weights for the trainer) or by weighted_subset(), which keeps a
+weight-proportional sample of the rows so training is shorter.
+"""
+
+import time
+from bisect import bisect_left, insort
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+import torch
+from transformers import TrainerCallback
+
+
+IGNORE_INDEX = -100
+
+
+def pack_by_length(lengths: Sequence[int], max_len: int) -> List[List[int]]:
+    """
+    Best-fit decreasing bin packing of row indices into bins of max_len tokens.
+
+    Rows longer than max_len (only possible if the shards were built with a
+    larger max_seq_length) get a bin of their own and are truncated later.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    bins: List[List[int]] = []
+    free: List[Any] = []  # sorted (remaining capacity, bin index)
+    for i in order:
+        length = min(lengths[i], max_len)
+        pos = bisect_left(free, (length, -1))
+        if pos < len(free):
+            remaining, b = free.pop(pos)
+        else:
+            remaining, b = max_len, len(bins)
+            bins.append([])
+        bins[b].append(i)
+        if remaining - length > 0:
+            insort(free, (remaining - length, b))
+    return bins
+
+
+def weighted_subset(weights: Sequence[float], fraction: float, seed: int = 0) -> List[int]:
+    """
+    Indices of a weighted sample without replacement of fraction * len(weights) rows.
+
+    Efraimidis-Spirakis: keep the rows with the largest u ** (1 / w), so a row's
+    inclusion probability grows with its weight; rows with weight <= 0 are never
+    kept. Returned in original order.
+    """
+    w = np.asarray(weights, dtype=np.float64)
+    positive = np.flatnonzero(w > 0)
+    k = min(int(round(len(w) * fraction)), len(positive))
+    if k <= 0:
+        return []
+    rng = np.random.default_rng(seed)
+    keys = np.log(rng.random(len(positive))) / w[positive]
+    chosen = positive[np.argpartition(-keys, k - 1)[:k]]
+    return sorted(chosen.tolist())
+
+
+class PackedDataset(torch.utils.data.Dataset):
+    """Packed view over a shard dataset; each item is {"segments": [row, ...]}."""
+
+    def __init__(self, ds: Any, max_len: int) -> None:
+        self.ds = ds
+        self.bins = pack_by_length(ds["length"], max_len)
+
+    def __len__(self) -> int:
+        return len(self.bins)
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        return {"segments": [self.ds[i] for i in self.bins[index]]}
+
+
+class SFTCollator:
+    """
+    Collate shard rows (bucketed) or packed items into model inputs.
+
+    With weighted=True the batch also carries loss_weights, each token's row
+    weight, for a trainer that scales per-token losses (the model itself does
+    not accept the key).
+
+    Keeps running totals of real tokens, supervised tokens and padded slots
+    for ThroughputCallback. Counts are per process, so they are only
+    complete with dataloader_num_workers=0 (the Trainer default).
+    """
+
+    def __init__(
+        self,
+        pad_token_id: int,
+        max_len: int,
+        dtype: torch.dtype = torch.bfloat16,
+        weighted: bool = False,
+    ) -> None:
+        self.pad_token_id = pad_token_id
+        self.max_len = max_len
+        self.dtype = dtype
+        self.weighted = weighted
+        self.tokens = 0
+        self.supervised_tokens = 0
+        self.slots = 0
+
+    def _segment_labels(self, row: Dict[str, Any]) -> List[int]:
+        labels = [t if m else IGNORE_INDEX for t, m in zip(row["input_ids"], row["assistant_mask"])]
+        # The first token has no in-row context to be predicted from
+        labels[0] = IGNORE_INDEX
+        return labels
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        packed = "segments" in features[0]
+        sequences = []
+        for feature in features:
+            segments = feature["segments"] if packed else [feature]
+            ids: List[int] = []
+            labels: List[int] = []
+            positions: List[int] = []
+            segment_ids: List[int] = []
+            weights: List[float] = []
+            for n, row in enumerate(segments):
+                row_ids = row["input_ids"][:self.max_len - len(ids)]
+                if not row_ids:
+                    break
+                ids.extend(row_ids)
+                labels.extend(self._segment_labels(row)[:len(row_ids)])
+                positions.extend(range(len(row_ids)))
+                segment_ids.extend([n] * len(row_ids))
+                weights.extend([row.get("weight", 1.0)] * len(row_ids))
+            sequences.append((ids, labels, positions, segment_ids, weights))
+
+        width = max(len(s[0]) for s in sequences)
+        batch_ids = torch.full((len(sequences), width), self.pad_token_id, dtype=torch.long)
+        batch_labels = torch.full((len(sequences), width), IGNORE_INDEX, dtype=torch.long)
+        batch_positions = torch.zeros((len(sequences), width), dtype=torch.long)
+        batch_segments = torch.full((len(sequences), width), -1, dtype=torch.long)
+        batch_weights = torch.zeros((len(sequences), width), dtype=torch.float32)
+        for b, (ids, labels, positions, segment_ids, weights) in enumerate(sequences):
+            batch_ids[b, :len(ids)] = torch.tensor(ids)
+            batch_labels[b, :len(ids)] = torch.tensor(labels)
+            batch_positions[b, :len(ids)] = torch.tensor(positions)
+            batch_segments[b, :len(ids)] = torch.tensor(segment_ids)
+            batch_weights[b, :len(ids)] = torch.tensor(weights)
+
+        self.tokens += sum(len(s[0]) for s in sequences)
+        self.supervised_tokens += int((batch_labels != IGNORE_INDEX).sum())
+        self.slots += batch_ids.numel()
+
+        batch = {"input_ids": batch_ids, "labels": batch_labels}
+        if self.weighted:
+            batch["loss_weights"] = batch_weights
+        if packed:
+            # Block-diagonal causal mask in additive form (0 = attend); padding
+            # rows attend to themselves only so softmax stays finite
+            seg = batch_segments
+            causal = torch.tril(torch.ones(width, width, dtype=torch.bool))
+            allowed = (seg[:, :, None] == seg[:, None, :]) & causal & (seg[:, :, None] >= 0)
+            allowed |= torch.eye(width, dtype=torch.bool)
+            mask = torch.zeros(allowed.shape, dtype=self.dtype)
+            mask.masked_fill_(~allowed, torch.finfo(self.dtype).min)
+            batch["attention_mask"] = mask[:, None, :, :]
+            batch["position_ids"] = batch_positions
+        else:
+            batch["attention_mask"] = (batch_segments >= 0).long()
+        return batch
+
+
+def packing_isolated(model: Any, packed: PackedDataset, collator: SFTCollator, tol: float = 0.05) -> bool:
+    """
+    Check that rows packed together do not attend to each other in `model`.
+
+    Runs the first packed sequence holding 2+ rows through the model, and its
+    second row alone, and compares that row's next-token log-probs. Leaking
+    attention shifts them by far more than bf16 noise; a mean absolute
+    difference above `tol` means the model ignored the block-diagonal mask.
+    """
+    sample = next((b for b in packed.bins if len(b) >= 2), None)
+    if sample is None:
+        return True
+    first, second = packed.ds[sample[0]], packed.ds[sample[1]]
+    # A separate collator so the check does not count toward throughput stats
+    probe = SFTCollator(collator.pad_token_id, collator.max_len, dtype=collator.dtype)
+    together = probe([{"segments": [first, second]}])
+    alone = probe([second])
+    offset = len(first["input_ids"])
+    n = min(len(second["input_ids"]), collator.max_len - offset)
+    if n < 2:
+        return True
+
+    device = next(model.parameters()).device
+    was_training = model.training
+    model.eval()
+    try:
+        with torch.no_grad():
+            logits = {}
+            for name, batch in (("together", together), ("alone", alone)):
+                batch.pop("labels")
+                outputs = model(**{k: v.to(device) for k, v in batch.items()})
+                logits[name] = outputs.logits[0].float()
+    finally:
+        model.train(was_training)
+
+    targets = torch.tensor(second["input_ids"][1:n], device=device)[:, None]
+    together_lp = torch.log_softmax(logits["together"][offset:offset + n - 1], dim=-1).gather(1, targets)
+    alone_lp = torch.log_softmax(logits["alone"][:n - 1], dim=-1).gather(1, targets)
+    diff = (together_lp - alone_lp).abs().mean().item()
+    print(f"Packing isolation check: mean |log-prob diff| {diff:.4f} (tolerance {tol})")
+    return diff <= tol
+
+
+class ThroughputCallback(TrainerCallback):
+    """Log tokens/sec and padding ratio alongside the Trainer's own logs."""
+
+    def __init__(self, collator: SFTCollator) -> None:
+        self.collator = collator
+        self.started = 0.0
+        self.last_time = 0.0
+        self.last_tokens = 0
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.started = self.last_time = time.perf_counter()
+        self.last_tokens = self.collator.tokens
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        now = time.perf_counter()
+        tokens = self.collator.tokens - self.last_tokens
+        rate = tokens / max(now - self.last_time, 1e-9)
+        self.last_time, self.last_tokens = now, self.collator.tokens
+        print(f"step {state.global_step}: {rate:,.0f} tokens/sec, padding ratio {self.padding_ratio():.1%}")
+
+    def on_train_end(self, args, state, control, **kwargs):
+        elapsed = time.perf_counter() - self.started
+        c = self.collator
+        print(
+            f"Training throughput: {c.tokens:,} tokens in {elapsed:,.0f}s "
+            f"({c.tokens / max(elapsed, 1e-9):,.0f} tokens/sec), "
+            f"padding ratio {self.padding_ratio():.1%}, "
+            f"{c.supervised_tokens:,} supervised tokens"
+        )
+
+    def padding_ratio(self) -> float:
+        return 1 - self.collator.tokens / self.collator.slots if self.collator.slots else 0.0
@@ -0,0 +1,284 @@
+"""
+Pre-tokenized SFT shards (Arrow IPC) with memory-mapped loading for training.
+
+A merged SFT JSONL (data/daily/latest.jsonl) is split into shards, and each
+shard is stored once per tokenizer as an Arrow stream file holding the
+chat-templated text, its input_ids and an assistant_mask (1 on tokens of
+assistant turns, which are the only ones trained on) plus the row's SFT
+"weight" (1.0 when absent) and a row_key (64-bit digest of the raw line,
+used by continual training to tell new rows from already-trained ones).
+Training memory-maps the shards
+(datasets.Dataset.from_file), so a nightly run no longer parses JSON or runs
+apply_chat_template/tokenization over rows it has already seen.
+
+Shard boundaries are content-defined: a row closes its shard when its line
+digest hits 1 in SFT_SHARD_ROWS (or the shard reaches 4x that size). Rows
+added at the front of the file (the daily export) therefore only change the
+first shard or two; every later shard hashes to the same key as yesterday's
+and is reused instead of re-tokenized.
+
+Layout of SFT_SHARDS_DIR:
+    v<format>/<tokenizer_key>/shards/<shard_key>.arrow
+    v<format>/<tokenizer_key>/manifests/<dataset_key>.json
+
+tokenizer_key hashes the tokenizer model, the chat template and
+max_seq_length (input_ids are truncated to it), so a tokenizer or template
+change gets a fresh shard set instead of silently mixing encodings.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+SFT_SHARDS_DIR = os.getenv("SFT_SHARDS_DIR", "data/sft_shards")
+SFT_SHARD_ROWS = int(os.getenv("SFT_SHARD_ROWS", "2000"))
+SHARD_FORMAT_VERSION = 4
+
+SHARD_SCHEMA = pa.schema([
+    ("text", pa.string()),
+    ("input_ids", pa.list_(pa.int32())),
+    ("assistant_mask", pa.list_(pa.int8())),
+    ("length", pa.int32()),
+    ("weight", pa.float32()),
+    ("row_key", pa.int64()),
+])
+
+
+def tokenizer_key(tokenizer: Any, max_seq_length: int) -> str:
+    """Stable hash of everything that changes the encoded rows."""
+    h = hashlib.sha256()
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        spec = json.loads(backend.to_str())
+        # Runtime padding/truncation settings do not change the stored ids
+        spec.pop("padding", None)
+        spec.pop("truncation", None)
+        h.update(json.dumps(spec, sort_keys=True).encode("utf-8"))
+    else:
+        h.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode("utf-8"))
+    h.update((getattr(tokenizer, "chat_template", None) or "").encode("utf-8"))
+    h.update(f"{max_seq_length}:{SHARD_FORMAT_VERSION}".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def shard_root(tok_key: str, shards_dir: str = SFT_SHARDS_DIR) -> Path:
+    return Path(shards_dir) / f"v{SHARD_FORMAT_VERSION}" / tok_key
+
+
+def row_key(line: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), "little", signed=True)
+
+
+def iter_chunks(data_file: str, shard_rows: int = SFT_SHARD_ROWS) -> Iterator[Tuple[str, List[bytes]]]:
+    """Yield (shard_key, raw lines) using content-defined boundaries; no JSON parsing."""
+    lines: List[bytes] = []
+    h = hashlib.blake2b(digest_size=16)
+    with open(data_file, "rb", buffering=1024 * 1024) as f:
+        for raw in f:
+            line = raw.strip()
+            if not line:
+                continue
+            digest = hashlib.blake2b(line, digest_size=16).digest()
+            lines.append(line)
+            h.update(digest)
+            if int.from_bytes(digest[:4], "little") % shard_rows == 0 or len(lines) >= 4 * shard_rows:
+                yield h.hexdigest(), lines
+                lines = []
+                h = hashlib.blake2b(digest_size=16)
+    if lines:
+        yield h.hexdigest(), lines
+
+
+def assistant_spans(tokenizer: Any, messages: List[Dict[str, Any]], text: str) -> Optional[List[Tuple[int, int]]]:
+    """
+    Character spans of assistant turns (content through end-of-turn tokens) in text.
+
+    Each turn's span comes from rendering the conversation up to it; returns
+    None when the chat template is not prefix-stable, i.e. a rendered prefix is
+    not a prefix of the full text, and turns cannot be located.
+    """
+    spans = []
+    for i, message in enumerate(messages):
+        if message.get("role") != "assistant":
+            continue
+        before = tokenizer.apply_chat_template(messages[:i], tokenize=False) if i else ""
+        upto = tokenizer.apply_chat_template(messages[:i + 1], tokenize=False)
+        if not (text.startswith(upto) and upto.startswith(before)):
+            return None
+        start = upto.find(message.get("content") or "", len(before))
+        spans.append((start if start >= 0 else len(before), len(upto)))
+    return spans
+
+
+def span_mask(offsets: List[Tuple[int, int]], spans: Optional[List[Tuple[int, int]]]) -> List[int]:
+    # No assistant turn or unlocatable turns: train on the whole row, as before
+    if not spans:
+        return [1] * len(offsets)
+    mask = []
+    i = 0
+    for start, end in offsets:
+        while i < len(spans) and spans[i][1] <= start:
+            i += 1
+        mask.append(1 if i < len(spans) and end > spans[i][0] else 0)
+    return mask
+
+
+def encode_rows(lines: List[bytes], tokenizer: Any, max_seq_length: int) -> Tuple[pa.Table, int]:
+    """Template and tokenize one shard's rows. Returns (table, skipped rows)."""
+    texts = []
+    spans = []
+    weights = []
+    keys = []
+    skipped = 0
+    for line in lines:
+        try:
+            row = json.loads(line)
+            messages = row.get("messages")
+            weight = row.get("weight")
+            weight = 1.0 if weight is None else float(weight)
+        except (ValueError, TypeError, AttributeError):
+            messages = None
+        if not messages:
+            skipped += 1
+            continue
+        weights.append(weight)
+        keys.append(row_key(line))
+        text = tokenizer.apply_chat_template(messages, tokenize=False)
+        texts.append(text)
+        spans.append(assistant_spans(tokenizer, messages, text))
+    # The template already carries BOS/special tokens. Offsets need a fast
+    # tokenizer; without them every token is trained on
+    offsets_ok = getattr(tokenizer, "is_fast", False)
+    encoded = tokenizer(
+        texts,
+        add_special_tokens=False,
+        truncation=True,
+        max_length=max_seq_length,
+        return_offsets_mapping=offsets_ok,
+    ) if texts else {"input_ids": []}
+    input_ids = encoded["input_ids"]
+    if offsets_ok:
+        masks = [span_mask(offsets, row_spans) for offsets, row_spans in zip(encoded["offset_mapping"], spans)]
+    else:
+        masks = [[1] * len(ids) for ids in input_ids]
+    table = pa.table(
+        {
+            "text": texts,
+            "input_ids": input_ids,
+            "assistant_mask": masks,
+            "length": [len(ids) for ids in input_ids],
+            "weight": weights,
+            "row_key": keys,
+        },
+        schema=SHARD_SCHEMA,
+    )
+    return table, skipped
+
+
+def write_shard(path: Path, table: pa.Table) -> None:
+    # Arrow stream format is what datasets.Dataset.from_file memory-maps
+    tmp = path.with_suffix(".tmp")
+    with pa.OSFile(str(tmp), "wb") as sink:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=1000)
+    os.replace(tmp, path)
+
+
+def build_shards(
+    data_file: str,
+    tokenizer: Any,
+    max_seq_length: int,
+    shards_dir: str = SFT_SHARDS_DIR,
+    shard_rows: int = SFT_SHARD_ROWS,
+) -> Dict[str, Any]:
+    """
+    Make sure every shard of data_file exists for this tokenizer and write a manifest.
+
+    Existing shards are reused as-is; only new shards are tokenized. Returns the
+    manifest: {"tokenizer_key", "source", "created_at", "rows", "tokens",
+    "skipped", "built", "reused", "shards": [{"key", "rows", "tokens"}], "path"}.
+    """
+    tok_key = tokenizer_key(tokenizer, max_seq_length)
+    root = shard_root(tok_key, shards_dir)
+    (root / "shards").mkdir(parents=True, exist_ok=True)
+    (root / "manifests").mkdir(parents=True, exist_ok=True)
+
+    shards = []
+    built = reused = skipped = 0
+    dataset_hash = hashlib.blake2b(digest_size=8)
+    for key, lines in iter_chunks(data_file, shard_rows):
+        dataset_hash.update(key.encode("ascii"))
+        path = root / "shards" / f"{key}.arrow"
+        if path.exists():
+            with pa.memory_map(str(path)) as source:
+                lengths = pa.ipc.open_stream(source).read_all().column("length")
+            rows, tokens = len(lengths), pc.sum(lengths).as_py() or 0
+            reused += 1
+        else:
+            table, bad = encode_rows(lines, tokenizer, max_seq_length)
+            write_shard(path, table)
+            rows, tokens = table.num_rows, sum(table.column("length").to_pylist())
+            skipped += bad
+            built += 1
+        shards.append({"key": key, "rows": rows, "tokens": tokens})
+
+    manifest_path = root / "manifests" / f"{dataset_hash.hexdigest()}.json"
+    manifest = {
+        "format": SHARD_FORMAT_VERSION,
+        "tokenizer_key": tok_key,
+        "max_seq_length": max_seq_length,
+        "source": str(data_file),
+        "created_at": datetime.now().isoformat(),
+        "rows": sum(s["rows"] for s in shards),
+        "tokens": sum(s["tokens"] for s in shards),
+        "skipped": skipped,
+        "built": built,
+        "reused": reused,
+        "shards": shards,
+    }
+    tmp = manifest_path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, manifest_path)
+    manifest["path"] = str(manifest_path)
+    return manifest
+
+
+def load_shards(manifest: Dict[str, Any], shards_dir: str = SFT_SHARDS_DIR):
+    """Memory-map a manifest's shards as one datasets.Dataset (nothing is copied)."""
+    from datasets import Dataset, concatenate_datasets
+
+    root = shard_root(manifest["tokenizer_key"], shards_dir)
+    parts = [
+        Dataset.from_file(str(root / "shards" / f"{s['key']}.arrow"))
+        for s in manifest["shards"]
+        if s["rows"]
+    ]
+    if not parts:
+        raise ValueError(f"No usable rows in {manifest['source']}")
+    return concatenate_datasets(parts)
+
+
+def prune_shards(tok_key: str, keep: int = 7, shards_dir: str = SFT_SHARDS_DIR) -> int:
+    """Delete manifests beyond the newest `keep` and shards none of the kept ones use."""
+    root = shard_root(tok_key, shards_dir)
+    manifests = sorted((root / "manifests").glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    live = set()
+    for path in manifests[:keep]:
+        with open(path, "r", encoding="utf-8") as f:
+            live.update(s["key"] for s in json.load(f)["shards"])
+    for path in manifests[keep:]:
+        path.unlink()
+    removed = 0
+    for path in (root / "shards").glob("*.arrow"):
+        if path.stem not in live:
+            path.unlink()
+            removed += 1
+    return removed
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Self-contained checks for embedding_index.py: save/load round trips
+(float32 and int8), incremental add/remove, IVF search and versioned saves.
+
+No server, database or embedding model needed:
+    python test_embedding_index.py     (or: python -m pytest test_embedding_index.py)
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from embedding_index import EmbeddingIndex
+
+
+DIM = 32
+
+
+def build(index_dir, dtype="float32", docs=200, seed=0):
+    rng = np.random.default_rng(seed)
+    index = EmbeddingIndex(index_dir, dim=DIM, dtype=dtype)
+    vectors = {}
+    for kb_id in range(docs):
+        vectors[kb_id] = rng.normal(size=(2, DIM)).astype(np.float32)
+        index.add(kb_id, [0, 1], vectors[kb_id], content_hash=f"h{kb_id}")
+    index.save()
+    return index, vectors
+
+
+def test_float32_round_trip_finds_exact_vector():
+    with tempfile.TemporaryDirectory() as tmp:
+        _, vectors = build(tmp)
+        loaded = EmbeddingIndex.load(tmp)
+        assert len(loaded) == 400
+        hit = loaded.search(vectors[17][1], k=1)[0]
+        assert (hit["kb_id"], hit["chunk_index"]) == (17, 1)
+        assert abs(hit["score"] - 1.0) < 1e-5
+        assert loaded.docs["17"] == "h17"
+
+
+def test_int8_round_trip_keeps_ranking():
+    with tempfile.TemporaryDirectory() as tmp:
+        _, vectors = build(tmp, dtype="int8")
+        loaded = EmbeddingIndex.load(tmp)
+        assert loaded.dtype == "int8"
+        hit = loaded.search(vectors[42][0], k=1)[0]
+        assert (hit["kb_id"], hit["chunk_index"]) == (42, 0)
+        assert hit["score"] > 0.98
+
+
+def test_add_replaces_and_remove_drops_rows():
+    with tempfile.TemporaryDirectory() as tmp:
+        index, vectors = build(tmp)
+        index.remove(5)
+        replacement = np.ones((1, DIM), dtype=np.float32)
+        index.add(6, [0], replacement)
+        index.save()
+        loaded = EmbeddingIndex.load(tmp)
+        assert len(loaded) == 397
+        assert all(hit["kb_id"] != 5 for hit in loaded.search(vectors[5][0], k=10))
+        assert loaded.search(replacement[0], k=1)[0]["kb_id"] == 6
+        assert "5" not in loaded.docs
+
+
+def test_ivf_search_with_all_lists_matches_brute_force():
+    with tempfile.TemporaryDirectory() as tmp:
+        index, vectors = build(tmp)
+        brute = [h["kb_id"] for h in EmbeddingIndex.load(tmp).search(vectors[3][0], k=5)]
+        index.build_ivf(8)
+        loaded = EmbeddingIndex.load(tmp)
+        assert loaded.centroids is not None
+        assert [h["kb_id"] for h in loaded.search(vectors[3][0], k=5, nprobe=8)] == brute
+        assert loaded.search(vectors[3][0], k=1, nprobe=1)[0]["kb_id"] == 3
+
+
+def test_saves_go_to_new_version_dirs():
+    with tempfile.TemporaryDirectory() as tmp:
+        index, _ = build(tmp)
+        reader = EmbeddingIndex.load(tmp)  # keeps the first version mapped
+        for kb_id in (500, 501):
+            index.add(kb_id, [0], np.ones((1, DIM), dtype=np.float32))
+            index.save()
+        versions = sorted(name for name in os.listdir(tmp) if name.startswith("v"))
+        assert len(versions) == 2  # current + previous; older ones pruned
+        assert len(EmbeddingIndex.load(tmp)) == 402
+        assert len(reader.search(np.ones(DIM), k=3)) == 3
+
+
+def main():
+    tests = [value for name, value in globals().items() if name.startswith("test_")]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n✨ {len(tests)} embedding index checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Self-contained checks for kb_chunking.py (slide markers and word windows).
+
+No server or database needed:
+    python test_kb_chunking.py     (or: python -m pytest test_kb_chunking.py)
+"""
+
+from kb_chunking import chunk_document, passage_id, split_slides
+
+
+def words(prefix, n):
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+
+def test_split_slides_markers_and_preamble():
+    content = "Intro text\n--- Slide 1 ---\nFirst\n• -- Slide 2 ---\nSecond\n--- Slide 3 ---\n   \n"
+    assert split_slides(content) == [(0, "Intro text"), (1, "First"), (2, "Second")]
+    assert split_slides("no markers here") == [(0, "no markers here")]
+    assert split_slides("   ") == []
+
+
+def test_small_slides_are_merged_up_to_max_words():
+    content = "\n".join(f"--- Slide {n} ---\n{words(f's{n}_', 30)}" for n in range(1, 6))
+    chunks = chunk_document(content, max_words=100, overlap_words=10)
+    assert [(c["slide_start"], c["slide_end"]) for c in chunks] == [(1, 3), (4, 5)]
+    assert all(len(c["text"].split()) <= 100 for c in chunks)
+    assert [c["chunk_index"] for c in chunks] == [0, 1]
+
+
+def test_long_slide_is_windowed_with_overlap():
+    text = words("w", 250)
+    chunks = chunk_document(f"--- Slide 7 ---\n{text}", max_words=100, overlap_words=20)
+    windows = [c["text"].split() for c in chunks]
+    assert [len(w) for w in windows] == [100, 100, 90]
+    assert windows[0][-20:] == windows[1][:20]
+    assert windows[-1][-1] == "w249"
+    assert {(c["slide_start"], c["slide_end"]) for c in chunks} == {(7, 7)}
+
+
+def test_chunk_hash_is_stable_and_ids_are_kb_scoped():
+    first = chunk_document(words("x", 50))
+    assert first == chunk_document(words("x", 50))
+    assert first[0]["chunk_hash"] != chunk_document(words("y", 50))[0]["chunk_hash"]
+    assert chunk_document("") == []
+    assert passage_id(12, 3) == "12:3"
+
+
+def main():
+    tests = [value for name, value in globals().items() if name.startswith("test_")]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n✨ {len(tests)} chunking checks passed")
+
+
+if __name__ == "__main__":
+    main()
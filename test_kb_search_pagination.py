@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test script for /kb/search keyset pagination over tied ranks.
+
+Creates a batch of KB items that all match one marker word exactly once in
+their content, so every hit has the same ts_rank. Paging through them with a
+small limit must return each item exactly once, ordered by id descending.
+Requires the API server (uvicorn app.main:app) against a Postgres database.
+"""
+
+import os
+import uuid
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+TIED_ITEMS = 11
+PAGE_SIZE = 3
+
+
+def create_tied_items(marker):
+    ids = []
+    for i in range(TIED_ITEMS):
+        response = requests.post(f"{BASE_URL}/kb", json={
+            "title": f"Pagination tie test {i}",
+            "content": f"{marker} entry number {i}",
+            "category": "test",
+            "created_by": "test_kb_search_pagination",
+        })
+        response.raise_for_status()
+        ids.append(response.json()["id"])
+    return ids
+
+
+def page_through(marker):
+    seen = []
+    cursor = None
+    while True:
+        params = {"q": marker, "limit": PAGE_SIZE}
+        if cursor:
+            params["cursor"] = cursor
+        response = requests.get(f"{BASE_URL}/kb/search", params=params)
+        response.raise_for_status()
+        data = response.json()
+        seen.extend(item["id"] for item in data["items"])
+        cursor = data["next_cursor"]
+        if not cursor:
+            return seen
+
+
+def test_search_pagination_with_ties():
+    """Tied ranks must neither skip nor repeat rows across pages."""
+    print("🔍 Testing /kb/search pagination over tied ranks...")
+    marker = f"tie{uuid.uuid4().hex[:12]}"
+    ids = create_tied_items(marker)
+    try:
+        seen = page_through(marker)
+        assert len(seen) == len(set(seen)), f"Repeated rows across pages: {seen}"
+        assert seen == sorted(ids, reverse=True), f"Expected {sorted(ids, reverse=True)}, got {seen}"
+        print(f"✅ {len(seen)} tied rows returned exactly once over {-(-len(seen) // PAGE_SIZE)} pages")
+    finally:
+        for item_id in ids:
+            requests.delete(f"{BASE_URL}/kb/{item_id}")
+
+
+def test_invalid_cursor():
+    """A malformed or tampered cursor is a 400, not a 500."""
+    print("🔍 Testing invalid cursors...")
+    for cursor in ("not-base64!", "e30=", "eyJyYW5rIjogIngifQ=="):  # garbage, {}, {"rank": "x"}
+        for path, params in (("/kb/search", {"q": "x"}), ("/kb", {})):
+            response = requests.get(f"{BASE_URL}{path}", params={**params, "cursor": cursor})
+            assert response.status_code == 400, f"{path} cursor={cursor}: {response.status_code}"
+    print("✅ Invalid cursors rejected with 400")
+
+
+def main():
+    test_search_pagination_with_ties()
+    test_invalid_cursor()
+
+
+if __name__ == "__main__":
+    main()
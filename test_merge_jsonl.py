@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Self-contained checks for the streaming dedup merge of the daily SFT sources
+(merge_jsonl_sources in scripts/agent_daily_training.py), in both the
+single-pass and the hash-partitioned mode.
+
+No server or database needed:
+    python test_merge_jsonl.py     (or: python -m pytest test_merge_jsonl.py)
+"""
+
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+
+from agent_daily_training import merge_jsonl_sources  # noqa: E402
+
+
+def make_line(i):
+    return json.dumps({"messages": [{"role": "user", "content": f"q{i}"}, {"role": "assistant", "content": f"a{i}"}]})
+
+
+def write_sources(tmp):
+    chat = Path(tmp) / "chat.jsonl"
+    kb = Path(tmp) / "kb.jsonl"
+    chat.write_text("\n".join([make_line(i) for i in range(100)] + [make_line(5), "not json", ""]) + "\n")
+    # 50..149: half overlap with chat, plus a within-file duplicate and a brace-only invalid row
+    kb.write_text("\n".join([make_line(i) for i in range(50, 150)] + [make_line(149), "{broken"]) + "\n")
+    return [("chat", chat), ("kb", kb), ("missing", Path(tmp) / "missing.jsonl")]
+
+
+def check_merge(partition_bytes, validate="brace"):
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = write_sources(tmp)
+        output = Path(tmp) / "out" / "merged.jsonl"
+        stats = merge_jsonl_sources(sources, output, partition_bytes=partition_bytes, validate=validate)
+        lines = output.read_text().splitlines()
+        leftovers = [p.name for p in output.parent.iterdir() if p.name != "merged.jsonl"]
+
+    assert sorted(lines) == sorted(make_line(i) for i in range(150))
+    assert stats["written"] == 150
+    assert stats["sources"]["chat"] == {"read": 102, "written": 100, "duplicates": 1, "invalid": 1}
+    assert stats["sources"]["kb"] == {"read": 102, "written": 50, "duplicates": 51, "invalid": 1}
+    assert stats["sources"]["missing"]["read"] == 0
+    assert leftovers == []  # temp and partition files are cleaned up
+    return stats, lines
+
+
+def test_single_pass_keeps_first_occurrence_order():
+    stats, lines = check_merge(partition_bytes=1 << 30)
+    assert stats["partitions"] == 1
+    assert lines == [make_line(i) for i in range(150)]
+
+
+def test_partitioned_merge_matches_single_pass():
+    stats, _ = check_merge(partition_bytes=2048)
+    assert stats["partitions"] > 1
+
+
+def test_json_validation_rejects_non_objects():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "a.jsonl"
+        source.write_text('{"a": 1}\n{"a": 1,}\n{"b": 2}\n')
+        output = Path(tmp) / "merged.jsonl"
+        stats = merge_jsonl_sources([("a", source)], output, validate="json")
+        assert output.read_text().splitlines() == ['{"a": 1}', '{"b": 2}']
+    assert stats["invalid"] == 1
+
+
+def test_output_may_be_a_source():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "latest.jsonl"
+        path.write_text(make_line(1) + "\n" + make_line(1) + "\n")
+        merge_jsonl_sources([("latest", path)], path)
+        assert path.read_text().splitlines() == [make_line(1)]
+
+
+def main():
+    tests = [value for name, value in globals().items() if name.startswith("test_")]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n✨ {len(tests)} merge checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Self-contained checks for near_dup.py (MinHash + LSH near-duplicate detection).
+
+No server or database needed:
+    python test_near_dup.py     (or: python -m pytest test_near_dup.py)
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from near_dup import NearDuplicateIndex, cluster_near_duplicates, jaccard_estimate, minhash_signature, shingles
+
+
+BASE = " ".join(f"word{i}" for i in range(300))
+# Same deck re-exported with a different footer: ~97% of shingles shared
+VARIANT = BASE + " exported by hannah slides v2"
+OTHER = " ".join(f"other{i}" for i in range(300))
+
+
+def test_signature_is_deterministic():
+    assert np.array_equal(minhash_signature(BASE), minhash_signature(BASE))
+    assert jaccard_estimate(minhash_signature(BASE), minhash_signature(BASE)) == 1.0
+    # Case and punctuation do not change the shingles
+    assert shingles("Hello, World!") == shingles("hello world")
+
+
+def test_similarity_estimate():
+    assert jaccard_estimate(minhash_signature(BASE), minhash_signature(VARIANT)) >= 0.9
+    assert jaccard_estimate(minhash_signature(BASE), minhash_signature(OTHER)) <= 0.1
+
+
+def test_index_query_insert_remove():
+    index = NearDuplicateIndex(threshold=0.8)
+    index.insert(1, minhash_signature(BASE))
+    index.insert(2, minhash_signature(OTHER))
+
+    matches = index.query(minhash_signature(VARIANT))
+    assert [key for key, _ in matches] == [1]
+    assert index.query(minhash_signature(VARIANT), exclude=(1,)) == []
+
+    index.remove(1)
+    assert index.query(minhash_signature(VARIANT)) == []
+    assert len(index) == 1
+
+
+def test_index_save_load_round_trip():
+    index = NearDuplicateIndex(threshold=0.8)
+    index.insert(7, minhash_signature(BASE))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "near_dup.pkl")
+        index.save(path)
+        loaded = NearDuplicateIndex.load(path)
+    assert loaded.threshold == 0.8
+    assert [key for key, _ in loaded.query(minhash_signature(VARIANT))] == [7]
+
+
+def test_clusters_are_transitive_with_oldest_canonical():
+    docs = [(3, VARIANT), (1, BASE), (2, OTHER), (4, VARIANT + " again")]
+    clusters, index = cluster_near_duplicates(docs, threshold=0.8)
+    assert len(clusters) == 1
+    assert clusters[0]["canonical"] == 1
+    assert clusters[0]["members"] == [1, 3, 4]
+    assert len(index) == 4
+
+
+def test_clusters_longest_canonical():
+    clusters, _ = cluster_near_duplicates([(1, BASE), (2, VARIANT)], threshold=0.8, canonical="longest")
+    assert clusters[0]["canonical"] == 2
+
+
+def main():
+    tests = [value for name, value in globals().items() if name.startswith("test_")]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n✨ {len(tests)} near-dup checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Self-contained checks for sft_packing.py: bin packing, weighted sampling and
+the collator's labels, position_ids and block-diagonal attention mask.
+
+Needs the training dependencies (torch, transformers), no GPU or model:
+    python test_sft_packing.py     (or: python -m pytest test_sft_packing.py)
+"""
+
+import random
+
+import torch
+
+from sft_packing import IGNORE_INDEX, SFTCollator, pack_by_length, weighted_subset
+
+
+def row(ids, mask, weight=1.0):
+    return {"input_ids": list(ids), "assistant_mask": list(mask), "length": len(ids), "weight": weight}
+
+
+def test_pack_by_length_fits_and_covers_every_row():
+    rng = random.Random(0)
+    lengths = [rng.randint(1, 900) for _ in range(500)]
+    bins = pack_by_length(lengths, 1024)
+    packed = sorted(i for b in bins for i in b)
+    assert packed == list(range(len(lengths)))
+    assert all(sum(lengths[i] for i in b) <= 1024 for b in bins)
+    # Best-fit decreasing stays close to the lower bound
+    assert len(bins) <= sum(lengths) / 1024 * 1.1 + 1
+
+
+def test_pack_by_length_oversized_row_gets_own_bin():
+    bins = pack_by_length([5000, 10, 20], 1024)
+    assert [0] in bins
+    assert sorted(i for b in bins for i in b) == [0, 1, 2]
+
+
+def test_weighted_subset():
+    weights = [1.0] * 50 + [0.0] * 50
+    keep = weighted_subset(weights, 0.3, seed=1)
+    assert len(keep) == 30
+    assert keep == sorted(keep)
+    assert all(i < 50 for i in keep)  # weight 0 is never kept
+    assert weighted_subset(weights, 0.3, seed=1) == keep
+    assert weighted_subset(weights, 0.3, seed=2) != keep
+
+
+def test_bucketed_labels_and_padding():
+    collator = SFTCollator(pad_token_id=0, max_len=16, dtype=torch.float32)
+    batch = collator([row([5, 6, 7, 8], [0, 0, 1, 1]), row([9, 10], [1, 1])])
+    # Prompt tokens, the first token and padding are never supervised
+    assert batch["labels"].tolist() == [[IGNORE_INDEX, IGNORE_INDEX, 7, 8], [IGNORE_INDEX, 10, IGNORE_INDEX, IGNORE_INDEX]]
+    assert batch["input_ids"].tolist()[1] == [9, 10, 0, 0]
+    assert batch["attention_mask"].tolist() == [[1, 1, 1, 1], [1, 1, 0, 0]]
+    assert "loss_weights" not in batch
+    assert (collator.tokens, collator.supervised_tokens, collator.slots) == (6, 3, 8)
+
+
+def test_packed_positions_and_block_diagonal_mask():
+    collator = SFTCollator(pad_token_id=0, max_len=8, dtype=torch.float32, weighted=True)
+    first, second = row([1, 2, 3], [1, 1, 1], weight=0.5), row([4, 5], [0, 1], weight=2.0)
+    batch = collator([{"segments": [first, second]}, {"segments": [row([6], [1])]}])
+
+    assert batch["position_ids"].tolist()[0] == [0, 1, 2, 0, 1]
+    # Each row's first token is unsupervised, so nothing is predicted across the boundary
+    assert batch["labels"].tolist()[0] == [IGNORE_INDEX, 2, 3, IGNORE_INDEX, 5]
+    assert batch["loss_weights"].tolist()[0] == [0.5, 0.5, 0.5, 2.0, 2.0]
+
+    mask = batch["attention_mask"]
+    assert mask.shape == (2, 1, 5, 5)
+    allowed = (mask[0, 0] == 0).int().tolist()
+    assert allowed == [
+        [1, 0, 0, 0, 0],
+        [1, 1, 0, 0, 0],
+        [1, 1, 1, 0, 0],
+        [0, 0, 0, 1, 0],
+        [0, 0, 0, 1, 1],
+    ]
+    # Padding positions only attend to themselves, so softmax stays finite
+    padding = (mask[1, 0] == 0).int()
+    assert padding[1].tolist() == [0, 1, 0, 0, 0]
+
+
+def test_packed_sequence_is_truncated_to_max_len():
+    collator = SFTCollator(pad_token_id=0, max_len=4, dtype=torch.float32)
+    batch = collator([{"segments": [row([1, 2, 3], [1, 1, 1]), row([4, 5, 6], [1, 1, 1])]}])
+    assert batch["input_ids"].tolist() == [[1, 2, 3, 4]]
+    assert batch["position_ids"].tolist() == [[0, 1, 2, 0]]
+
+
+def main():
+    tests = [value for name, value in globals().items() if name.startswith("test_")]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n✨ {len(tests)} packing checks passed")
+
+
+if __name__ == "__main__":
+    main()
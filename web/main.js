@@ -16,6 +16,37 @@ async function getJson(url) {
     return resp.json();
 }
 
+// POST and read a Server-Sent Events response, calling onEvent(event, data) per message.
+async function postSse(path, body, onEvent) {
+    const resp = await fetch(`${apiBase}${path}`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json", "Accept": "text/event-stream" },
+        body: JSON.stringify(body),
+    });
+    if (!resp.ok) throw new Error(await resp.text());
+
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while ((sep = buffer.indexOf("\n\n")) !== -1) {
+            const raw = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            let event = "message";
+            let data = "";
+            raw.split("\n").forEach(line => {
+                if (line.startsWith("event:")) event = line.slice(6).trim();
+                else if (line.startsWith("data:")) data += line.slice(5).trim();
+            });
+            if (data) onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
 document.getElementById("sendBtn").addEventListener("click", async () => {
     const user_id = document.getElementById("userId").value || "demo-user";
     const session_id = document.getElementById("sessionId").value || null;
@@ -24,10 +55,18 @@ document.getElementById("sendBtn").addEventListener("click", async () => {
 
     const out = document.getElementById("answer");
     out.textContent = "Đang gửi...";
+    let answer = "";
     try {
-        const data = await postJson("/chat", { user_id, session_id, temperature, message });
-        out.textContent = `#${data.history_id}:\n\n` + data.answer;
-        document.getElementById("historyId").value = data.history_id;
+        await postSse("/chat/stream", { user_id, session_id, temperature, message }, (event, data) => {
+            if (event === "error") throw new Error(data.detail);
+            if (event === "done") {
+                out.textContent = `#${data.history_id}:\n\n` + answer;
+                document.getElementById("historyId").value = data.history_id;
+                return;
+            }
+            answer += data.delta;
+            out.textContent = answer;
+        });
     } catch (e) {
         out.textContent = "Lỗi: " + e.message;
     }
@@ -51,9 +90,9 @@ document.getElementById("kbSearchBtn").addEventListener("click", async () => {
     const list = document.getElementById("kbResults");
     list.innerHTML = "<li>Đang tìm...</li>";
     try {
-        const data = await getJson(`/kb/search?q=${q}`);
+        const data = await getJson(`/kb/search?q=${encodeURIComponent(q)}&fuzzy=true`);
         list.innerHTML = "";
-        data.forEach(item => {
+        data.items.forEach(item => {
             const li = document.createElement("li");
             li.textContent = `${item.id} - ${item.title}`;
             list.appendChild(li);